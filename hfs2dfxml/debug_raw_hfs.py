@@ -7,8 +7,10 @@ import Objects as DFXML
 # When you don't have the actual disk image to check against
 
 # Read in raw hfsutils output
+# NOTE To replay every hfsutils command (hls, hcopy, ...), not just
+#      the hls listing, see hfs_replay and tests/hfs2dfxml_bench.py
 with open('DEBUG_hfs2dfxml.txt', 'r') as dbg:
-    dbg = dbg.read().decode('unicode-escape').encode('macroman')
+    dbg = dbg.read()
     dbg = dbg.strip('\n') # Remove last erroneous linebreak in debug file
     dbg_volobj = DFXML.VolumeObject()
     dbg_volobj.ftype_str = 'HFS'
@@ -18,7 +20,11 @@ with open('DEBUG_hfs2dfxml.txt', 'r') as dbg:
     dbg_moddict = hfs2dfxml._parse_hls_mod(dbg)
     dbg_linedicts = hfs2dfxml._parse_hls_cre(dbg, dbg_moddict, False)
     for dbg_linedict in dbg_linedicts:
-        dbg_volobj.append(hfs2dfxml._line_to_dfxml(dbg_linedict))
+        dbg_datafork, dbg_rsrcfork = hfs2dfxml._line_to_dfxml(dbg_linedict,
+                                                              'classic')
+        dbg_volobj.append(dbg_datafork)
+        if dbg_rsrcfork is not None:
+            dbg_volobj.append(dbg_rsrcfork)
     DFXML_root = DFXML.DFXMLObject(version='1.0', dc={'type': 'Disk Image'})
     DFXML_root.append(dbg_volobj)
     with open('DEBUG_Output.xml', 'w') as dbgout:
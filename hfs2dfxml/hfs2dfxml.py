@@ -10,35 +10,137 @@
 
 __version__ = '0.1.2'
 
+import io
 import os
 import sys
+import json
+import shutil
 import subprocess
 import re
+import signal
 import tempfile
+import time
 import magic
 import argparse
 import xml.etree.ElementTree as ET
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import Future
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import wait
 from datetime import datetime
-from hashlib import md5
-from hashlib import sha1
+from functools import lru_cache
 
 # Import Python DFXML Bindings
 #sys.path.append('dfxml/python')
 import Objects as DFXML
+import hfs_native
+import hfs_baseline
+import hfs_cache
+import hfs_dedup
+import hfs_digests
+import hfs_index
+import hfs_journal
+import hfs_stats
+import hfs_triage
+import hfs_writer
 
 
-PATTERNFILE = re.compile('^(\d+)\s+(\w+)\s+(.{4}/.{4})\s+(\d+)\s+(\d+)\s+(\w{3}\s{1,2}\d{1,2}\s{1,2}\d{2}:{0,1}\d{2})\s(".*")(\**)$')
-PATTERNDIR = re.compile('^(\d+)\s+(\w+)\s+(\d+\sitems*)\s+(\w{3}\s{1,2}\d{1,2}\s{1,2}\d{2}:{0,1}\d{2})\s(".*"):$')
+PATTERNFILE = re.compile(r'^(\d+)\s+(\w+)\s+(.{4}/.{4})\s+(\d+)\s+(\d+)\s+(\w{3}\s{1,2}\d{1,2}\s{1,2}\d{2}:{0,1}\d{2})\s(".*")(\**)$')
+PATTERNDIR = re.compile(r'^(\d+)\s+(\w+)\s+(\d+\sitems*)\s+(\w{3}\s{1,2}\d{1,2}\s{1,2}\d{2}:{0,1}\d{2})\s(".*"):$')
 
 DEBUG = False
+_hfsutils = subprocess  # Runs hfsutils commands (see hfs_replay)
+_spawned = {}  # Subprocesses spawned by this process, by command
+# Bytes from the start of a fork (or image) given to libmagic. libmagic
+# reads up to its bytes_max parameter of a whole file (1 MiB or more,
+# by version), so types it identifies past MAGIC_BYTES may differ from
+# those of magic.from_file on the fork.
+MAGIC_BYTES = 1024 * 1024
+TRIAGE_CHUNK = 64  # Images handed to a triage worker at a time
+DAEMON_POLL = 1.0  # Seconds between scans of the spool directory
+DAEMON_STATES = ('incoming', 'running', 'done', 'failed')  # Spool subdirs
+OPTION_DEFAULTS = {'reader': 'native', 'hashing': 'image', 'jobs': 1,
+                   'cache_path': None, 'cache_size': hfs_cache.MAX_ENTRIES,
+                   'magic': True, 'digests': hfs_digests.DEFAULT_DIGESTS,
+                   'resume': False, 'baseline_path': None,
+                   'differential': False, 'index_path': None,
+                   'dedup_path': None, 'strict': False, 'check': False}
 
+
+class HFSOptions(object):
+    # Options of a run, shared by every volume and image it reads, and
+    # passed whole instead of one argument per option. Takes keyword
+    # arguments named after the attributes; others take OPTION_DEFAULTS.
+    # reader: 'native' reads the catalog from the image, 'hfsutils'
+    #     parses hls output.
+    # hashing: 'image' reads fork extents from the image (native reader
+    #     only), 'hcopy' copies each file out with hcopy.
+    # jobs: hashing worker processes; partitions, or images in batch and
+    #     daemon mode, read at once.
+    # cache_path, cache_size: hash cache (None for none; see hfs_cache).
+    # magic: whether to identify file types with libmagic.
+    # digests: names of the digests to compute (see hfs_digests.DIGESTS).
+    # resume: whether to resume from checkpoint journals (hfs_journal).
+    # baseline_path, differential: DFXML of an earlier run to compare
+    #     with, and whether to write only differences (hfs_baseline).
+    # index_path: catalog index to write (None for none; hfs_index).
+    # dedup_path: dedup store to use (None for none; see hfs_dedup).
+    # strict, check: whether to indent the DFXML, and check each
+    #     fileobject, as it is written (see hfs_writer).
+    __slots__ = tuple(OPTION_DEFAULTS)
+
+    def __init__(self, **kwargs):
+        for _option, _default in OPTION_DEFAULTS.items():
+            setattr(self, _option, kwargs.pop(_option, _default))
+        if kwargs:
+            sys.exit('HFSOptions error: Unknown options: ' +
+                     '{0}.'.format(', '.join(sorted(kwargs))))
+        if self.differential and self.baseline_path is None:
+            sys.exit('HFSOptions error: differential requires ' +
+                     'baseline_path (DFXML to compare with).')
+
+    def replace(self, **kwargs):
+        # Returns a copy with the given options changed.
+        _options = {_option: getattr(self, _option)
+                    for _option in self.__slots__}
+        _options.update(kwargs)
+        return HFSOptions(**_options)
+
+
+@lru_cache(maxsize=65536)
 def _reformat_date(unformatted):
     # Reformats dates found in hls output for comparisons.
+    # NOTE: Memoized; a volume has few distinct date strings, and
+    #       datetime objects are immutable so they can be shared.
     reformat = unformatted.replace('  ', ' ')
     reformat = datetime.strptime(reformat, '%b %d %Y')
     return reformat
 
 
+def _match_hls_line(hls_line):
+    # Takes a stripped line of hls output.
+    # Returns tuple (match for PATTERNFILE, match for PATTERNDIR); at most
+    # one is not None. Only directory lines end with a colon (hls -F) and
+    # file lines cannot, so each line is matched against one pattern only.
+    if hls_line.endswith(':'):
+        return None, PATTERNDIR.match(hls_line)
+    return PATTERNFILE.match(hls_line), None
+
+
+def _count_subprocess(command):
+    # Counts a subprocess about to be spawned (see _take_spawned).
+    _spawned[command] = _spawned.get(command, 0) + 1
+
+
+def _take_spawned():
+    # Returns dict of command: subprocesses spawned by this process
+    # since the last call.
+    global _spawned
+    spawned, _spawned = _spawned, {}
+    return spawned
+
+
 def _format_hcopy_name(prehcopy):
     # Takes a filename and prepares it for use in hcopy.
     # Takes all non-ascii chars and converts to ?
@@ -49,19 +151,33 @@ def _format_hcopy_name(prehcopy):
 def _call_humount(report_err=False):
     # Calls humount; optionally reports any errors (e.g., volume is
     # already mounted).
+    _count_subprocess('humount')
     try:
-        subprocess.check_call(['humount'], stderr=subprocess.STDOUT)
+        _hfsutils.check_call(['humount'], stderr=subprocess.STDOUT)
     except subprocess.CalledProcessError as e:
         if report_err:
             print('_call_humount error: {0}'.format(e.output))
 
 
-def _call_hmount(hfsfilename):
-    # Calls hmount with path to HFS volume. Returns output of command,
-    # which includes volume name and other information.
+def _uses_hfsutils(hfs_options):
+    # Takes HFSOptions of a run.
+    # Returns True if the run mounts volumes with hfsutils (to list or
+    # to copy files), and so needs humount beforehand.
+    return hfs_options.reader != 'native' or hfs_options.hashing == 'hcopy'
+
+
+def _call_hmount(hfsfilename, partition_number=None):
+    # Calls hmount with path to HFS volume, and number of the partition
+    # to mount if the image has a partition map (hmount mounts the first
+    # HFS partition otherwise). Returns output of command, which
+    # includes volume name and other information.
+    _count_subprocess('hmount')
+    hmount_args = ['hmount', hfsfilename]
+    if partition_number is not None:
+        hmount_args.append(str(partition_number))
     try:
-        hmount_output = subprocess.check_output(['hmount', hfsfilename],
-                                                stderr=subprocess.STDOUT)
+        hmount_output = _hfsutils.check_output(hmount_args,
+                                               stderr=subprocess.STDOUT)
         try:
             hmount_output = hmount_output.decode('utf-8')
         except:
@@ -73,55 +189,82 @@ def _call_hmount(hfsfilename):
     return hmount_output
 
 
-def _call_hls():
-    # Calls hls twice to obtain output for generating fileobjects
-    # Returns output of command unformatted.
+def _popen_hls(hls_args):
+    # Starts hls with the given arguments: '-1acilQRUFN' to list by
+    # creation date, '-1amilQRUFN' by modification date.
+    # Returns tuple (Popen, its output decoded line by line as macroman),
+    # so the listing is parsed as hls writes it, never held whole.
+    # NOTE: hls arguments (from man page)
+    # The order listed is to ensure consistent formatting for parsing.
+    # -1 Output is formatted so entry appears on a single line.
+    # -a All files and directories and "invisible" files are shown.
+    # -c Sort and display by creation date (hls_cre_output only)
+    # -m Sort and display by modification date (hls_mod_output only)
+    # -i Show catalog IDs for each entry.
+    # -l Display entries in long format, including entry type,
+    #    flags, file type and reator, resource bytes, data bytes,
+    #    date of creation or modification, and pathname.
+    # -Q Cause all filenames to be enclosed in double-quotes and
+    #    special/non-printable characters to be properly escaped.
+    # -R Recursively descent into and display each directory contents.
+    # -U Do not sort directory contents
+    # -F Cause certain output filenames to be followed by
+    #    a single-character flag (e.g., colon for directories and
+    #    asterisk for applications.)
+    # -N Cause all filenames to be output verbatim without any
+    #    escaping or question mark substitution.
+    _count_subprocess('hls')
+    hls_proc = _hfsutils.Popen(['hls', hls_args], stdout=subprocess.PIPE)
+    return hls_proc, io.TextIOWrapper(hls_proc.stdout, encoding='macroman',
+                                      newline='\n')
+
+
+def _debug_tee(hls_cre_lines):
+    # Copies hls output to the DEBUG file as it is read.
+    with open('DEBUG_hfs2dfxml.txt', 'w') as debugfile:
+        for dbg in hls_cre_lines:
+            debugfile.write(dbg)
+            yield dbg
+
+
+def _stream_hls_lines(run_stats=None):
+    # Runs hls for creation and modification times (see _popen_hls)
+    # concurrently, in one pass over the catalog, and joins the two
+    # listings by CNID while they are being read.
+    # Yields HFSEntry, as _parse_hls_cre does (without hashes).
+    # Takes optional RunStats; waiting for hls output is timed as 'hls',
+    # parsing and joining the listings as 'parse'.
+    hls_cre_proc, hls_cre_lines = _popen_hls('-1acilQRUFN')
+    hls_mod_proc, hls_mod_lines = _popen_hls('-1amilQRUFN')
+    hls_cre_lines = hfs_stats.timed_iter(run_stats, 'hls', hls_cre_lines)
+    hls_mod_lines = hfs_stats.timed_iter(run_stats, 'hls', hls_mod_lines)
     try:
-        # NOTE: hls arguments (from man page)
-        # The order listed is to ensure consistent formatting for parsing.
-        # -1 Output is formatted so entry appears on a single line.
-        # -a All files and directories and "invisible" files are shown.
-        # -c Sort and display by creation date (hls_cre_output only)
-        # -m Sort and display by modification date (hls_mod_output only)
-        # -i Show catalog IDs for each entry.
-        # -l Display entries in long format, including entry type,
-        #    flags, file type and reator, resource bytes, data bytes,
-        #    date of creation or modification, and pathname.
-        # -Q Cause all filenames to be enclosed in double-quotes and
-        #    special/non-printable characters to be properly escaped.
-        # -R Recursively descent into and display each directory contents.
-        # -U Do not sort directory contents
-        # -F Cause certain output filenames to be followed by
-        #    a single-character flag (e.g., colon for directories and
-        #    asterisk for applications.)
-        # -N Cause all filenames to be output verbatim without any
-        #    escaping or question mark substitution.
-
-        hls_cre_output = subprocess.check_output(['hls', '-1acilQRUFN'])
-        hls_mod_output = subprocess.check_output(['hls', '-1amilQRUFN'])
-
-        # NOTE: Decode using macroman
-        hls_cre_output = hls_cre_output.decode('macroman')
-        hls_mod_output = hls_mod_output.decode('macroman')
- 
-    except subprocess.CalledProcessError as e:
-#        sys.exit('_call_hls error: {0}'.format(e.output,))
-        return (True, e)
-    if DEBUG:
-        with open('DEBUG_hfs2dfxml.txt', 'w') as debugfile:
-            _debug_output = hls_cre_output.split('\n')
-            for dbg in _debug_output:
-                debugfile.write(dbg)
-                debugfile.write('\n')
-    return (hls_cre_output, hls_mod_output)
+        if DEBUG:
+            hls_cre_lines = _debug_tee(hls_cre_lines)
+        for this_line in hfs_stats.timed_iter(run_stats, 'parse',
+                                              _parse_hls_cre(
+                                                  hls_cre_lines,
+                                                  _HLSModStream(hls_mod_lines),
+                                                  hcopy=False)):
+            yield this_line
+        for _unused in hls_mod_lines:
+            pass  # Entries missing from the creation listing are ignored
+    finally:
+        hls_cre_proc.stdout.close()
+        hls_mod_proc.stdout.close()
+        hls_cre_proc.wait()
+        hls_mod_proc.wait()
+    for hls_proc in (hls_cre_proc, hls_mod_proc):
+        if hls_proc.returncode != 0:
+            sys.exit('_stream_hls_lines error: {0} returned {1}.'.format(
+                     ' '.join(hls_proc.args), hls_proc.returncode))
 
 
-def _parse_hls_mod(hls_mod_raw):
+def _iter_hls_mod(hls_mod_raw):
     # Takes raw hls input (assumes file modification times).
-    # Returns a dictionary to correlate with additional hls output.
-    hls_mod_dict = {}
-    hls_mod_raw = hls_mod_raw.split('\n')
-    for hls_mod_line in hls_mod_raw:
+    # Yields tuple (CNID, modification date, quoted filename, line)
+    # for each entry, in listing order.
+    for hls_mod_line in _hls_lines(hls_mod_raw):
         if hls_mod_line.startswith(':'):
             continue
         elif hls_mod_line == '\n':
@@ -130,8 +273,7 @@ def _parse_hls_mod(hls_mod_raw):
             continue
 
         hls_mod_line = hls_mod_line.strip()
-        parse_file_mod = re.match(PATTERNFILE, hls_mod_line)
-        parse_dir_mod = re.match(PATTERNDIR, hls_mod_line)
+        parse_file_mod, parse_dir_mod = _match_hls_line(hls_mod_line)
 
         if parse_file_mod and not parse_dir_mod:
             mod_cnid = parse_file_mod.group(1)
@@ -147,7 +289,15 @@ def _parse_hls_mod(hls_mod_raw):
             sys.exit('_parse_hls_mod error: Unexpected line format.\n' +
                      '|{0}|'.format(hls_mod_line))
             # NOTE: Should be a logger event, probably?
+        yield mod_cnid, mod_mdate, mod_filename, hls_mod_line
+
 
+def _parse_hls_mod(hls_mod_raw):
+    # Takes raw hls input (assumes file modification times).
+    # Returns a dictionary to correlate with additional hls output.
+    hls_mod_dict = {}
+    for mod_cnid, mod_mdate, mod_filename, hls_mod_line in _iter_hls_mod(
+                                                               hls_mod_raw):
         if mod_cnid in hls_mod_dict:
             sys.exit('_parse_hls_mod error: Duplcate CNID found.\n' +
                      '|{0}|'.format(hls_mod_line))
@@ -157,96 +307,276 @@ def _parse_hls_mod(hls_mod_raw):
     return hls_mod_dict
 
 
+class _HLSModStream(object):
+    # Stands in for the _parse_hls_mod dictionary while the modification
+    # time listing is still being produced. Reads only as far as the
+    # requested CNID; both listings are in catalog order (hls -U), so
+    # only entries that arrive out of order are held.
+
+    def __init__(self, hls_mod_raw):
+        self._entries = _iter_hls_mod(hls_mod_raw)
+        self._pending = {}
+        self._seen = bytearray()  # Bitmap of CNIDs read so far
+
+    def _check_duplicate(self, mod_cnid, hls_mod_line):
+        _cnid = int(mod_cnid)
+        _byte, _bit = _cnid >> 3, 1 << (_cnid & 7)
+        if _byte >= len(self._seen):
+            self._seen.extend(bytes(_byte + 1 - len(self._seen)))
+        if self._seen[_byte] & _bit:
+            sys.exit('_parse_hls_mod error: Duplcate CNID found.\n' +
+                     '|{0}|'.format(hls_mod_line))
+        self._seen[_byte] |= _bit
+
+    def __getitem__(self, cnid):
+        if cnid in self._pending:
+            return self._pending.pop(cnid)
+        for mod_cnid, mod_mdate, mod_filename, hls_mod_line in self._entries:
+            self._check_duplicate(mod_cnid, hls_mod_line)
+            if mod_cnid == cnid:
+                return (mod_mdate, mod_filename)
+            self._pending[mod_cnid] = (mod_mdate, mod_filename)
+        raise KeyError(cnid)
+
+
 def _file_line(regex_file_cre):
     # Takes regular expression matching entry for file in hls output.
-    # Returns dictionary with formatted values corresponding to DFXML tags.
-    HFS_file_line = {}
-    HFS_file_line['cnid'] = regex_file_cre.group(1)
-    HFS_file_line['HFSrsrcsize'] = regex_file_cre.group(4)
-    HFS_file_line['filesize'] = regex_file_cre.group(5)
+    # Returns HFSEntry with formatted values corresponding to DFXML tags.
+    HFS_file_line = hfs_native.HFSEntry()
+    HFS_file_line.cnid = int(regex_file_cre.group(1))
+    HFS_file_line.HFSrsrcsize = int(regex_file_cre.group(4))
+    HFS_file_line.filesize = int(regex_file_cre.group(5))
 
     if regex_file_cre.group(2).startswith('f'):
-        HFS_file_line['name_type'] = 'r'
+        HFS_file_line.name_type = 'r'
     elif regex_file_cre.group(2).startswith('F'):
-        HFS_file_line['name_type'] = 'r'
-        HFS_file_line['HFSlocked'] = '1'
+        HFS_file_line.name_type = 'r'
+        HFS_file_line.HFSlocked = '1'
     else:
-        HFS_file_line['name_type'] = '-' # Unknown type if not f
+        HFS_file_line.name_type = '-' # Unknown type if not f
 #        sys.exit('_file_line error: Unexpected Entry Type.\n' +
 #                 '{0}'.format(regex_file_cre.groups()))
     if regex_file_cre.group(2).endswith('i'):
-        HFS_file_line['HFSflags'] = 'i'
+        HFS_file_line.HFSflags = 'i'
 
     if ((regex_file_cre.group(3) != '    /    ') and
        (regex_file_cre.group(3) != '????/????')):
-        HFS_file_line['HFStype_creator'] = regex_file_cre.group(3)
+        HFS_file_line.HFStype_creator = regex_file_cre.group(3)
     _crtime = _reformat_date(regex_file_cre.group(6))
     if _crtime != datetime(1904, 1, 1):
-        HFS_file_line['crtime'] = _crtime
-
-    HFS_file_line['_filename'] = regex_file_cre.group(7)
+        HFS_file_line.crtime = _crtime
     return HFS_file_line
 
 
-def _hcopy_res(hfs_filepath):
-    # Takes full path of hfs file.
-    # Returns strings for libmagic, md5 and sha1 hash of file.
-    # NOTE: This copies the output of hcopy to a temporary file.
-    # NOTE: This only runs on data fork of specified file. (hcopy -r)
-    # NOTE: In rare cases, this fails due to a limitation in hcopy
-    # NOTE: In that case, None will be returns for all values
-    with tempfile.NamedTemporaryFile(delete=False) as tmp_fileout:
-        try:
-            tmp_fileout.write(subprocess.check_output(['hcopy', '-r',
-                                                    r'{0}'.format(
-                                                    hfs_filepath,), '-']))
-        except:
-            return None, None, None
-            # TODO: Report an error in reading the file
-        tmp_fileout.close()
+_libmagic = None  # Shared libmagic handle, loaded on first use
+
+
+def _magic_buffer(magic_buf):
+    # Takes bytes from the start of a fork (or disk image).
+    # Returns libmagic description of them.
+    # NOTE: The magic database is loaded once per process, not per file.
+    global _libmagic
+    if _libmagic is None:
         _libmagic = magic.open(magic.MAGIC_NONE)
         _libmagic.load()
-        libmagic = _libmagic.file(tmp_fileout.name)
-        _libmagic.close()
-        _hasher_md5 = md5()
-        _hasher_sha1 = sha1()
-        with open(tmp_fileout.name, 'rb') as tmp_hash:
-            buf = tmp_hash.read(128)
-            while len(buf) > 0:
-                _hasher_md5.update(buf)
-                _hasher_sha1.update(buf)
-                buf = tmp_hash.read(128)
-        file_md5 = _hasher_md5.hexdigest()
-        file_sha1 = _hasher_sha1.hexdigest()
-        os.unlink(tmp_fileout.name)
-        return libmagic, file_md5, file_sha1
+    return _libmagic.buffer(magic_buf)
+
+
+def _fork_res(fork_chunks, digests, use_magic=True):
+    # Takes iterable of a fork's contents in chunks, names of the
+    # digests to compute and whether to run libmagic.
+    # Returns libmagic (None if not run) and dict of digest name: hex
+    # digest of the fork, reading it once.
+    _head, fork_hashes = hfs_digests.digest_chunks(fork_chunks, digests,
+                                                   MAGIC_BYTES if use_magic
+                                                   else 0)
+    libmagic = None
+    if use_magic:
+        libmagic = _magic_buffer(_head)
+    return libmagic, fork_hashes
+
+
+def _hcopy_res(hfs_filepath, digests, use_magic=True, data=True,
+               rsrc=False):
+    # Takes full path of hfs file, names of the digests to compute,
+    # whether to run libmagic (on the data fork) and which forks to hash.
+    # Returns libmagic (None if not run) and hashes of the data fork,
+    # and hashes of the resource fork (None for forks not hashed).
+    # NOTE: Only the data fork is copied (hcopy -r) unless the resource
+    #       fork is hashed; both come out of one hcopy -m (MacBinary).
+    # NOTE: hcopy output is hashed as it is read from the pipe, so
+    #       memory use does not grow with the size of the file.
+    # NOTE: In rare cases, this fails due to a limitation in hcopy
+    # NOTE: In that case, None will be returns for all values
+    _count_subprocess('hcopy')
+    try:
+        hcopy_proc = _hfsutils.Popen(['hcopy', '-m' if rsrc else '-r',
+                                      r'{0}'.format(hfs_filepath,), '-'],
+                                     stdout=subprocess.PIPE)
+    except OSError:
+        return None, None, None
+    libmagic = None
+    data_hashes = None
+    rsrc_hashes = None
+    try:
+        with hcopy_proc.stdout as hcopy_output:
+            _data_len = None  # hcopy -r: the data fork, to the end
+            if rsrc:
+                _data_len, _rsrc_len = hfs_digests.macbinary_header(
+                                           hcopy_output)
+            if data:
+                libmagic, data_hashes = _fork_res(hfs_digests.read_chunks(
+                                                      hcopy_output,
+                                                      _data_len,
+                                                      hfs_native.READ_SIZE),
+                                                  digests, use_magic)
+            else:
+                hfs_digests.skip(hcopy_output, _data_len)
+            if rsrc:
+                hfs_digests.skip(hcopy_output,
+                                 hfs_digests.macbinary_padding(_data_len))
+                _rsrc_magic, rsrc_hashes = _fork_res(
+                                               hfs_digests.read_chunks(
+                                                   hcopy_output, _rsrc_len,
+                                                   hfs_native.READ_SIZE),
+                                               digests, False)
+                hfs_digests.skip(hcopy_output, None)  # Padding, if any
+    except SystemExit:
+        if hcopy_proc.wait() != 0:
+            return None, None, None  # Output ended as hcopy failed
+        raise
+    if hcopy_proc.wait() != 0:
+        return None, None, None
+        # TODO: Report an error in reading the file
+    return libmagic, data_hashes, rsrc_hashes
+
+
+def _image_fork_res(hfs_vol, fork_runs, fork_size, type_creator, digests,
+                    use_magic=True, dedup_store=None, cnid=None, fork=None):
+    # Takes HFSVolume, byte runs and size of a fork, HFStype_creator of
+    # its file and the same arguments as _fork_res, plus DedupStore (or
+    # None) and the CNID and fork ('data' or 'rsrc') stored with results.
+    # Returns libmagic and hashes of the fork, as _fork_res, and where
+    # they were taken from (None if computed from the fork); with
+    # dedup_store, taken from the store if a fork with the same
+    # prefilter key was hashed before and one digest of the fork
+    # confirms it is a copy (see hfs_dedup).
+    # NOTE: A fork that cannot be read (see hfs_native.ForkError) is
+    #       reported and gets None for all values, as with hcopy, so the
+    #       rest of the volume is still read.
+    try:
+        return _read_fork_res(hfs_vol, fork_runs, fork_size, type_creator,
+                              digests, use_magic, dedup_store, cnid, fork)
+    except hfs_native.ForkError as e:
+        print('_image_fork_res error: CNID {0} {1} fork: {2}'.format(
+              cnid, fork, e), file=sys.stderr)
+        return None, None, None
+
+
+def _read_fork_res(hfs_vol, fork_runs, fork_size, type_creator, digests,
+                   use_magic, dedup_store, cnid, fork):
+    # Same as _image_fork_res, but raises hfs_native.ForkError if the
+    # fork cannot be read.
+    _chunks = hfs_vol.read_runs(fork_runs, fork_size=fork_size)
+    if dedup_store is None:
+        return _fork_res(_chunks, digests, use_magic) + (None,)
+    _prefilter = hfs_dedup.prefilter_key(fork_size, type_creator,
+                                         hfs_vol.read_head(
+                                             fork_runs, hfs_dedup.EDGE_SIZE),
+                                         hfs_vol.read_tail(
+                                             fork_runs, hfs_dedup.EDGE_SIZE))
+    _stored = dedup_store.get(_prefilter, digests, use_magic)
+    if _stored is not None:
+        # Confirm the copy with a full hash of the fork, in the last of
+        # the digests; only libmagic and other digests are reused
+        _confirm = digests[-1:]
+        _head, _confirm_hashes = hfs_digests.digest_chunks(_chunks, _confirm)
+        if all(_confirm_hashes[_digest] == _stored[1][_digest]
+               for _digest in _confirm):
+            return _stored
+        # Not a copy: hash it in full, keeping the stored fork's results
+        return _fork_res(hfs_vol.read_runs(fork_runs, fork_size=fork_size),
+                         digests, use_magic) + (None,)
+    libmagic, fork_hashes = _fork_res(_chunks, digests, use_magic)
+    dedup_store.put(_prefilter, libmagic, fork_hashes, cnid, fork)
+    return libmagic, fork_hashes, None
+
+
+def _hash_line(this_line, hfs_vol=None, use_magic=True,
+               digests=hfs_digests.DEFAULT_DIGESTS, dedup_store=None):
+    # Takes HFSEntry; adds libmagic (unless use_magic is False) and
+    # hashes for non-empty forks not hashed yet. Returns the entry.
+    # Reads forks from hfs_vol (HFSVolume) if given, reusing results of
+    # identical forks from dedup_store (DedupStore, or None), otherwise
+    # with hcopy from the currently mounted volume.
+    if this_line.filename is None:
+        return this_line
+    _data = bool(this_line.filesize) and this_line.hashes is None
+    _rsrc = bool(this_line.HFSrsrcsize) and this_line.rsrc_hashes is None
+    if hfs_vol is not None:
+        if _data:
+            (this_line.libmagic, this_line.hashes,
+             this_line.dedup_source) = _image_fork_res(
+                hfs_vol, this_line.data_runs, this_line.filesize,
+                this_line.HFStype_creator, digests, use_magic, dedup_store,
+                this_line.cnid, 'data')
+        if _rsrc:
+            (_rsrc_magic, this_line.rsrc_hashes,
+             this_line.rsrc_dedup_source) = _image_fork_res(
+                hfs_vol, this_line.rsrc_runs, this_line.HFSrsrcsize,
+                this_line.HFStype_creator, digests, False, dedup_store,
+                this_line.cnid, 'rsrc')
+    elif _data or _rsrc:
+        _hcopy_name = _format_hcopy_name(this_line.filename)
+        _libmagic, _data_hashes, _rsrc_hashes = _hcopy_res(_hcopy_name,
+                                                           digests,
+                                                           use_magic, _data,
+                                                           _rsrc)
+        if _data:
+            this_line.libmagic, this_line.hashes = _libmagic, _data_hashes
+        if _rsrc:
+            this_line.rsrc_hashes = _rsrc_hashes
+    return this_line
 
 
 def _dir_line(regex_dir_cre):
     # Takes regular expression matching entry for directory in hls output.
-    # Returns dictionary with formatted values corresponding to DFXML tags.
-    HFS_dir_line = {}
-    HFS_dir_line['cnid'] = regex_dir_cre.group(1)
+    # Returns HFSEntry with formatted values corresponding to DFXML tags.
+    HFS_dir_line = hfs_native.HFSEntry()
+    HFS_dir_line.cnid = int(regex_dir_cre.group(1))
     if regex_dir_cre.group(2).startswith('d'):
-        HFS_dir_line['name_type'] = 'd'  # TODO: Need test for locked dirs.
+        HFS_dir_line.name_type = 'd'  # TODO: Need test for locked dirs.
     elif regex_dir_cre.group(2).startswith('D'):
-        HFS_dir_line['name_type'] = 'd'
-        HFS_dir_line['HFSlocked'] = '1'
+        HFS_dir_line.name_type = 'd'
+        HFS_dir_line.HFSlocked = '1'
     else:
-        HFS_dir_line['name_type'] = '-' # Unknown type if not d
+        HFS_dir_line.name_type = '-' # Unknown type if not d
 #        sys.exit('_dir_line error: Unexpected entry type.\n' +
 #                 '{0}'.format(regex_dir_cre.groups()))
     if regex_dir_cre.group(2).endswith('i'):
-        HFS_dir_line['HFSflags'] = 'i'
+        HFS_dir_line.HFSflags = 'i'
     _crtime = _reformat_date(regex_dir_cre.group(4))
     if _crtime != datetime(1904, 1, 1):
-        HFS_dir_line['crtime'] = _crtime
-    HFS_dir_line['_dirname'] = regex_dir_cre.group(5)
+        HFS_dir_line.crtime = _crtime
     return HFS_dir_line
 
 
+def _byte_runs(fork_runs):
+    # Takes list of (file offset, fs offset, image offset, length) tuples.
+    # Returns DFXML ByteRuns.
+    this_brs = DFXML.ByteRuns()
+    for _file_offset, _fs_offset, _img_offset, _length in fork_runs:
+        this_br = DFXML.ByteRun()
+        this_br.file_offset = _file_offset
+        this_br.fs_offset = _fs_offset
+        this_br.img_offset = _img_offset
+        this_br.len = _length
+        this_brs.append(this_br)
+    return this_brs
+
+
 def _line_to_dfxml(hfs_line, path_delim):
-    # Takes in dictionary with properties of HFS file or directory
+    # Takes in HFSEntry with properties of HFS file or directory
     # Returns tuple:
     # (DFXML FileObject for data fork,
     #  DFXML FileObject for resource fork)
@@ -256,49 +586,55 @@ def _line_to_dfxml(hfs_line, path_delim):
     this_fileobj = DFXML.FileObject() # data fork
     this_rsrcobj = None # empty resource fork
 
-    this_fileobj.inode = hfs_line['cnid']
-    this_fileobj.name_type = hfs_line['name_type']
+    this_fileobj.inode = hfs_line.cnid
+    this_fileobj.name_type = hfs_line.name_type
     this_fileobj.alloc = '1'
-    if hfs_line.get('filename') is not None:
-        this_fileobj.filename = hfs_line['filename']
-        this_fileobj.filesize = hfs_line['filesize']
+    if hfs_line.filename is not None:
+        this_fileobj.filename = hfs_line.filename
+        this_fileobj.filesize = hfs_line.filesize
     else:
-        this_fileobj.filename = hfs_line['dirname']
+        this_fileobj.filename = hfs_line.dirname
 
     # Only change delimiter in filepath if needed (data fork)
     if path_delim != 'classic':
         this_fileobj.filename = this_fileobj.filename.replace(':', '/')
         this_fileobj.filename = this_fileobj.filename.lstrip('/')
 
-    if hfs_line.get('libmagic') is not None:
-        this_fileobj.libmagic = hfs_line['libmagic']
-        this_fileobj.md5 = hfs_line['md5']
-        this_fileobj.sha1 = hfs_line['sha1']
-    if hfs_line.get('crtime') is not None:
-        this_fileobj.crtime = hfs_line['crtime'].isoformat()
-    if hfs_line.get('mtime') is not None:
-        this_fileobj.mtime = hfs_line['mtime'].isoformat()
+    if hfs_line.data_runs:
+        this_fileobj.data_brs = _byte_runs(hfs_line.data_runs)
+    if hfs_line.libmagic is not None:
+        this_fileobj.libmagic = hfs_line.libmagic
+    if hfs_line.crtime is not None:
+        this_fileobj.crtime = hfs_line.crtime.isoformat()
+    if hfs_line.mtime is not None:
+        this_fileobj.mtime = hfs_line.mtime.isoformat()
     # NOTE: The following values are in the projected HFS namespace.
     # See: https://github.com/dfxml-working-group/dfxml_schema/issues/23
     HFS_namespace_elems = DFXML.OtherNSElementList()
-    if hfs_line.get('HFStype_creator') is not None:
+    if hfs_line.HFStype_creator is not None:
         _HFStype_creator = ET.Element('{http://www.forensicswiki.org/' +
                                       'wiki/HFS}HFStype_creator')
-        _HFStype_creator.text = hfs_line['HFStype_creator']
+        _HFStype_creator.text = hfs_line.HFStype_creator
         HFS_namespace_elems.append(_HFStype_creator)
-    if hfs_line.get('HFSlocked') is not None:
+    if hfs_line.HFSlocked is not None:
         _HFSlocked = ET.Element('{http://www.forensicswiki.org/' +
                                 'wiki/HFS}HFSlocked')
-        _HFSlocked.text = hfs_line['HFSlocked']
+        _HFSlocked.text = hfs_line.HFSlocked
         HFS_namespace_elems.append(_HFSlocked)
-    if hfs_line.get('HFSflags') is not None:
+    if hfs_line.HFSflags is not None:
         _HFSflags = ET.Element('{http://www.forensicswiki.org/' +
                                'wiki/HFS}HFSflags')
-        _HFSflags.text = hfs_line['HFSflags']
+        _HFSflags.text = hfs_line.HFSflags
         HFS_namespace_elems.append(_HFSflags)
+    if hfs_line.dedup_source is not None:
+        HFS_namespace_elems.append(hfs_dedup.source_element(
+                                       hfs_line.dedup_source))
     this_fileobj.externals = (HFS_namespace_elems)
+    if hfs_line.hashes is not None:
+        # After externals are set, as digests may be added to them
+        hfs_digests.set_digests(this_fileobj, hfs_line.hashes)
 
-    if hfs_line.get('HFSrsrcsize') is not None:
+    if hfs_line.HFSrsrcsize is not None:
         this_rsrcobj = DFXML.FileObject() # resource fork
         this_rsrcobj.name_type = '-'
         this_rsrcobj.parent_object = this_fileobj
@@ -313,156 +649,1084 @@ def _line_to_dfxml(hfs_line, path_delim):
             _rsrcpath = this_fileobj.filename.split('/')
             _rsrcpath[-1] = '._{0}'.format(_rsrcpath[-1])
             this_rsrcobj.filename = '/'.join(_rsrcpath).lstrip('/')
-            this_rsrcobj.name_type = hfs_line['name_type'] # Change from -
+            this_rsrcobj.name_type = hfs_line.name_type # Change from -
         else:
             pass # No other options
 
-        this_rsrcobj.filesize = hfs_line['HFSrsrcsize']
+        this_rsrcobj.filesize = hfs_line.HFSrsrcsize
+        if hfs_line.rsrc_runs:
+            this_rsrcobj.data_brs = _byte_runs(hfs_line.rsrc_runs)
+        if hfs_line.rsrc_hashes is not None:
+            hfs_digests.set_digests(this_rsrcobj, hfs_line.rsrc_hashes)
+        if hfs_line.rsrc_dedup_source is not None:
+            this_rsrcobj.externals.append(hfs_dedup.source_element(
+                                              hfs_line.rsrc_dedup_source))
 
     return (this_fileobj, this_rsrcobj)
 
 
+def _hls_lines(hls_raw):
+    # Takes raw hls output, as a string or an iterable of lines.
+    # Yields lines without line endings, the same as hls_raw.split('\n')
+    # but without holding a second copy of the output.
+    if isinstance(hls_raw, str):
+        _start = 0
+        _end = hls_raw.find('\n')
+        while _end != -1:
+            yield hls_raw[_start:_end]
+            _start = _end + 1
+            _end = hls_raw.find('\n', _start)
+        yield hls_raw[_start:]
+    else:
+        hls_line = ''
+        for hls_line in hls_raw:
+            yield hls_line.rstrip('\n')
+        if hls_line.endswith('\n') or hls_line == '':
+            yield ''
+
+
+def _hls_sections(hls_raw):
+    # Takes raw hls output (see _hls_lines).
+    # Yields (section number, line number within section, line), the same
+    # as enumerating hls_raw.split('\n\n') and then each section's lines.
+    # hls -R separates the listing of each directory with a blank line.
+    section_num = 0
+    line_num = 0
+    hls_lines = _hls_lines(hls_raw)
+    hls_line = next(hls_lines)
+    for next_line in hls_lines:
+        # A blank line that is neither first in its section nor the last
+        # line of the output ends a section.
+        if hls_line == '' and line_num > 0:
+            section_num += 1
+            line_num = 0
+        else:
+            yield section_num, line_num, hls_line
+            line_num += 1
+        hls_line = next_line
+    yield section_num, line_num, hls_line
+
+
 def _parse_hls_cre(hls_cre_raw, hls_mod_dict, hcopy=True):
     # Takes in raw hls output with creation times and dict with mod times
-    # Returns list of dictionaries with HFS data
-    hfs_all_files = []
-    hls_cre_sections = hls_cre_raw.split('\n\n')
-    hls_cre_sections = [hlstmp.split('\n') for hlstmp in hls_cre_sections]
+    # Yields HFSEntry with HFS data for each line, as it is parsed
     _standalone_dir_id = re.compile(':(.*):')
+    this_dir = False
+
+    for hls_cre_section, hls_cre_linenum, hls_cre_entry in _hls_sections(
+                                                               hls_cre_raw):
+        # First line in section has directory name
+        if ((hls_cre_linenum == 0) and (hls_cre_section > 0)):
+            _dirname = re.match(_standalone_dir_id, hls_cre_entry)
+            if not _dirname:
+                sys.exit('_parse_hls_cre error: Directory not found ' +
+                         'on first line of section.\n' +
+                         '|{0}|'.format(hls_cre_entry))
+            else:
+                this_dir = _dirname.group(1)
+        else:
+            if hls_cre_entry == '':
+                continue  # Skip blank line
+            if hls_cre_section == 0:
+                this_dir = ''  # Root is :
+            if this_dir is False:
+                sys.exit('_parse_hls_cre error: this_dir was not ' +
+                         'already assigned.\n')
+            hls_cre_entry_line = hls_cre_entry.strip()
+            parse_file_cre, parse_dir_cre = _match_hls_line(
+                                                hls_cre_entry_line)
+            if ((parse_file_cre) and not(parse_dir_cre)):
+                this_line = _file_line(parse_file_cre)
+                _cnid = parse_file_cre.group(1)
+                _filename = parse_file_cre.group(7)
+                _mod_date, _fname_verify = hls_mod_dict[_cnid]
+
+                if _fname_verify == _filename:
+                    _mod_date = _reformat_date(_mod_date)
+                    if _mod_date != datetime(1904, 1, 1):
+                        this_line.mtime = _mod_date
+                else:
+                    sys.exit('_parse_hls_cre error: Inode/filename' +
+                             'mismatch when retrieving modification' +
+                             'time.\n' +
+                             '|{0}|{1}|'.format(_fname_verify,
+                                                _filename))
+                _filename = _filename.strip('"')
+                _dirprefix = this_dir
+
+                if this_dir != '':
+                    this_line.filename = ':{0}:{1}'.format(_dirprefix,
+                                                           _filename)
+                else:
+                    this_line.filename = ':{0}'.format(_filename)
+                if hcopy:
+                    _hash_line(this_line)
+
+            elif (not(parse_file_cre) and parse_dir_cre):
+                this_line = _dir_line(parse_dir_cre)
+                _cnid = parse_dir_cre.group(1)
+                _dirname = parse_dir_cre.group(5)
+                _mod_date, _dname_verify = hls_mod_dict[_cnid]
 
-    for hls_cre_block in enumerate(hls_cre_sections):
-        this_dir = False
-        for hls_cre_entry in enumerate(hls_cre_block[1]):
-            # First line in section has directory name
-            if ((hls_cre_entry[0] == 0) and (hls_cre_block[0] > 0)):
-                _dirname = re.match(_standalone_dir_id, hls_cre_entry[1])
-                if not _dirname:
-                    sys.exit('_parse_hls_cre error: Directory not found ' +
-                             'on first line of section.\n' +
-                             '|{0}|'.format(hls_cre_entry[1]))
+                if _dname_verify == _dirname:
+                    _mod_date = _reformat_date(_mod_date)
+                    if _mod_date != datetime(1904, 1, 1):
+                        this_line.mtime = _mod_date
                 else:
-                    this_dir = _dirname.group(1)
+                    sys.exit('_parse_hls_cre error: Inode/filename ' +
+                             'mismatch when retrieving modification ' +
+                             'time.\n' +
+                             '|{0}|{1}|'.format(_dname_verify,
+                                                _dirname))
+                _dirname = _dirname.strip('"')
+                if this_dir != '':
+                    this_line.dirname = ':{0}:{1}'.format(this_dir, _dirname)
+                else:
+                    this_line.dirname = ':{0}'.format(_dirname)
             else:
-                if hls_cre_entry[1] == '':
-                    continue  # Skip blank line
-                if hls_cre_block[0] == 0:
-                    this_dir = ''  # Root is :
-                if this_dir is False:
-                    sys.exit('_parse_hls_cre error: this_dir was not ' +
-                             'already assigned.\n')
-                hls_cre_entry_line = hls_cre_entry[1].strip()
-                parse_file_cre = re.match(PATTERNFILE, hls_cre_entry_line)
-                parse_dir_cre = re.match(PATTERNDIR, hls_cre_entry_line)
-                if ((parse_file_cre) and not(parse_dir_cre)):
-                    this_line = _file_line(parse_file_cre)
-                    _cnid = this_line['cnid']
-                    _filename = this_line['_filename']
-                    _mod_date, _fname_verify = hls_mod_dict[_cnid]
-
-                    if _fname_verify == _filename:
-                        _mod_date = _reformat_date(_mod_date)
-                        if _mod_date != datetime(1904, 1, 1):
-                            this_line['mtime'] = _mod_date
-                    else:
-                        sys.exit('_parse_hls_cre error: Inode/filename' +
-                                 'mismatch when retrieving modification' +
-                                 'time.\n' +
-                                 '|{0}|{1}|'.format(_fname_verify,
-                                                    _filename))
-                    _filename = _filename.strip('"')
-                    _dirprefix = this_dir
-
-                    if this_dir != '':
-                        this_line['filename'] = ':{0}:{1}'.format(
-                                                    _dirprefix, _filename)
-                    else:
-                        this_line['filename'] = ':{0}'.format(
-                                                            _filename)
-                    if hcopy and this_line['filesize'] != '0':
-                        _hcopy_name = _format_hcopy_name(this_line['filename'])
-                        this_line['libmagic'], this_line['md5'], \
-                        this_line['sha1'] = _hcopy_res(_hcopy_name)
-
-                elif (not(parse_file_cre) and parse_dir_cre):
-                    this_line = _dir_line(parse_dir_cre)
-                    _cnid = this_line['cnid']
-                    _dirname = this_line['_dirname']
-                    _mod_date, _dname_verify = hls_mod_dict[_cnid]
-
-                    if _dname_verify == _dirname:
-                        _mod_date = _reformat_date(_mod_date)
-                        if _mod_date != datetime(1904, 1, 1):
-                            this_line['mtime'] = _mod_date
-                    else:
-                        sys.exit('_parse_hls_cre error: Inode/filename ' +
-                                 'mismatch when retrieving modification ' +
-                                 'time.\n' +
-                                 '|{0}|{1}|'.format(_dname_verify,
-                                                    _dirname))
-                    _dirname = _dirname.strip('"')
-                    if this_dir != '':
-                        this_line['dirname'] = ':{0}:{1}'.format(this_dir,
-                                                                 _dirname)
-                    else:
-                        this_line['dirname'] = ':{0}'.format(_dirname)
+                sys.exit('_parse_hls_cre error: File/dir mismatch.')
+            yield this_line
+
+
+def _hfs_partitions(hfs_filename):
+    # Takes path to disk image.
+    # Returns list of (partition number, byte offset, byte length) of
+    # each HFS volume in it: a bare HFS volume has partition number
+    # None; the Apple_HFS partitions of a partition map are numbered
+    # from 1, in map order, as hmount numbers them.
+    # NOTE: An image with no HFS volume found is treated as one bare
+    #       volume, so that it fails as before when it is read.
+    _partitions = hfs_native.partitions(hfs_filename)
+    if not _partitions:
+        return [(None, 0, os.path.getsize(hfs_filename))]
+    if _partitions[0][0] == 0:
+        return [(None, 0, _partitions[0][1])]
+    return [(_number, _offset, _length) for _number, (_offset, _length,
+                                                      _name) in
+            enumerate(_partitions, 1)]
+
+
+def _partition_index(hfs_partitions, partition_number=None):
+    # Takes _hfs_partitions of an image and partition number (None for
+    # the first HFS volume). Returns index of the partition in the list.
+    if partition_number is None:
+        return 0
+    for _index, hfs_partition in enumerate(hfs_partitions):
+        if hfs_partition[0] == partition_number:
+            return _index
+    sys.exit('hfs_volobj error: No HFS partition ' +
+             '{0}.'.format(partition_number))
+
+
+def _partition_journals(hfs_journal_path, hfs_partitions):
+    # Returns path to the checkpoint journal of each partition (or
+    # None each, without a journal); partitions of a partition map
+    # with more than one get the partition number appended.
+    if hfs_journal_path is None or len(hfs_partitions) == 1:
+        return [hfs_journal_path] * len(hfs_partitions)
+    return ['{0}.{1}'.format(hfs_journal_path, hfs_partition[0])
+            for hfs_partition in hfs_partitions]
+
+
+def _partition_number(hfs_partition=None):
+    # Returns number of the _hfs_partitions entry (None for a bare
+    # volume, or if None).
+    return hfs_partition[0] if hfs_partition is not None else None
+
+
+def _open_volume(hfs_filename, hfs_partition=None):
+    # Returns HFSVolume of the _hfs_partitions entry (the first HFS
+    # volume if None).
+    if hfs_partition is None:
+        return hfs_native.HFSVolume(hfs_filename)
+    return hfs_native.HFSVolume(hfs_filename, hfs_partition[1])
+
+
+def _mount_volume(hfs_filename, hfs_partition=None):
+    # Same as _open_volume, but mounts the volume with hmount.
+    if hfs_partition is None:
+        return _call_hmount(hfs_filename)
+    return _call_hmount(hfs_filename, hfs_partition[0])
+
+
+def _private_home(homes_dir):
+    # Gives this process a private HOME, in homes_dir.
+    # hfsutils keeps its current volume in $HOME, so a process that
+    # mounts volumes under its own HOME cannot disturb those of other
+    # processes (hashing workers, partition or batch jobs, the parent).
+    # Returns path to the new HOME.
+    os.environ['HOME'] = tempfile.mkdtemp(dir=homes_dir)
+    return os.environ['HOME']
+
+
+def _native_lines(hfs_filename, hfs_partition=None):
+    # Takes path to HFS volume and _hfs_partitions entry (or None);
+    # reads the catalog in-process.
+    # Yields HFSEntry for each file and directory, as _parse_hls_cre
+    # does (without hashes), plus byte runs for each fork.
+    # NOTE: Timestamps keep full resolution (not truncated to the day).
+    with _open_volume(hfs_filename, hfs_partition) as hfs_vol:
+        for this_line in hfs_vol.walk():
+            yield this_line
+
+
+_hash_worker_vol = None  # HFSVolume of a hashing worker ('image' hashing)
+_hash_worker_magic = True  # Whether a hashing worker runs libmagic
+_hash_worker_digests = hfs_digests.DEFAULT_DIGESTS  # Digests it computes
+_hash_worker_dedup = None  # DedupStore of a hashing worker, if any
+
+
+def _hash_worker_init(hfs_filename, worker_homes, hfs_options,
+                      hfs_partition=None):
+    # Runs once in each hashing worker process; 'hcopy' workers mount
+    # the volume under a private HOME.
+    global _hash_worker_vol, _hash_worker_magic, _hash_worker_digests
+    global _hash_worker_dedup
+    _hash_worker_magic = hfs_options.magic
+    _hash_worker_digests = hfs_options.digests
+    if hfs_options.hashing == 'hcopy':
+        _private_home(worker_homes)
+        _mount_volume(hfs_filename, hfs_partition)
+    else:
+        _hash_worker_vol = _open_volume(hfs_filename, hfs_partition)
+        if hfs_options.dedup_path is not None:
+            _hash_worker_dedup = hfs_dedup.DedupStore(
+                                     hfs_options.dedup_path, hfs_filename,
+                                     _partition_number(hfs_partition))
+
+
+def _hash_worker(this_line):
+    return _timed_hash_line(this_line, _hash_worker_vol, _hash_worker_magic,
+                            _hash_worker_digests, _hash_worker_dedup)
+
+
+def _timed_hash_line(this_line, hfs_vol=None, use_magic=True,
+                     digests=hfs_digests.DEFAULT_DIGESTS, dedup_store=None):
+    # Same as _hash_line, but returns tuple (entry, seconds taken,
+    # subprocesses spawned by this process since last call).
+    _start = time.perf_counter()
+    _hash_line(this_line, hfs_vol, use_magic, digests, dedup_store)
+    return this_line, time.perf_counter() - _start, _take_spawned()
+
+
+def _hash_done(hash_result, run_stats):
+    # Takes result of _timed_hash_line and RunStats (or None).
+    # Returns the entry.
+    this_line, hash_seconds, hash_spawned = hash_result
+    if run_stats is not None:
+        run_stats.add_subprocesses(hash_spawned)
+        run_stats.add_file(this_line.filename, hash_seconds,
+                           (this_line.filesize if this_line.hashes else 0) +
+                           (this_line.HFSrsrcsize if this_line.rsrc_hashes
+                            else 0))
+    return this_line
+
+
+def _cached_line(this_line, hash_cache, use_magic=True,
+                 digests=hfs_digests.DEFAULT_DIGESTS):
+    # Takes HFSEntry, HashCache (or None), whether libmagic is run and
+    # names of the digests computed.
+    # Returns True if the entry needs no hashing: a directory, or a file
+    # whose forks are each empty, already hashed (taken from a baseline,
+    # see hfs_baseline) or have results in the cache (added to it).
+    if this_line.filename is None:
+        return True
+    _data_done = (not this_line.filesize or this_line.hashes is not None or
+                  _cached_fork(this_line, 'data', hash_cache, use_magic,
+                               digests))
+    _rsrc_done = (not this_line.HFSrsrcsize or
+                  this_line.rsrc_hashes is not None or
+                  _cached_fork(this_line, 'rsrc', hash_cache, False,
+                               digests))
+    return _data_done and _rsrc_done
+
+
+def _cached_fork(this_line, fork, hash_cache, use_magic, digests):
+    # Adds results for the fork ('data' or 'rsrc') of an HFSEntry from
+    # hash_cache (or None). Returns True if it had all of them.
+    if hash_cache is None:
+        return False
+    _cached = hash_cache.get(this_line.cnid, fork,
+                             this_line.filesize if fork == 'data' else
+                             this_line.HFSrsrcsize, this_line.mtime)
+    if _cached is None:
+        return False
+    _libmagic, _hashes = _cached
+    if any(_digest not in _hashes for _digest in digests):
+        return False  # Cached by a run with other digests
+    if use_magic and _libmagic is None:
+        return False  # Cached by a run without libmagic
+    _hashes = {_digest: _hashes[_digest] for _digest in digests}
+    if fork == 'rsrc':
+        this_line.rsrc_hashes = _hashes
+        return True
+    if use_magic:
+        this_line.libmagic = _libmagic
+    this_line.hashes = _hashes
+    return True
+
+
+def _cache_line(this_line, hash_cache):
+    # Stores hashes of a freshly hashed HFSEntry in hash_cache; results
+    # taken from a dedup store are not, as they were not computed from
+    # this volume's forks.
+    if hash_cache is not None:
+        if this_line.filesize and this_line.dedup_source is None:
+            hash_cache.put(this_line.cnid, 'data', this_line.filesize,
+                           this_line.mtime, this_line.libmagic,
+                           this_line.hashes)
+        if this_line.HFSrsrcsize and this_line.rsrc_dedup_source is None:
+            hash_cache.put(this_line.cnid, 'rsrc', this_line.HFSrsrcsize,
+                           this_line.mtime, None, this_line.rsrc_hashes)
+    return this_line
+
+
+def _hash_lines(hfs_lines, hfs_filename, hfs_options, hash_cache=None,
+                run_stats=None, hfs_partition=None):
+    # Takes iterable of HFSEntry in catalog order, path to HFS volume,
+    # HFSOptions (hashing, jobs, magic, digests and dedup_path are
+    # used; the dedup store with 'image' hashing only), HashCache (or
+    # None) checked before hashing each fork, RunStats (or None) for
+    # per-file times and _hfs_partitions entry of the volume (or None).
+    # Yields the entries with hashes added, still in catalog order.
+    # NOTE: With jobs > 1 only a few entries per worker are in flight;
+    #       serial 'hcopy' hashing expects the volume to be mounted.
+    jobs = hfs_options.jobs
+    use_magic = hfs_options.magic
+    digests = hfs_options.digests
+    if hfs_options.hashing != 'image':
+        # hcopy reads the whole fork to see its end
+        hfs_options = hfs_options.replace(dedup_path=None)
+    if jobs <= 1:
+        hfs_vol = None
+        dedup_store = None
+        if hfs_options.hashing == 'image':
+            hfs_vol = _open_volume(hfs_filename, hfs_partition)
+        if hfs_options.dedup_path is not None:
+            dedup_store = hfs_dedup.DedupStore(hfs_options.dedup_path,
+                                               hfs_filename,
+                                               _partition_number(
+                                                   hfs_partition))
+        for this_line in hfs_lines:
+            if _cached_line(this_line, hash_cache, use_magic, digests):
+                yield this_line
+            else:
+                yield _cache_line(_hash_done(_timed_hash_line(this_line,
+                                                              hfs_vol,
+                                                              use_magic,
+                                                              digests,
+                                                              dedup_store),
+                                             run_stats), hash_cache)
+        if dedup_store is not None:
+            dedup_store.close()
+        if hfs_vol is not None:
+            hfs_vol.close()
+        return
+    with tempfile.TemporaryDirectory(prefix='hfs2dfxml_') as worker_homes:
+        with ProcessPoolExecutor(max_workers=jobs,
+                                 initializer=_hash_worker_init,
+                                 initargs=(hfs_filename, worker_homes,
+                                           hfs_options,
+                                           hfs_partition)) as executor:
+            pending = deque()
+            for this_line in hfs_lines:
+                if _cached_line(this_line, hash_cache, use_magic, digests):
+                    pending.append(this_line)
                 else:
-                    sys.exit('_parse_hls_cre error: File/dir mismatch.')
-                hfs_all_files.append(this_line)
-    return hfs_all_files
+                    pending.append(executor.submit(_hash_worker, this_line))
+                while len(pending) > jobs * 4:
+                    yield _hash_result(pending.popleft(), hash_cache,
+                                       run_stats)
+            while pending:
+                yield _hash_result(pending.popleft(), hash_cache, run_stats)
+
 
+def _hash_result(pending_line, hash_cache=None, run_stats=None):
+    # Entries that needed no hashing are queued as-is, others as futures.
+    if isinstance(pending_line, Future):
+        return _cache_line(_hash_done(pending_line.result(), run_stats),
+                           hash_cache)
+    return pending_line
 
-def hfs_volobj(hfs_filename, hfs_delimiter):
+
+def _hfs_volobj_header(hfs_filename, hfs_partition=None, use_magic=True):
+    # Takes path to HFS volume, _hfs_partitions entry (or None) and
+    # whether to describe the image with libmagic; without it, block
+    # size and count are read from the image where libmagic reads them.
+    # Returns DFXML VolumeObject with volume properties but no fileobjects.
     this_volobj = DFXML.VolumeObject()
     this_volobj.ftype_str = 'HFS'
-    _volmagic = magic.open(magic.MAGIC_NONE)
-    _volmagic.load()
-    _volstring = _volmagic.file(hfs_filename)
-    _volmagic.close()
-    # NOTE: Need more testing with different HFS disk images
-    if _volstring.startswith('Apple Driver Map'):
-        _block_size, _block_count = re.search('blocksize (\d+), ' +
-                                              'blockcount (\d+)',
-                                              _volstring).groups()
-    elif _volstring.startswith('Macintosh HFS data'):
-        _block_size, _block_count = re.search('block size: (\d+), ' +
-                                              'number of blocks: (\d+)',
-                                              _volstring).groups()
+    if use_magic:
+        with open(hfs_filename, 'rb') as hfs_file:
+            _volstring = _magic_buffer(hfs_file.read(MAGIC_BYTES))
+        # NOTE: Need more testing with different HFS disk images
+        if _volstring.startswith('Apple Driver Map'):
+            _block_size, _block_count = re.search(r'blocksize (\d+), ' +
+                                                  r'blockcount (\d+)',
+                                                  _volstring).groups()
+        elif _volstring.startswith('Macintosh HFS data'):
+            _block_size, _block_count = re.search(r'block size: (\d+), ' +
+                                                  r'number of blocks: (\d+)',
+                                                  _volstring).groups()
+        else:
+            _block_size = None
+            _block_count = None
     else:
-        _block_size = None
-        _block_count = None
+        _block_size, _block_count = hfs_native.block_geometry(hfs_filename)
+    if hfs_partition is not None and hfs_partition[0] is not None:
+        # One of the partitions of a partition map
+        this_volobj.partition_offset = hfs_partition[1]
+        if _block_size is not None:
+            _block_count = hfs_partition[2] // int(_block_size)
     this_volobj.block_size = _block_size
     this_volobj.block_count = _block_count
-    hfs_fileinfo = _call_hmount(hfs_filename)
+    return this_volobj
+
+
+def _hfs_fileobjs(hfs_filename, hfs_delimiter, hfs_options=None,
+                  hfs_partition=None, hfs_volume_index=0, hfs_run_stats=None,
+                  hfs_journal_path=None):
+    # Takes the same arguments as hfs_volobj, but with the
+    # _hfs_partitions entry of the volume (or None) and index of the
+    # volume in the DFXML.
+    # Yields DFXML FileObjects (data fork, then resource fork) one entry
+    # at a time, in catalog order; if differential, only new and changed
+    # entries, then deleted ones.
+    if hfs_options is None:
+        hfs_options = HFSOptions()
+    if hfs_options.reader != 'native' and hfs_options.hashing == 'image':
+        # Extents are only known to the native reader
+        hfs_options = hfs_options.replace(hashing='hcopy')
+    hfs_mounted = (hfs_options.reader != 'native' or
+                   (hfs_options.hashing == 'hcopy' and hfs_options.jobs <= 1))
+    if hfs_mounted:
+        with hfs_stats.stage(hfs_run_stats, 'mount'):
+            hfs_fileinfo = _mount_volume(hfs_filename, hfs_partition)
 #    if hfs_fileinfo[0] is True:
 #        this_volobj.error = hfs_fileinfo[1]
 #        return this_volobj # NOTE: VolumeObject has no error attribute
-    hlscre, hlsmod = _call_hls()
-    if hlscre is True:
-        this_volobj.error = hlsmod
-        return this_volobj # NOTE: This doesn't seem to get written out to the XML; why?
-    hlsmoddict = _parse_hls_mod(hlsmod)
-    linedicts = _parse_hls_cre(hlscre, hlsmoddict)
-    for linedict in linedicts:
-        # NOTE: This is the part I'd expect it to break
-        #       I mean, it's the most obvious part
-        datafork, rsrcfork = _line_to_dfxml(linedict, hfs_delimiter)
-        this_volobj.append(datafork)
-        if rsrcfork is not None:
-            this_volobj.append(rsrcfork)
-    _call_humount(report_err=True)  # Report if HFS file did not unmount
+    hash_cache = None
+    hash_journal = None
+    baseline = None
+    catalog_index = None
+    try:
+        if hfs_options.baseline_path is not None:
+            with hfs_stats.stage(hfs_run_stats, 'baseline'):
+                baseline = hfs_baseline.Baseline(hfs_options.baseline_path,
+                                                 hfs_volume_index)
+        if hfs_options.cache_path is not None:
+            hash_cache = hfs_cache.HashCache(hfs_options.cache_path,
+                                             hfs_filename,
+                                             hfs_options.cache_size,
+                                             hfs_partition[1] if
+                                             hfs_partition else 0)
+        if hfs_journal_path is not None:
+            hash_journal = hfs_journal.HashJournal(hfs_journal_path,
+                                                   hfs_filename,
+                                                   hfs_options.magic,
+                                                   hfs_options.resume,
+                                                   hash_cache,
+                                                   hfs_options.digests)
+        if hfs_options.index_path is not None:
+            catalog_index = hfs_index.open_index(hfs_options.index_path,
+                                                 hfs_filename,
+                                                 hfs_volume_index)
+        if hfs_options.reader == 'native':
+            linedicts = hfs_stats.timed_iter(hfs_run_stats, 'catalog',
+                                             _native_lines(hfs_filename,
+                                                           hfs_partition))
+        else:
+            linedicts = _stream_hls_lines(hfs_run_stats)
+        if baseline is not None:
+            linedicts = baseline.filled(linedicts, hfs_options.magic,
+                                        hfs_options.digests)
+        linedicts = hfs_stats.timed_iter(hfs_run_stats, 'hash',
+                                         _hash_lines(linedicts, hfs_filename,
+                                                     hfs_options,
+                                                     hash_journal or
+                                                     hash_cache,
+                                                     hfs_run_stats,
+                                                     hfs_partition))
+        for linedict in linedicts:
+            # NOTE: This is the part I'd expect it to break
+            #       I mean, it's the most obvious part
+            with hfs_stats.stage(hfs_run_stats, 'dfxml'):
+                datafork, rsrcfork = _line_to_dfxml(linedict, hfs_delimiter)
+                if catalog_index is not None:
+                    with hfs_stats.stage(hfs_run_stats, 'index'):
+                        catalog_index.add(linedict, datafork.filename)
+                if (hfs_options.differential and
+                        not baseline.annotate(datafork, rsrcfork)):
+                    continue  # Unchanged since the baseline
+            yield datafork
+            if rsrcfork is not None:
+                yield rsrcfork
+        if hfs_options.differential:
+            for this_fileobj in baseline.deleted():
+                yield this_fileobj
+    finally:
+        if catalog_index is not None:
+            catalog_index.close()
+        if hash_journal is not None:
+            hash_journal.close()
+        if hash_cache is not None:
+            hash_cache.close()
+        if hfs_mounted:
+            with hfs_stats.stage(hfs_run_stats, 'umount'):
+                _call_humount(report_err=True)  # Report if did not unmount
+        if hfs_run_stats is not None:
+            hfs_run_stats.add_subprocesses(_take_spawned())
+
+
+def hfs_volobj(hfs_filename, hfs_delimiter, hfs_options=None,
+               hfs_partition=None, hfs_run_stats=None, hfs_journal_path=None):
+    # Takes path to HFS volume, path delimiter and HFSOptions of the run
+    # (defaults if None).
+    # For disk images with a partition map, hfs_partition is the number
+    # of the Apple_HFS partition to read (as for hmount; the first if
+    # None).
+    # Takes optional hfs_stats.RunStats to report the run to (see its
+    # hooks), and path to a checkpoint journal (None for no journal),
+    # resumed from with the resume option (see hfs_journal). The
+    # journal is removed once the volume is complete.
+    # Returns DFXML VolumeObject.
+    if hfs_options is None:
+        hfs_options = HFSOptions()
+    _take_spawned()  # Count only this run's subprocesses
+    _partitions = _hfs_partitions(hfs_filename)
+    _volume_index = _partition_index(_partitions, hfs_partition)
+    this_volobj = _hfs_volobj(hfs_filename, hfs_delimiter, hfs_options,
+                              _partitions[_volume_index], _volume_index,
+                              hfs_run_stats, hfs_journal_path)
+    _remove_journal(hfs_journal_path)
+    if hfs_run_stats is not None:
+        hfs_run_stats.finish()
+    return this_volobj
+
+
+def _hfs_volobj(hfs_filename, hfs_delimiter, hfs_options, hfs_partition,
+                hfs_volume_index, hfs_run_stats, hfs_journal_path):
+    # Takes the same arguments as _hfs_fileobjs, after the VolumeObject.
+    # Returns DFXML VolumeObject of the partition, with its fileobjects.
+    with hfs_stats.stage(hfs_run_stats, 'volume'):
+        this_volobj = _hfs_volobj_header(hfs_filename, hfs_partition,
+                                         hfs_options.magic)
+    for this_fileobj in _hfs_fileobjs(hfs_filename, hfs_delimiter,
+                                      hfs_options, hfs_partition,
+                                      hfs_volume_index, hfs_run_stats,
+                                      hfs_journal_path):
+        this_volobj.append(this_fileobj)
     return this_volobj
 
 
-def hfs2dfxml(hfs_file, hfs_delim):
-    _call_humount()  # Ensure no other volume mounted by hfsutils
+def _remove_journal(hfs_journal_path):
+    # Removes checkpoint journal of a completed run, if any.
+    if hfs_journal_path is not None and os.path.isfile(hfs_journal_path):
+        os.unlink(hfs_journal_path)
+
+
+def _register_namespaces():
+    # Prefixes for namespaced elements rendered by ElementTree.
     ET.register_namespace('hfs', 'http://www.forensicswiki.org/wiki/HFS')
+    ET.register_namespace('delta', hfs_baseline.XMLNS_DELTA)
+
+
+def _hfs2dfxml_root(hfs_file):
+    # Returns DFXMLObject for an HFS disk image, without volumes.
+    _register_namespaces()
     DFXML_root = DFXML.DFXMLObject(version='1.1.1',
                                    dc={'type': 'Disk Image'})
     DFXML_root.sources = [os.path.basename(hfs_file)]
-    DFXML_root.append(hfs_volobj(hfs_file, hfs_delim))
     return DFXML_root
 
 
+def hfs2dfxml(hfs_file, hfs_delim, hfs_options=None, hfs_run_stats=None,
+              hfs_journal_path=None):
+    # Takes the same arguments as hfs_volobj, for every HFS volume in
+    # the disk image: one for a bare HFS volume, one per Apple_HFS
+    # partition of a partition map (whose journals are kept as
+    # hfs_journal_path.N for partition N).
+    # Returns DFXMLObject with a VolumeObject per HFS volume.
+    # With jobs > 1 and more than one partition, partitions are read
+    # at once by hfs2dfxml_stream (see _write_partitions), and the
+    # DFXML it writes is parsed into the DFXMLObject.
+    if hfs_options is None:
+        hfs_options = HFSOptions()
+    _partitions = _hfs_partitions(hfs_file)
+    if hfs_options.jobs > 1 and len(_partitions) > 1:
+        with tempfile.TemporaryDirectory(prefix='hfs2dfxml_') as dfxml_dir:
+            _dfxml_path = os.path.join(dfxml_dir, 'partitions.xml')
+            with open(_dfxml_path, 'w') as dfxmloutput:
+                hfs2dfxml_stream(hfs_file, dfxmloutput, hfs_delim,
+                                 hfs_options, hfs_run_stats,
+                                 hfs_journal_path)
+            return DFXML.parse(_dfxml_path)
+    _take_spawned()  # Count only this run's subprocesses
+    if _uses_hfsutils(hfs_options):
+        with hfs_stats.stage(hfs_run_stats, 'umount'):
+            _call_humount()  # Ensure no other volume mounted by hfsutils
+    if hfs_run_stats is not None:
+        hfs_run_stats.add_subprocesses(_take_spawned())
+    DFXML_root = _hfs2dfxml_root(hfs_file)
+    if hfs_options.differential:
+        DFXML_root.add_namespace('delta', hfs_baseline.XMLNS_DELTA)
+    _journal_paths = _partition_journals(hfs_journal_path, _partitions)
+    for _volume_index, hfs_partition in enumerate(_partitions):
+        DFXML_root.append(_hfs_volobj(hfs_file, hfs_delim, hfs_options,
+                                      hfs_partition, _volume_index,
+                                      hfs_run_stats,
+                                      _journal_paths[_volume_index]))
+    for _journal_path in _journal_paths:
+        _remove_journal(_journal_path)
+    if hfs_run_stats is not None:
+        hfs_run_stats.finish()
+    return DFXML_root
+
+
+def hfs2dfxml_stream(hfs_file, output_fh, hfs_delim, hfs_options=None,
+                     hfs_run_stats=None, hfs_journal_path=None):
+    # Same as hfs2dfxml, but writes DFXML to output_fh as each fileobject
+    # is produced, instead of returning a DFXMLObject.
+    # With the strict option, the DFXML is indented as it is written;
+    # with check, the shape of each fileobject is checked before it is
+    # written (see hfs_writer.check_fileobject).
+    # With jobs > 1 and more than one partition, up to jobs partitions
+    # are read at once instead (see _write_partitions).
+    # NOTE: Only the fileobjects being written are held in memory.
+    # NOTE: To resume, output_fh must be written afresh; hashes are
+    #       taken from the journal, not from the partial output.
+    if hfs_options is None:
+        hfs_options = HFSOptions()
+    _take_spawned()  # Count only this run's subprocesses
+    if _uses_hfsutils(hfs_options):
+        with hfs_stats.stage(hfs_run_stats, 'umount'):
+            _call_humount()  # Ensure no other volume mounted by hfsutils
+    if hfs_run_stats is not None:
+        hfs_run_stats.add_subprocesses(_take_spawned())
+    DFXML_root = _hfs2dfxml_root(hfs_file)
+    _partitions = _hfs_partitions(hfs_file)
+    _journal_paths = _partition_journals(hfs_journal_path, _partitions)
+    with hfs_stats.stage(hfs_run_stats, 'volume'):
+        _volobjs = [_hfs_volobj_header(hfs_file, hfs_partition,
+                                       hfs_options.magic)
+                    for hfs_partition in _partitions]
+    _namespaces = None
+    if hfs_options.differential:
+        _namespaces = {'delta': hfs_baseline.XMLNS_DELTA}
+    with hfs_writer.DFXMLStreamWriter(output_fh, DFXML_root, _namespaces,
+                                      hfs_writer.INDENT if hfs_options.strict
+                                      else None,
+                                      hfs_options.check) as writer:
+        if hfs_options.jobs > 1 and len(_partitions) > 1:
+            _write_partitions(writer, hfs_file, hfs_delim, hfs_options,
+                              _partitions, _volobjs, _journal_paths,
+                              hfs_run_stats)
+        else:
+            for _volume_index, (this_volobj, hfs_partition,
+                                journal_path) in enumerate(zip(
+                                    _volobjs, _partitions, _journal_paths)):
+                writer.open_volume(this_volobj)
+                for this_fileobj in _hfs_fileobjs(hfs_file, hfs_delim,
+                                                  hfs_options,
+                                                  hfs_partition,
+                                                  _volume_index,
+                                                  hfs_run_stats,
+                                                  journal_path):
+                    with hfs_stats.stage(hfs_run_stats, 'write'):
+                        writer.write_fileobject(this_fileobj)
+                writer.close_volume()
+    output_fh.flush()
+    for _journal_path in _journal_paths:
+        _remove_journal(_journal_path)
+    if hfs_run_stats is not None:
+        hfs_run_stats.finish()
+
+
+def _write_partitions(writer, hfs_file, hfs_delim, hfs_options,
+                      hfs_partitions, volobjs, journal_paths, hfs_run_stats):
+    # Reads the partitions of a partition map concurrently, jobs at a
+    # time, each in a worker process that renders its fileobjects to a
+    # temporary file. Writes each partition's volume to writer, in
+    # partition order, once its worker is done.
+    # NOTE: Partitions are independent volumes, so nothing is shared
+    #       between workers; each partition is hashed serially.
+    with tempfile.TemporaryDirectory(prefix='hfs2dfxml_') as partition_dir:
+        with ProcessPoolExecutor(max_workers=min(hfs_options.jobs,
+                                                 len(hfs_partitions))) \
+                as executor:
+            fragment_paths = [os.path.join(partition_dir,
+                                           '{0}.xml'.format(_volume_index))
+                              for _volume_index in range(len(volobjs))]
+            partition_results = [executor.submit(
+                                     _partition_job, hfs_file,
+                                     fragment_paths[_volume_index],
+                                     partition_dir, hfs_delim,
+                                     hfs_options.replace(jobs=1),
+                                     hfs_partition, _volume_index,
+                                     writer.namespaces,
+                                     hfs_run_stats is not None,
+                                     journal_paths[_volume_index])
+                                 for _volume_index, hfs_partition in
+                                 enumerate(hfs_partitions)]
+            for this_volobj, fragment_path, partition_result in zip(
+                    volobjs, fragment_paths, partition_results):
+                with hfs_stats.stage(hfs_run_stats, 'partitions'):
+                    _report = partition_result.result()
+                if _report is not None:
+                    hfs_run_stats.add_report(_report)
+                writer.open_volume(this_volobj)
+                with hfs_stats.stage(hfs_run_stats, 'write'):
+                    with open(fragment_path) as fragment:
+                        writer.write_fragment(fragment)
+                writer.close_volume()
+
+
+def _partition_job(hfs_file, fragment_path, partition_homes, hfs_delim,
+                   hfs_options, hfs_partition, hfs_volume_index, namespaces,
+                   hfs_stats_report, hfs_journal_path):
+    # Reads one partition for _write_partitions, in a worker process
+    # with a private HOME, writing its fileobjects to fragment_path as
+    # the writer would (with its namespaces, and indent and check as set
+    # by the options).
+    # Returns RunStats report if hfs_stats_report, otherwise None.
+    _private_home(partition_homes)
+    _register_namespaces()
+    _take_spawned()  # Count only this partition's subprocesses
+    run_stats = hfs_stats.RunStats() if hfs_stats_report else None
+    _indent = hfs_writer.INDENT if hfs_options.strict else None
+    with open(fragment_path, 'w') as fragment:
+        for this_fileobj in _hfs_fileobjs(hfs_file, hfs_delim,
+                                          hfs_options, hfs_partition,
+                                          hfs_volume_index, run_stats,
+                                          hfs_journal_path):
+            with hfs_stats.stage(run_stats, 'write'):
+                fragment.write(hfs_writer.render_fileobject(
+                                   this_fileobj, namespaces, _indent,
+                                   hfs_options.check))
+    return run_stats.report() if run_stats else None
+
+
+def _batch_images(batch_source, unique_names=True):
+    # Takes directory of disk images (searched recursively), or manifest
+    # file listing one image path per line (relative to the manifest).
+    # Returns list of (image path, name of DFXML output file) tuples.
+    # With unique_names, exits if two images would share an output file.
+    batch_images = []
+    if os.path.isdir(batch_source):
+        for dirpath, dirnames, filenames in os.walk(batch_source):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.startswith('.'):
+                    continue
+                hfs_file = os.path.join(dirpath, filename)
+                batch_images.append((hfs_file, '{0}.xml'.format(
+                    os.path.relpath(hfs_file, batch_source))))
+    else:
+        _manifest_dir = os.path.dirname(os.path.abspath(batch_source))
+        with open(batch_source) as manifest:
+            for manifest_line in manifest:
+                manifest_line = manifest_line.strip()
+                if manifest_line == '' or manifest_line.startswith('#'):
+                    continue
+                hfs_file = os.path.join(_manifest_dir, manifest_line)
+                batch_images.append((hfs_file, '{0}.xml'.format(
+                    os.path.basename(hfs_file))))
+    _dfxml_names = [dfxml_name for hfs_file, dfxml_name in batch_images]
+    if unique_names and len(set(_dfxml_names)) != len(_dfxml_names):
+        sys.exit('hfs2dfxml error: Manifest lists more than one image ' +
+                 'with the same file name.')
+    return batch_images
+
+
+def _batch_job(hfs_file, dfxml_file, hfs_delim, hfs_options, batch_homes,
+               hfs_stats_report=False):
+    # Processes one image of a batch, in a worker process (with a private
+    # HOME if the run uses hfsutils).
+    # Returns tuple (error message, or None if the DFXML file was
+    # written; RunStats report if hfs_stats_report, otherwise None).
+    # The DFXML is written to X.xml.part and renamed to X.xml once
+    # complete, so an image is done if and only if X.xml exists.
+    # Hash results are journaled next to the DFXML file (one journal per
+    # partition, see _partition_journals); with the resume option, done
+    # images are skipped and others resume from their journals.
+    job_home = None
+    if _uses_hfsutils(hfs_options):
+        job_home = _private_home(batch_homes)
+    run_stats = hfs_stats.RunStats() if hfs_stats_report else None
+    journal_file = '{0}.journal'.format(dfxml_file)
+    partial_file = '{0}.part'.format(dfxml_file)
+    try:
+        if not os.path.isfile(hfs_file):
+            return 'hfs2dfxml error: HFS Volume not found.', None
+        if os.path.isfile(dfxml_file):
+            if hfs_options.resume:
+                return None, None  # Done by an earlier run
+            return 'hfs2dfxml error: Output file already exists.', None
+        os.makedirs(os.path.dirname(dfxml_file), exist_ok=True)
+        try:
+            with open(partial_file, 'w') as dfxmloutput:
+                hfs2dfxml_stream(hfs_file, dfxmloutput, hfs_delim,
+                                 hfs_options.replace(jobs=1),
+                                 hfs_run_stats=run_stats,
+                                 hfs_journal_path=journal_file)
+        except (Exception, SystemExit) as e:
+            if os.path.isfile(partial_file):
+                os.unlink(partial_file)  # Do not leave partial DFXML behind
+            return (str(e) or type(e).__name__,
+                    run_stats.report() if run_stats else None)
+        os.replace(partial_file, dfxml_file)
+    finally:
+        if job_home is not None:
+            shutil.rmtree(job_home, ignore_errors=True)
+    return None, run_stats.report() if run_stats else None
+
+
+def hfs2dfxml_batch(batch_source, output_dir, hfs_delim, hfs_options=None,
+                    hfs_stats_report=False):
+    # Takes directory or manifest of disk images (see _batch_images) and
+    # output directory. Writes one DFXML file per image, processing
+    # the jobs option's number of images at once, plus
+    # hfs2dfxml_batch.json summarizing the batch. Returns the summary as
+    # a dictionary; with hfs_stats_report, it includes a RunStats report
+    # per image.
+    # With the resume option, an interrupted batch picks up where it
+    # stopped. An index_path or dedup_path is shared by all images.
+    # NOTE: Images are processed in parallel, so each image is hashed
+    #       serially.
+    if hfs_options is None:
+        hfs_options = HFSOptions()
+    batch_images = _batch_images(batch_source)
+    os.makedirs(output_dir, exist_ok=True)
+    batch_failures = []
+    batch_stats = {}
+    with tempfile.TemporaryDirectory(prefix='hfs2dfxml_') as batch_homes:
+        with ProcessPoolExecutor(max_workers=hfs_options.jobs) as executor:
+            batch_results = [executor.submit(_batch_job, hfs_file,
+                                             os.path.join(output_dir,
+                                                          dfxml_name),
+                                             hfs_delim, hfs_options,
+                                             batch_homes, hfs_stats_report)
+                             for hfs_file, dfxml_name in batch_images]
+            for (hfs_file, dfxml_name), batch_result in zip(batch_images,
+                                                            batch_results):
+                try:
+                    _error, _report = batch_result.result()
+                except Exception as e:  # e.g., worker process crashed
+                    _error, _report = str(e) or type(e).__name__, None
+                if _report is not None:
+                    batch_stats[hfs_file] = _report
+                if _error is not None:
+                    batch_failures.append({'image': hfs_file,
+                                           'error': _error})
+    batch_summary = {'images': len(batch_images),
+                     'succeeded': len(batch_images) - len(batch_failures),
+                     'failed': batch_failures}
+    if hfs_stats_report:
+        batch_summary['stats'] = batch_stats
+    with open(os.path.join(output_dir, 'hfs2dfxml_batch.json'),
+              'w') as summaryfile:
+        json.dump(batch_summary, summaryfile, indent=2)
+    return batch_summary
+
+
+def hfs2dfxml_triage(hfs_files, output_fh, triage_jobs=1):
+    # Takes list of disk image paths and open text file.
+    # Writes one JSON line per image (see hfs_triage.triage), in the
+    # order given, reading triage_jobs images at once. Images are not
+    # mounted and catalogs are not read, so this is fast enough to size
+    # up a whole collection before running hfs2dfxml on it.
+    # Returns dictionary of totals over all images.
+    triage_summary = {'images': 0, 'failed': 0, 'volumes': 0, 'files': 0,
+                      'folders': 0, 'used_bytes': 0}
+    if triage_jobs > 1:
+        executor = ProcessPoolExecutor(max_workers=triage_jobs)
+        image_summaries = executor.map(hfs_triage.triage, hfs_files,
+                                       chunksize=TRIAGE_CHUNK)
+    else:
+        executor = None
+        image_summaries = map(hfs_triage.triage, hfs_files)
+    try:
+        for image_summary in image_summaries:
+            output_fh.write(json.dumps(image_summary) + '\n')
+            triage_summary['images'] += 1
+            if image_summary['error'] is not None:
+                triage_summary['failed'] += 1
+            for vol_summary in image_summary['volumes']:
+                triage_summary['volumes'] += 1
+                for _field in ('files', 'folders', 'used_bytes'):
+                    triage_summary[_field] += vol_summary[_field]
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return triage_summary
+
+
+def _daemon_worker_init(use_magic):
+    # Loads the libmagic database once per daemon worker, not per job,
+    # unless jobs run without libmagic.
+    if use_magic:
+        _magic_buffer(b'')
+
+
+def _write_status(status_path, status):
+    # Writes status dictionary as JSON, replacing status_path at once so
+    # that readers of the spool directory never see a partial file.
+    with open('{0}.tmp'.format(status_path), 'w') as statusfile:
+        json.dump(status, statusfile, indent=2)
+    os.replace('{0}.tmp'.format(status_path), status_path)
+
+
+def _claim_job(spool_dir, job_name, output_dir):
+    # Moves job file from incoming to running and marks it as running.
+    # Returns job status dictionary (with error set if the job file is
+    # not valid), or None if the job was withdrawn before it was claimed.
+    # The status keeps image and output as given in the job file, so a
+    # requeued job is resolved again the same way; image_path and
+    # output_path are resolved against the spool and output directories.
+    _running_path = os.path.join(spool_dir, 'running', job_name)
+    try:
+        os.rename(os.path.join(spool_dir, 'incoming', job_name),
+                  _running_path)
+    except FileNotFoundError:
+        return None
+    job_status = {'job': job_name, 'status': 'running', 'error': None,
+                  'started': datetime.now().isoformat(), 'finished': None}
+    try:
+        with open(_running_path) as jobfile:
+            _job = json.load(jobfile)
+        job_status['image'] = _job['image']
+        job_status['output'] = _job.get(
+            'output', '{0}.xml'.format(os.path.splitext(job_name)[0]))
+        job_status['image_path'] = os.path.join(spool_dir, _job['image'])
+        job_status['output_path'] = os.path.join(output_dir,
+                                                 job_status['output'])
+        job_status['requeued'] = _job.get('requeued', False)
+    except (ValueError, TypeError, KeyError, AttributeError):
+        job_status['error'] = ('hfs2dfxml error: Job file is not a JSON ' +
+                               'object with an image path.')
+    _write_status(_running_path, job_status)
+    return job_status
+
+
+def _finish_job(spool_dir, job_status, daemon_status):
+    # Moves job from running to done or failed, with its final status.
+    job_status['status'] = 'failed' if job_status['error'] else 'done'
+    job_status['finished'] = datetime.now().isoformat()
+    _write_status(os.path.join(spool_dir, job_status['status'],
+                               job_status['job']), job_status)
+    os.unlink(os.path.join(spool_dir, 'running', job_status['job']))
+    daemon_status[job_status['status']] += 1
+
+
+def hfs2dfxml_daemon(spool_dir, output_dir, hfs_delim, hfs_options=None,
+                     hfs_stats_report=False, poll_interval=DAEMON_POLL,
+                     run_once=False):
+    # Takes spool directory and output directory, and runs until SIGTERM
+    # or SIGINT (or, with run_once, until no jobs are left).
+    # A job is a JSON file put into incoming/ in the spool directory, with
+    # the path of an image (relative to the spool directory) and
+    # optionally of its DFXML file (relative to output_dir; by default
+    # the job file name with .xml). Jobs are processed in name order by
+    # the jobs option's number of worker processes, which live as long
+    # as the daemon, so imports and libmagic (with the magic option) are
+    # loaded once, not per image. A job file is moved to running/ while
+    # processed, then to done/ or failed/, rewritten with its status:
+    # image, output, error, start and finish times, and with
+    # hfs_stats_report, its RunStats report.
+    # daemon.json in the spool directory counts jobs running, done and
+    # failed. Jobs left in running/ by a daemon that was killed are put
+    # back into incoming/ and resume from their journal.
+    # Returns the final contents of daemon.json as a dictionary.
+    # NOTE: Run one daemon per spool directory.
+    if hfs_options is None:
+        hfs_options = HFSOptions()
+    for _state in DAEMON_STATES:
+        os.makedirs(os.path.join(spool_dir, _state), exist_ok=True)
+    for job_name in os.listdir(os.path.join(spool_dir, 'running')):
+        if job_name.endswith('.json'):
+            _running_path = os.path.join(spool_dir, 'running', job_name)
+            with open(_running_path) as jobfile:
+                _job = json.load(jobfile)
+            _job['requeued'] = True
+            _write_status(_running_path, _job)
+            os.rename(_running_path,
+                      os.path.join(spool_dir, 'incoming', job_name))
+    daemon_status = {'pid': os.getpid(),
+                     'started': datetime.now().isoformat(),
+                     'running': 0, 'done': 0, 'failed': 0}
+    _status_path = os.path.join(spool_dir, 'daemon.json')
+    _stopping = []
+    _handlers = {_signal: signal.signal(_signal,
+                                        lambda signum, frame:
+                                        _stopping.append(signum))
+                 for _signal in (signal.SIGTERM, signal.SIGINT)}
+    try:
+        with tempfile.TemporaryDirectory(prefix='hfs2dfxml_') as daemon_homes:
+            with ProcessPoolExecutor(max_workers=hfs_options.jobs,
+                                     initializer=_daemon_worker_init,
+                                     initargs=(hfs_options.magic,)
+                                     ) as executor:
+                running_jobs = {}  # Future: job status
+                while True:
+                    _queued = sorted(job_name for job_name in os.listdir(
+                                         os.path.join(spool_dir, 'incoming'))
+                                     if job_name.endswith('.json'))
+                    for job_name in _queued:
+                        if _stopping or (len(running_jobs) >=
+                                         hfs_options.jobs):
+                            break
+                        job_status = _claim_job(spool_dir, job_name,
+                                                output_dir)
+                        if job_status is None:
+                            continue
+                        if job_status['error'] is not None:
+                            _finish_job(spool_dir, job_status, daemon_status)
+                            continue
+                        running_jobs[executor.submit(
+                            _batch_job, job_status['image_path'],
+                            job_status['output_path'], hfs_delim,
+                            hfs_options.replace(
+                                resume=job_status['requeued']),
+                            daemon_homes, hfs_stats_report)] = job_status
+                    daemon_status['running'] = len(running_jobs)
+                    _write_status(_status_path, daemon_status)
+                    if not running_jobs:
+                        if _stopping or (run_once and not _queued):
+                            break
+                        time.sleep(poll_interval)
+                        continue
+                    finished_jobs, _pending = wait(
+                        running_jobs, timeout=poll_interval,
+                        return_when=FIRST_COMPLETED)
+                    for finished_job in finished_jobs:
+                        job_status = running_jobs.pop(finished_job)
+                        try:
+                            _error, _report = finished_job.result()
+                        except Exception as e:  # e.g., worker crashed
+                            _error, _report = str(e) or type(e).__name__, None
+                        job_status['error'] = _error
+                        if _report is not None:
+                            job_status['stats'] = _report
+                        _finish_job(spool_dir, job_status, daemon_status)
+    finally:
+        for _signal, _handler in _handlers.items():
+            signal.signal(_signal, _handler)
+    return daemon_status
+
+
+def _positive_int(option_value):
+    # argparse type for counts of at least one (e.g. jobs).
+    try:
+        _count = int(option_value)
+    except ValueError:
+        _count = 0
+    if _count < 1:
+        raise argparse.ArgumentTypeError(
+            'must be a whole number of at least 1, not {0!r}'.format(
+                option_value))
+    return _count
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('hfsvol', metavar='[HFS Volume]',
@@ -474,13 +1738,155 @@ if __name__ == '__main__':
                         help='Delimiter format (classic [default], macosx,'+
                         ' osx, companion)')
     parser.add_argument('-s', '--strict', action='store_true',
-                        help='Turn on strict mode for XML parsing',
-                        default='False')
+                        help='Indent the XML output as it is written')
+    parser.add_argument('--check', action='store_true',
+                        help='Check the shape of each fileobject against ' +
+                        'the DFXML schema as it is written')
+    parser.add_argument('-r', '--reader', type=str, choices=['native',
+                        'hfsutils'], default='native',
+                        help='Catalog reader (native [default] reads the ' +
+                        'image directly, hfsutils parses hls output)')
+    parser.add_argument('-H', '--hashing', type=str, choices=['image',
+                        'hcopy'], default='image',
+                        help='Source of data forks for hashing (image ' +
+                        '[default] reads extents from the disk image, ' +
+                        'hcopy copies each file out with hfsutils)')
+    parser.add_argument('-j', '--jobs', type=_positive_int, default=1,
+                        help='Number of hashing worker processes, or of ' +
+                        'images processed at once with --batch (default 1)')
+    parser.add_argument('-b', '--batch', action='store_true',
+                        help='Batch mode: [HFS Volume] is a directory or ' +
+                        'manifest file of disk images and [Output File] is ' +
+                        'a directory for one DFXML file per image')
+    parser.add_argument('-t', '--triage', action='store_true',
+                        help='Triage mode: only read the partition map and ' +
+                        'volume headers of [HFS Volume] (an image, or a ' +
+                        'directory or manifest with --batch) and write ' +
+                        'one JSON line per image to [Output File]')
+    parser.add_argument('-D', '--daemon', action='store_true',
+                        help='Daemon mode: [HFS Volume] is a spool ' +
+                        'directory taking job files in incoming/ and ' +
+                        '[Output File] is a directory for their DFXML; ' +
+                        'runs until interrupted, with -j jobs at once')
+    parser.add_argument('-c', '--cache', default=None,
+                        help='SQLite file caching libmagic and hash ' +
+                        'results between runs (created if missing)')
+    parser.add_argument('--cache-size', type=int,
+                        default=hfs_cache.MAX_ENTRIES,
+                        help='Maximum number of results kept in the ' +
+                        'cache (default {0})'.format(hfs_cache.MAX_ENTRIES))
+    parser.add_argument('--no-magic', dest='magic', action='store_false',
+                        help='Do not identify file types with libmagic')
+    parser.add_argument('--digests', default=','.join(
+                        hfs_digests.DEFAULT_DIGESTS),
+                        help='Comma-separated digests to compute for each ' +
+                        'fork, in a single pass ({0}; default {1})'.format(
+                        ', '.join(hfs_digests.DIGESTS),
+                        ','.join(hfs_digests.DEFAULT_DIGESTS)))
+    parser.add_argument('--index', default=None,
+                        help='Also write every catalog entry to this ' +
+                        'index for queries without parsing DFXML: SQLite ' +
+                        '(created if missing), or JSON Lines if it ends ' +
+                        'in .jsonl (appended to)')
+    parser.add_argument('--dedup', default=None,
+                        help='SQLite store of fork hashes shared across ' +
+                        'images: forks matching one already hashed in ' +
+                        'size, type/creator, first and last 64 KiB and ' +
+                        'one digest take its other digests and libmagic ' +
+                        '(created if missing)')
+    parser.add_argument('--stats', default=None,
+                        help='Write timing and resource use of the run ' +
+                        'to this JSON file')
+    parser.add_argument('--resume', action='store_true',
+                        help='Resume an interrupted run from its ' +
+                        'checkpoint journal ([Output File].journal), ' +
+                        'overwriting the partial output')
+    parser.add_argument('--baseline', default=None,
+                        help='DFXML of an earlier run on this volume; ' +
+                        'data forks unchanged since are not hashed again')
+    parser.add_argument('--differential', action='store_true',
+                        help='With --baseline, write only entries that ' +
+                        'are new, changed or deleted since the baseline')
     args = parser.parse_args()
+    digest_names = hfs_digests.check_digests(
+                       [_digest.strip().lower() for _digest in
+                        args.digests.split(',') if _digest.strip()])
+    if not digest_names:
+        sys.exit('hfs2dfxml error: --digests needs at least one digest.')
+
+    if args.differential and args.baseline is None:
+        sys.exit('hfs2dfxml error: --differential requires --baseline.')
+    if args.baseline is not None:
+        if args.batch or args.daemon:
+            sys.exit('hfs2dfxml error: --baseline is not supported ' +
+                     'with --batch or --daemon.')
+        if not os.path.isfile(args.baseline):
+            sys.exit('hfs2dfxml error: Baseline DFXML not found.')
+
+    if args.dedup is not None and (args.reader != 'native' or
+                                   args.hashing != 'image'):
+        sys.exit('hfs2dfxml error: --dedup requires --reader native and ' +
+                 '--hashing image.')
+
+    if args.triage:
+        if not os.path.exists(args.hfsvol):
+            sys.exit('hfs2dfxml error: HFS Volume not found.')
+        if os.path.isfile(args.output):
+            sys.exit('hfs2dfxml error: Output file already exists.')
+        if args.batch:
+            triage_files = [hfs_file for hfs_file, dfxml_name in
+                            _batch_images(args.hfsvol, unique_names=False)]
+        else:
+            triage_files = [args.hfsvol]
+        with open(args.output, 'w') as triageoutput:
+            triage_summary = hfs2dfxml_triage(triage_files, triageoutput,
+                                              args.jobs)
+        print('hfs2dfxml: {0} images triaged ({1} failed): '.format(
+              triage_summary['images'], triage_summary['failed']) +
+              '{0} volumes, {1} files, {2} folders, {3} bytes used.'.format(
+              triage_summary['volumes'], triage_summary['files'],
+              triage_summary['folders'], triage_summary['used_bytes']))
+        sys.exit(0)
+
+    options = HFSOptions(reader=args.reader, hashing=args.hashing,
+                         jobs=args.jobs, cache_path=args.cache,
+                         cache_size=args.cache_size, magic=args.magic,
+                         digests=digest_names, resume=args.resume,
+                         baseline_path=args.baseline,
+                         differential=args.differential,
+                         index_path=args.index, dedup_path=args.dedup,
+                         strict=args.strict, check=args.check)
+
+    if args.daemon:
+        if args.stats is not None:
+            sys.exit('hfs2dfxml error: --stats is not supported with ' +
+                     '--daemon (job status files include stats).')
+        daemon_status = hfs2dfxml_daemon(args.hfsvol, args.output,
+                                         args.delimiter, options, True)
+        print('hfs2dfxml: {0} jobs done, {1} failed.'.format(
+              daemon_status['done'], daemon_status['failed']))
+        sys.exit(0)
+
+    if args.batch:
+        if not os.path.exists(args.hfsvol):
+            sys.exit('hfs2dfxml error: Batch directory or manifest ' +
+                     'not found.')
+        batch_summary = hfs2dfxml_batch(args.hfsvol, args.output,
+                                        args.delimiter, options,
+                                        args.stats is not None)
+        if args.stats is not None:
+            with open(args.stats, 'w') as statsfile:
+                json.dump(batch_summary.pop('stats'), statsfile, indent=2)
+        for batch_failure in batch_summary['failed']:
+            print('{0}: {1}'.format(batch_failure['image'],
+                                    batch_failure['error']))
+        print('hfs2dfxml: {0} of {1} images processed.'.format(
+              batch_summary['succeeded'], batch_summary['images']))
+        sys.exit(1 if batch_summary['failed'] else 0)
 
     if os.path.isfile(args.hfsvol):
         hfs = args.hfsvol
-        if os.path.isfile(args.output):
+        if os.path.isfile(args.output) and not args.resume:
             sys.exit('hfs2dfxml error: Output file already exists.')
         else:
             dfxml = args.output
@@ -488,9 +1894,13 @@ if __name__ == '__main__':
         sys.exit('hfs2dfxml error: HFS Volume not found.')
 
     delim = args.delimiter
+    run_stats = None
+    if args.stats is not None:
+        run_stats = hfs_stats.RunStats()
 
     with open(dfxml, 'w') as dfxmloutput:
-        dfxmloutput.write(hfs2dfxml(hfs, delim).to_dfxml())
-    if args.strict is True:
-        subprocess.check_output(['xmllint', '--format', dfxml,
-                                 '--output', dfxml])
+        hfs2dfxml_stream(hfs, dfxmloutput, delim, options, run_stats,
+                         '{0}.journal'.format(dfxml))
+    if run_stats is not None:
+        with open(args.stats, 'w') as statsfile:
+            json.dump(run_stats.report(), statsfile, indent=2)
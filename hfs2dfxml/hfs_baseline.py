@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+#
+# hfs_baseline compares a volume against DFXML written by an earlier
+# hfs2dfxml run (the baseline), so that only forks that changed since
+# are hashed again, and so that a differential DFXML can be written.
+# Entries are matched by CNID within the same volume (the nth volume
+# of the baseline for the nth partition); the forks of a file are
+# unchanged if its name, sizes and timestamps are the same as in the
+# baseline.
+# Differential annotations follow make_differential_dfxml.py of the
+# DFXML project: new, deleted, renamed, modified (contents), changed
+# (other metadata).
+
+from datetime import datetime
+
+import Objects as DFXML
+
+import hfs_dedup
+import hfs_digests
+
+XMLNS_DELTA = 'http://www.forensicswiki.org/wiki/Forensic_Disk_Differencing'
+
+
+def _name_key(filename):
+    # Baseline may have been written with another delimiter.
+    if filename is None:
+        return None
+    return filename.replace('/', ':').lstrip(':')
+
+
+def _time_key(timestamp):
+    # Takes datetime, ISO 8601 string or DFXML TimestampObject.
+    # Returns ISO 8601 string to the second, without time zone.
+    if timestamp is None:
+        return None
+    _timestamp = timestamp
+    if not isinstance(_timestamp, (datetime, str)):
+        _timestamp = getattr(_timestamp, 'time', _timestamp)
+    if hasattr(_timestamp, 'isoformat'):
+        _timestamp = _timestamp.isoformat()
+    return str(_timestamp).replace(' ', 'T')[:19]
+
+
+def _int_key(value):
+    if value is None:
+        return None
+    return int(value)
+
+
+def _externals_key(fileobj):
+    # Digests are compared apart (see _digests_differ), and where they
+    # were taken from is not metadata of the fork.
+    return [(_elem.tag, _elem.text) for _elem in (fileobj.externals or [])
+            if _elem.tag not in (hfs_digests.HFS_HASHDIGEST,
+                                 hfs_dedup.HFS_DEDUP_SOURCE)]
+
+
+def _digests_differ(this_fileobj, base_fileobj):
+    # Compares only the digests both fileobjects have, so that adding a
+    # digest does not make every fork look modified.
+    _this_hashes = hfs_digests.fileobj_digests(this_fileobj)
+    _base_hashes = hfs_digests.fileobj_digests(base_fileobj)
+    return any(_this_hashes[_digest] != _base_hashes[_digest]
+               for _digest in _this_hashes if _digest in _base_hashes)
+
+
+def _complete_digests(fileobj, digests):
+    # Returns dict of digests of fileobj, or None if any is missing.
+    _hashes = hfs_digests.fileobj_digests(fileobj)
+    if any(_digest not in _hashes for _digest in digests):
+        return None
+    return {_digest: _hashes[_digest] for _digest in digests}
+
+
+class Baseline(object):
+    # Takes path to DFXML written by hfs2dfxml and index of the volume
+    # in it to compare against.
+    # Usage: filled() on the catalog entries before hashing, then
+    # annotate() on the fileobjects of each entry, then deleted().
+
+    def __init__(self, baseline_path, volume_index=0):
+        # CNID: [data fork FileObject, resource fork FileObject or None]
+        self._entries = {}
+        self._seen = set()
+        _last_entry = None
+        _volume = -1
+        for _event, _obj in DFXML.iterparse(baseline_path):
+            if isinstance(_obj, DFXML.VolumeObject):
+                if _event == 'start':
+                    _volume += 1
+                if _volume > volume_index:
+                    break
+                continue
+            if (_event != 'end' or not isinstance(_obj, DFXML.FileObject) or
+               _volume != volume_index):
+                continue
+            if _obj.inode is not None:
+                _last_entry = [_obj, None]
+                self._entries[int(_obj.inode)] = _last_entry
+            elif _last_entry is not None and _last_entry[1] is None:
+                _last_entry[1] = _obj  # Resource fork follows its data fork
+                _last_entry = None
+
+    def filled(self, hfs_lines, use_magic=True,
+               digests=hfs_digests.DEFAULT_DIGESTS):
+        # Takes iterable of HFSEntry, before hashing, whether libmagic
+        # is run and names of the digests computed.
+        # Yields the entries; forks unchanged since the baseline get the
+        # baseline's libmagic and hashes (and dedup source, if they were
+        # taken from a dedup store), so they are not hashed.
+        for this_line in hfs_lines:
+            self._seen.add(this_line.cnid)
+            if this_line.filename is not None:
+                _baseline = self._entries.get(this_line.cnid)
+                if _baseline is not None:
+                    self._fill(this_line, _baseline[0], _baseline[1],
+                               use_magic, digests)
+            yield this_line
+
+    def _fill(self, this_line, base_fileobj, base_rsrcobj, use_magic,
+              digests):
+        if (_name_key(base_fileobj.filename) !=
+           _name_key(this_line.filename) or
+           _int_key(base_fileobj.filesize) != this_line.filesize or
+           _int_key(getattr(base_rsrcobj, 'filesize', None)) !=
+           this_line.HFSrsrcsize or
+           _time_key(base_fileobj.mtime) != _time_key(this_line.mtime) or
+           _time_key(base_fileobj.crtime) != _time_key(this_line.crtime)):
+            return
+        if this_line.filesize:
+            _hashes = _complete_digests(base_fileobj, digests)
+            if _hashes is not None and (base_fileobj.libmagic is not None or
+                                        not use_magic):
+                if use_magic:
+                    this_line.libmagic = base_fileobj.libmagic
+                this_line.hashes = _hashes
+                this_line.dedup_source = hfs_dedup.fileobj_source(
+                                             base_fileobj)
+        if this_line.HFSrsrcsize:
+            this_line.rsrc_hashes = _complete_digests(base_rsrcobj, digests)
+            if this_line.rsrc_hashes is not None:
+                this_line.rsrc_dedup_source = hfs_dedup.fileobj_source(
+                                                  base_rsrcobj)
+
+    def annotate(self, this_fileobj, this_rsrcobj):
+        # Takes data and resource fork FileObjects of an entry (see
+        # _line_to_dfxml). Sets their differential annotations, and
+        # original fileobjects from the baseline.
+        # Returns the annotations (empty if the entry is unchanged).
+        _baseline = self._entries.get(_int_key(this_fileobj.inode))
+        if _baseline is None:
+            _annos = set(['new'])
+        else:
+            base_fileobj, base_rsrcobj = _baseline
+            _annos = set()
+            if (_name_key(this_fileobj.filename) !=
+               _name_key(base_fileobj.filename)):
+                _annos.add('renamed')
+            if (_int_key(this_fileobj.filesize) !=
+               _int_key(base_fileobj.filesize) or
+               _int_key(getattr(this_rsrcobj, 'filesize', None)) !=
+               _int_key(getattr(base_rsrcobj, 'filesize', None)) or
+               _digests_differ(this_fileobj, base_fileobj) or
+               _digests_differ(this_rsrcobj, base_rsrcobj)):
+                _annos.add('modified')
+            if (_time_key(this_fileobj.mtime) !=
+                _time_key(base_fileobj.mtime) or
+                _time_key(this_fileobj.crtime) !=
+                _time_key(base_fileobj.crtime) or
+                this_fileobj.libmagic != base_fileobj.libmagic or
+                _externals_key(this_fileobj) !=
+                _externals_key(base_fileobj)):
+                _annos.add('changed')
+            if _annos:
+                this_fileobj.original_fileobject = base_fileobj
+                if this_rsrcobj is not None and base_rsrcobj is not None:
+                    this_rsrcobj.original_fileobject = base_rsrcobj
+        if _annos:
+            this_fileobj.annos = set(_annos)
+            if this_rsrcobj is not None:
+                this_rsrcobj.annos = set(_annos)
+        return _annos
+
+    def deleted(self):
+        # Yields FileObjects (data fork, then resource fork) of baseline
+        # entries not seen by filled(), annotated as deleted.
+        for _cnid, _forks in self._entries.items():
+            if _cnid in self._seen:
+                continue
+            for base_obj in _forks:
+                if base_obj is not None:
+                    base_obj.annos = set(['deleted'])
+                    yield base_obj
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+#
+# hfs_cache keeps libmagic and hash results of earlier runs in a
+# SQLite database, so DFXML can be regenerated (e.g. with another
+# delimiter) without hashing every fork again.
+# Results are keyed by image fingerprint, CNID, fork, size and
+# modify date; the least recently used results are evicted once the
+# cache holds more than max_entries results.
+
+import os
+import json
+import mmap
+import sqlite3
+from hashlib import sha1
+
+import hfs_native
+
+MAX_ENTRIES = 1000000
+FINGERPRINT_BYTES = 64 * 1024
+USED_EVERY = 1000  # Cache hits whose use is recorded at a time
+
+
+def image_fingerprint(hfs_filename):
+    # Takes path to disk image.
+    # Returns sha1 of the image size, its first 64 KiB and the MDB of
+    # each HFS volume on it. The MDB holds the volume's modify date,
+    # file count and free blocks, so any write to a volume changes it.
+    # NOTE: This reads a few KiB, not the whole image.
+    _hasher = sha1()
+    with open(hfs_filename, 'rb') as hfs_file:
+        _image_size = os.fstat(hfs_file.fileno()).st_size
+        _hasher.update(str(_image_size).encode('ascii'))
+        _hasher.update(hfs_file.read(FINGERPRINT_BYTES))
+        if _image_size > 0:
+            with mmap.mmap(hfs_file.fileno(), 0,
+                           access=mmap.ACCESS_READ) as image:
+                for _offset, _length, _name in \
+                        hfs_native._partition_offsets(image):
+                    _mdb = _offset + hfs_native.MDB_OFFSET
+                    _hasher.update(image[_mdb:_mdb + hfs_native.SECTOR_SIZE])
+    return _hasher.hexdigest()
+
+
+def open_store(store_path):
+    # Takes path to SQLite file of fork results (created if missing).
+    # Returns connection to it, as used by HashCache and
+    # hfs_dedup.DedupStore.
+    # NOTE: Stores commit each put() at once, so that concurrent runs,
+    #       hashing workers and batch jobs sharing a store see each
+    #       other's results and never wait on each other's open
+    #       transactions. Stores are kept in WAL mode without syncing
+    #       every commit: they only hold results that can be computed
+    #       again.
+    _db = sqlite3.connect(store_path, timeout=60)
+    _db.execute('PRAGMA journal_mode=WAL')
+    _db.execute('PRAGMA synchronous=NORMAL')
+    return _db
+
+
+def merge_results(stored_row, libmagic, fork_hashes):
+    # Takes row (libmagic, JSON digests) already stored for a fork (or
+    # None), and its new libmagic (None if not run) and dict of digest
+    # name: hex digest.
+    # Returns (libmagic, JSON digests) to store: digests already stored
+    # are kept alongside the new ones, and so is libmagic if not run.
+    if stored_row is not None:
+        fork_hashes = dict(json.loads(stored_row[1]), **fork_hashes)
+        if libmagic is None:
+            libmagic = stored_row[0]
+    return libmagic, json.dumps(fork_hashes, sort_keys=True)
+
+
+class HashCache(object):
+    # Takes path to SQLite cache file (created if missing), path to the
+    # disk image whose results are looked up and stored, maximum
+    # number of results kept in the cache and byte offset of the
+    # partition (CNIDs are only unique within a volume).
+    # Usage: get() before hashing a fork, put() after; close() when done.
+    # NOTE: get() only reads; the use of the results it returns is
+    #       recorded USED_EVERY hits at a time (see also open_store).
+
+    def __init__(self, cache_path, hfs_filename, max_entries=MAX_ENTRIES,
+                 partition_offset=0):
+        self.fingerprint = image_fingerprint(hfs_filename)
+        if partition_offset:
+            self.fingerprint = '{0}@{1}'.format(self.fingerprint,
+                                                partition_offset)
+        self.max_entries = max_entries
+        self._db = open_store(cache_path)
+        self._db.execute('CREATE TABLE IF NOT EXISTS forks (' +
+                         'image TEXT, cnid INTEGER, fork TEXT, ' +
+                         'size INTEGER, mtime TEXT, libmagic TEXT, ' +
+                         'digests TEXT, used INTEGER, ' +
+                         'PRIMARY KEY (image, cnid, fork, size, mtime))')
+        self._db.execute('CREATE INDEX IF NOT EXISTS forks_used ' +
+                         'ON forks (used)')
+        _last_used = self._db.execute('SELECT MAX(used) ' +
+                                      'FROM forks').fetchone()[0]
+        self._clock = (_last_used or 0) + 1  # Same for the whole run
+        self._db.commit()
+        self._used = []  # Keys of hits not yet recorded as used
+
+    def _key(self, cnid, fork, size, mtime):
+        return (self.fingerprint, cnid, fork, size,
+                '' if mtime is None else str(mtime))
+
+    def _row(self, fork_key):
+        return self._db.execute('SELECT libmagic, digests FROM forks ' +
+                                'WHERE image = ? AND cnid = ? AND ' +
+                                'fork = ? AND size = ? AND mtime = ?',
+                                fork_key).fetchone()
+
+    def get(self, cnid, fork, size, mtime):
+        # Returns (libmagic, dict of digest name: hex digest) stored for
+        # the fork, or None.
+        _key = self._key(cnid, fork, size, mtime)
+        _row = self._row(_key)
+        if _row is None:
+            return None
+        self._used.append(_key)
+        if len(self._used) >= USED_EVERY:
+            self._record_used()
+        return _row[0], json.loads(_row[1])
+
+    def put(self, cnid, fork, size, mtime, libmagic, fork_hashes):
+        # Stores results for the fork; failed hashes (None) are not kept.
+        # Digests already stored for the fork are kept alongside.
+        if fork_hashes is None:
+            return
+        _key = self._key(cnid, fork, size, mtime)
+        with self._db:
+            self._db.execute('INSERT OR REPLACE INTO forks VALUES ' +
+                             '(?, ?, ?, ?, ?, ?, ?, ?)',
+                             _key + merge_results(self._row(_key), libmagic,
+                                                  fork_hashes) +
+                             (self._clock,))
+
+    def _record_used(self):
+        # Marks the results of recent hits as used in this run, in one
+        # short transaction.
+        with self._db:
+            self._db.executemany('UPDATE forks SET used = ? WHERE ' +
+                                 'image = ? AND cnid = ? AND fork = ? ' +
+                                 'AND size = ? AND mtime = ?',
+                                 [(self._clock,) + _key
+                                  for _key in self._used])
+        self._used = []
+
+    def evict(self):
+        # Drops least recently used results beyond max_entries, if the
+        # cache holds more than that (so it is only sorted when over).
+        _count = self._db.execute('SELECT COUNT(*) FROM forks').fetchone()[0]
+        if _count <= self.max_entries:
+            return
+        self._db.execute('DELETE FROM forks WHERE rowid IN (' +
+                         'SELECT rowid FROM forks ORDER BY used DESC ' +
+                         'LIMIT -1 OFFSET ?)', (self.max_entries,))
+        self._db.commit()
+
+    def close(self):
+        self._record_used()
+        self.evict()
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
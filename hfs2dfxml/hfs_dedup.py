@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+#
+# hfs_dedup reuses the hashes of a fork for its copies in other images
+# (or elsewhere in the same image), so that files found throughout a
+# collection, such as system files and installers, have libmagic run
+# and every digest computed once. Results are kept in a SQLite store
+# shared by every image and run that uses it.
+# Candidate copies are found by a cheap prefilter key: the fork's size,
+# its file's type/creator and a digest of its first and last EDGE_SIZE
+# bytes. The first fork with a key is hashed in full. A later fork with
+# the same key is read in full once more, but hashed in one digest only
+# (the last of those wanted, in DIGESTS order); if that matches the
+# store, it is a copy, and takes the other digests and libmagic from
+# the store. It records where they were taken from (the image,
+# partition, CNID and fork first hashed) in an hfs:dedup_source
+# element, as they were not computed from its own bytes.
+# NOTE: A fork whose key matches but whose confirming digest does not
+#       is hashed in full, and not stored: the key keeps the results of
+#       the first fork.
+
+import os
+import json
+import xml.etree.ElementTree as ET
+from hashlib import sha1
+
+import hfs_cache
+
+EDGE_SIZE = 64 * 1024  # Bytes read from each end of a fork
+HFS_DEDUP_SOURCE = '{http://www.forensicswiki.org/wiki/HFS}dedup_source'
+SOURCE_ATTRIBUTES = ('image', 'partition', 'cnid', 'fork')
+
+
+def prefilter_key(fork_size, type_creator, fork_head, fork_tail):
+    # Takes fork size, HFStype_creator of its file (or None) and its
+    # first and last EDGE_SIZE bytes (see HFSVolume.read_head and
+    # read_tail). Returns the fork's prefilter key.
+    _hasher = sha1()
+    _hasher.update('{0}\0{1}\0'.format(fork_size,
+                                       type_creator or '').encode('utf-8'))
+    _hasher.update(fork_head)
+    if fork_size > EDGE_SIZE:
+        _hasher.update(fork_tail)
+    return _hasher.hexdigest()
+
+
+def source_element(dedup_source):
+    # Takes dict of where a fork's results were taken from (see
+    # DedupStore.get). Returns hfs:dedup_source element recording it
+    # (image, partition, if any, CNID and fork as attributes).
+    _source = ET.Element(HFS_DEDUP_SOURCE)
+    for _attribute in SOURCE_ATTRIBUTES:
+        if dedup_source.get(_attribute) is not None:
+            _source.set(_attribute, str(dedup_source[_attribute]))
+    return _source
+
+
+def fileobj_source(this_fileobj):
+    # Takes DFXML FileObject (or None).
+    # Returns dict recorded by its hfs:dedup_source element, or None.
+    if this_fileobj is None:
+        return None
+    for _elem in this_fileobj.externals or []:
+        if _elem.tag == HFS_DEDUP_SOURCE:
+            dedup_source = {_attribute: _elem.get(_attribute)
+                            for _attribute in SOURCE_ATTRIBUTES}
+            for _attribute in ('partition', 'cnid'):
+                if dedup_source[_attribute] is not None:
+                    dedup_source[_attribute] = int(dedup_source[_attribute])
+            return dedup_source
+    return None
+
+
+class DedupStore(object):
+    # Takes path to SQLite store (created if missing), path to the disk
+    # image being hashed and number of its partition (None for a bare
+    # volume), recorded with the forks it adds.
+    # Usage: get() with the prefilter_key of a fork before hashing it,
+    # put() after; close() when done.
+    # NOTE: Shared by concurrent workers and jobs as a hash cache is
+    #       (see hfs_cache.open_store).
+
+    def __init__(self, store_path, hfs_filename=None, hfs_partition=None):
+        self.image = (os.path.abspath(hfs_filename) if hfs_filename
+                      else None)
+        self.partition = hfs_partition
+        self._db = hfs_cache.open_store(store_path)
+        self._db.execute('CREATE TABLE IF NOT EXISTS forks (' +
+                         'prefilter TEXT PRIMARY KEY, libmagic TEXT, ' +
+                         'digests TEXT, image TEXT, partition INTEGER, ' +
+                         'cnid INTEGER, fork TEXT)')
+        self._db.commit()
+
+    def get(self, prefilter, digests, use_magic=True):
+        # Returns (libmagic, dict of digest name: hex digest, dict of
+        # SOURCE_ATTRIBUTES) of the fork first hashed with this
+        # prefilter key, or None if there is none with all the digests
+        # (and libmagic, if use_magic) wanted.
+        _row = self._db.execute('SELECT libmagic, digests, image, ' +
+                                'partition, cnid, fork FROM forks ' +
+                                'WHERE prefilter = ?',
+                                (prefilter,)).fetchone()
+        if _row is None:
+            return None
+        _libmagic, _hashes = _row[0], json.loads(_row[1])
+        if any(_digest not in _hashes for _digest in digests):
+            return None  # Stored by a run with other digests
+        if use_magic and _libmagic is None:
+            return None  # Stored by a run without libmagic (or rsrc)
+        return (_libmagic if use_magic else None,
+                {_digest: _hashes[_digest] for _digest in digests},
+                dict(zip(SOURCE_ATTRIBUTES, _row[2:])))
+
+    def put(self, prefilter, libmagic, fork_hashes, cnid=None, fork=None):
+        # Stores results of a fully hashed fork, with its CNID and fork
+        # ('data' or 'rsrc'); failed hashes (None) are not kept. Digests
+        # already stored for the key are kept alongside.
+        if fork_hashes is None:
+            return
+        _row = self._db.execute('SELECT libmagic, digests FROM forks ' +
+                                'WHERE prefilter = ?',
+                                (prefilter,)).fetchone()
+        with self._db:
+            self._db.execute('INSERT OR REPLACE INTO forks VALUES ' +
+                             '(?, ?, ?, ?, ?, ?, ?)',
+                             (prefilter,) +
+                             hfs_cache.merge_results(_row, libmagic,
+                                                     fork_hashes) +
+                             (self.image, self.partition, cnid, fork))
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
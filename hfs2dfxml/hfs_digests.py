@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+#
+# hfs_digests computes any set of digests of a fork in a single pass
+# over its contents, so that adding a digest costs CPU time, not
+# another read of the fork. Results are dicts of digest name: hex
+# digest, for the data fork and the resource fork alike. Forks are
+# read in chunks as they are hashed, from the image or from hcopy.
+#
+# Reference: MacBinary II (hcopy -m), header fields at offsets 83
+#            (data fork length), 87 (resource fork length), 120
+#            (secondary header length) and 124 (CRC-16/XMODEM of the
+#            first 124 bytes)
+
+import sys
+import struct
+import binascii
+import hashlib
+import xml.etree.ElementTree as ET
+
+DIGESTS = ('md5', 'sha1', 'sha256', 'blake2b')  # In the order written
+DEFAULT_DIGESTS = ('md5', 'sha1')
+DFXML_DIGESTS = ('md5', 'sha1', 'sha256')  # FileObject has properties for
+HFS_HASHDIGEST = '{http://www.forensicswiki.org/wiki/HFS}hashdigest'
+MACBINARY_BLOCK = 128
+MACBINARY_CRC = 124  # Offset of the header CRC, and bytes it covers
+SKIP_SIZE = 64 * 1024  # Chunk size for bytes read and discarded
+
+
+def check_digests(digests):
+    # Takes iterable of digest names.
+    # Returns them as a tuple in DIGESTS order, without duplicates.
+    for _digest in digests:
+        if _digest not in DIGESTS:
+            sys.exit('hfs_digests error: Unknown digest ' +
+                     '{0} (choose from {1}).'.format(_digest,
+                                                     ', '.join(DIGESTS)))
+    return tuple(_digest for _digest in DIGESTS if _digest in digests)
+
+
+def digest_chunks(fork_chunks, digests, head_size=0):
+    # Takes iterable of a fork's contents in chunks (bytes or
+    # memoryview), digest names and how many bytes from its start to
+    # keep (e.g. for libmagic).
+    # Returns tuple (the first head_size bytes, dict of digest name:
+    # hex digest), reading each chunk once.
+    _hashers = [(_digest, hashlib.new(_digest)) for _digest in digests]
+    _head = bytearray()
+    for _chunk in fork_chunks:
+        if len(_head) < head_size:
+            _head += _chunk[:head_size - len(_head)]
+        for _digest, _hasher in _hashers:
+            _hasher.update(_chunk)
+    return bytes(_head), {_digest: _hasher.hexdigest()
+                          for _digest, _hasher in _hashers}
+
+
+def read_chunks(fork_fh, fork_len, chunk_size):
+    # Takes file open for reading (e.g. hcopy's output pipe), number of
+    # bytes to read (None to read to its end) and chunk size.
+    # Yields the bytes in chunks of up to chunk_size, reading each chunk
+    # only when it is needed, so a fork is never held in memory whole.
+    # Exits if the file ends before fork_len bytes.
+    _left = fork_len
+    while _left is None or _left > 0:
+        _chunk = fork_fh.read(chunk_size if _left is None
+                              else min(chunk_size, _left))
+        if not _chunk:
+            break
+        if _left is not None:
+            _left -= len(_chunk)
+        yield _chunk
+    if _left:
+        sys.exit('hfs_digests error: MacBinary forks truncated.')
+
+
+def skip(fork_fh, skip_len):
+    # Reads and discards skip_len bytes (see read_chunks).
+    for _chunk in read_chunks(fork_fh, skip_len, SKIP_SIZE):
+        pass
+
+
+def macbinary_header(macbinary_fh):
+    # Takes file open at the start of MacBinary output of hcopy -m.
+    # Reads its header and any secondary header, leaving the file at the
+    # start of the data fork.
+    # Returns tuple (data fork length, resource fork length).
+    # Exits if the header is truncated or its CRC does not match, rather
+    # than hash forks at the wrong offsets.
+    _header = macbinary_fh.read(MACBINARY_BLOCK)
+    if len(_header) < MACBINARY_BLOCK:
+        sys.exit('hfs_digests error: MacBinary header truncated.')
+    if (binascii.crc_hqx(_header[:MACBINARY_CRC], 0) !=
+       struct.unpack_from('>H', _header, MACBINARY_CRC)[0]):
+        sys.exit('hfs_digests error: MacBinary header CRC does not match.')
+    _data_len, _rsrc_len = struct.unpack_from('>II', _header, 83)
+    _secondary_len, = struct.unpack_from('>H', _header, 120)
+    skip(macbinary_fh, _padded(_secondary_len))
+    return _data_len, _rsrc_len
+
+
+def macbinary_padding(fork_len):
+    # Returns number of bytes of padding after a fork of fork_len bytes.
+    return _padded(fork_len) - fork_len
+
+
+def _padded(length):
+    # MacBinary pads each part to a multiple of 128 bytes.
+    return -(-length // MACBINARY_BLOCK) * MACBINARY_BLOCK
+
+
+def set_digests(this_fileobj, fork_hashes):
+    # Takes DFXML FileObject and dict of digest name: hex digest.
+    # Digests the DFXML bindings have properties for are set on the
+    # FileObject; others are added as hfs:hashdigest elements, with the
+    # digest name as type (as in DFXML hashdigest).
+    for _digest in DIGESTS:
+        if _digest not in fork_hashes:
+            continue
+        if _digest in DFXML_DIGESTS:
+            setattr(this_fileobj, _digest, fork_hashes[_digest])
+        else:
+            _hashdigest = ET.Element(HFS_HASHDIGEST)
+            _hashdigest.set('type', _digest)
+            _hashdigest.text = fork_hashes[_digest]
+            this_fileobj.externals.append(_hashdigest)
+
+
+def fileobj_digests(this_fileobj):
+    # Takes DFXML FileObject (or None).
+    # Returns dict of digest name: hex digest set by set_digests.
+    fork_hashes = {}
+    if this_fileobj is None:
+        return fork_hashes
+    for _digest in DFXML_DIGESTS:
+        if getattr(this_fileobj, _digest, None) is not None:
+            fork_hashes[_digest] = getattr(this_fileobj, _digest)
+    for _elem in this_fileobj.externals or []:
+        if _elem.tag == HFS_HASHDIGEST and _elem.get('type') in DIGESTS:
+            fork_hashes[_elem.get('type')] = _elem.text
+    return fork_hashes
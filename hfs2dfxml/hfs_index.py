@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+#
+# hfs_index writes the catalog entries of each volume to an index that
+# can be queried without parsing DFXML: a SQLite database with indexes
+# on digests, names, type/creator and CNIDs, or JSON Lines with one
+# object per entry. An index may hold any number of images and volumes,
+# so a collection can be searched at once (e.g. for a sha1).
+#
+# SQLite tables:
+#   files  (image, volume, cnid, name_type, path, name, size, rsrc_size,
+#           crtime, mtime, libmagic, HFStype_creator, HFSlocked, HFSflags)
+#   hashes (image, volume, cnid, fork, digest, value)
+# where image is the absolute path of the disk image, volume the index
+# of the volume in its DFXML, path the DFXML filename of the data fork,
+# name the HFS name of the entry and fork 'data' or 'rsrc'.
+
+import os
+import sys
+import json
+import sqlite3
+
+INSERT_EVERY = 1000  # Entries inserted per transaction
+INDEXES = (('files_name', 'files (name)'),
+           ('files_type_creator', 'files (HFStype_creator)'),
+           ('files_cnid', 'files (image, volume, cnid)'),
+           ('hashes_value', 'hashes (value)'),
+           ('hashes_cnid', 'hashes (image, volume, cnid)'))
+
+
+def _entry_row(hfs_line, path):
+    # Takes HFSEntry and DFXML filename of its data fork.
+    # Returns dict of the columns of the files table.
+    return {'cnid': hfs_line.cnid,
+            'name_type': hfs_line.name_type,
+            'path': path,
+            'name': (hfs_line.filename or
+                     hfs_line.dirname).rsplit(':', 1)[-1],
+            'size': hfs_line.filesize,
+            'rsrc_size': hfs_line.HFSrsrcsize,
+            'crtime': (hfs_line.crtime.isoformat() if hfs_line.crtime
+                       else None),
+            'mtime': hfs_line.mtime.isoformat() if hfs_line.mtime else None,
+            'libmagic': hfs_line.libmagic,
+            'HFStype_creator': hfs_line.HFStype_creator,
+            'HFSlocked': hfs_line.HFSlocked,
+            'HFSflags': hfs_line.HFSflags}
+
+
+def open_index(index_path, hfs_filename, volume_index=0):
+    # Takes path to index file, path to disk image and index of the
+    # volume in the DFXML.
+    # Returns JSONLIndex if index_path ends in .jsonl, else SQLiteIndex.
+    if index_path.endswith('.jsonl'):
+        return JSONLIndex(index_path, hfs_filename, volume_index)
+    return SQLiteIndex(index_path, hfs_filename, volume_index)
+
+
+class SQLiteIndex(object):
+    # Takes path to SQLite index (created if missing), path to disk image
+    # and index of the volume in the DFXML. Entries already indexed for
+    # the volume are replaced.
+    # Usage: add() each entry; close() when done.
+    # NOTE: Entries are inserted in bulk, and table indexes are created
+    #       on close(), so that building a new index does not update
+    #       them for every entry.
+
+    def __init__(self, index_path, hfs_filename, volume_index=0):
+        self.image = os.path.abspath(hfs_filename)
+        self.volume = volume_index
+        self._db = sqlite3.connect(index_path, timeout=60)
+        self._db.execute('CREATE TABLE IF NOT EXISTS files (' +
+                         'image TEXT, volume INTEGER, cnid INTEGER, ' +
+                         'name_type TEXT, path TEXT, name TEXT, ' +
+                         'size INTEGER, rsrc_size INTEGER, crtime TEXT, ' +
+                         'mtime TEXT, libmagic TEXT, HFStype_creator TEXT, ' +
+                         'HFSlocked TEXT, HFSflags TEXT)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS hashes (' +
+                         'image TEXT, volume INTEGER, cnid INTEGER, ' +
+                         'fork TEXT, digest TEXT, value TEXT)')
+        for _table in ('files', 'hashes'):
+            self._db.execute('DELETE FROM {0} '.format(_table) +
+                             'WHERE image = ? AND volume = ?',
+                             (self.image, self.volume))
+        self._db.commit()
+        self._files = []
+        self._hashes = []
+
+    def add(self, hfs_line, path):
+        # Takes HFSEntry (after hashing) and DFXML filename of its data
+        # fork.
+        _row = _entry_row(hfs_line, path)
+        _row.update(image=self.image, volume=self.volume)
+        self._files.append(_row)
+        for _fork, _fork_hashes in (('data', hfs_line.hashes),
+                                    ('rsrc', hfs_line.rsrc_hashes)):
+            for _digest, _value in (_fork_hashes or {}).items():
+                self._hashes.append((self.image, self.volume,
+                                     hfs_line.cnid, _fork, _digest, _value))
+        if len(self._files) >= INSERT_EVERY:
+            self._insert()
+
+    def _insert(self):
+        # Inserts pending entries in one transaction.
+        with self._db:
+            self._db.executemany('INSERT INTO files VALUES (' +
+                                 ':image, :volume, :cnid, :name_type, ' +
+                                 ':path, :name, :size, :rsrc_size, ' +
+                                 ':crtime, :mtime, :libmagic, ' +
+                                 ':HFStype_creator, :HFSlocked, ' +
+                                 ':HFSflags)', self._files)
+            self._db.executemany('INSERT INTO hashes VALUES ' +
+                                 '(?, ?, ?, ?, ?, ?)', self._hashes)
+        self._files = []
+        self._hashes = []
+
+    def close(self):
+        self._insert()
+        with self._db:
+            for _index_name, _index_on in INDEXES:
+                self._db.execute('CREATE INDEX IF NOT EXISTS ' +
+                                 '{0} ON {1}'.format(_index_name, _index_on))
+        self._db.close()
+
+
+class JSONLIndex(object):
+    # Takes path to JSON Lines index (appended to), path to disk image
+    # and index of the volume in the DFXML.
+    # Each entry is written as one JSON object with the columns of the
+    # SQLite files table, plus hashes and rsrc_hashes (dicts of digest
+    # name: hex digest, or null).
+    # Usage: add() each entry; close() when done.
+    # NOTE: Unlike SQLiteIndex, entries of earlier runs are not
+    #       replaced. Lines are written INSERT_EVERY at a time, each in
+    #       one write() to a file opened with O_APPEND, so processes
+    #       appending to the same file never interleave within a line.
+
+    def __init__(self, index_path, hfs_filename, volume_index=0):
+        self.image = os.path.abspath(hfs_filename)
+        self.volume = volume_index
+        self._fd = os.open(index_path, os.O_WRONLY | os.O_APPEND |
+                           os.O_CREAT, 0o666)
+        self._lines = []
+
+    def add(self, hfs_line, path):
+        # Takes HFSEntry (after hashing) and DFXML filename of its data
+        # fork.
+        _row = {'image': self.image, 'volume': self.volume}
+        _row.update(_entry_row(hfs_line, path))
+        _row.update(hashes=hfs_line.hashes, rsrc_hashes=hfs_line.rsrc_hashes)
+        self._lines.append((json.dumps(_row, ensure_ascii=False) +
+                            '\n').encode('utf-8'))
+        if len(self._lines) >= INSERT_EVERY:
+            self._write()
+
+    def _write(self):
+        for _line in self._lines:
+            if os.write(self._fd, _line) != len(_line):
+                sys.exit('JSONLIndex error: Short write to index ' +
+                         '(disk full?).')
+        self._lines = []
+
+    def close(self):
+        self._write()
+        os.close(self._fd)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+#
+# hfs_journal checkpoints the hash results of a run to a journal file,
+# so an interrupted run can be resumed without hashing the forks it had
+# already hashed. On resume the catalog is walked again (which is cheap
+# next to hashing) and written out from the start, so the output is
+# the same as that of an uninterrupted run.
+#
+# The journal is a JSON line identifying the image and options, then
+# one JSON line per hashed fork: [CNID, fork, size, modify date,
+# libmagic, {digest name: hex digest}].
+
+import os
+import sys
+import json
+import time
+
+import hfs_cache
+import hfs_digests
+
+CHECKPOINT_ENTRIES = 256
+CHECKPOINT_SECONDS = 30
+
+
+class HashJournal(object):
+    # Takes path to journal file, path to disk image, whether libmagic is
+    # run, whether to resume from an existing journal (otherwise it is
+    # started afresh), HashCache (or None) to fall back on and names of
+    # the digests computed.
+    # Has the same get() and put() as HashCache, so it can stand in for
+    # one; results are checkpointed (flushed to disk) every
+    # CHECKPOINT_ENTRIES results or CHECKPOINT_SECONDS seconds.
+    # Only results resumed from are held in memory; new ones are only
+    # appended to the journal.
+    # NOTE: The journal is kept when closed; remove it once the output
+    #       is complete.
+
+    def __init__(self, journal_path, hfs_filename, use_magic=True,
+                 resume=False, hash_cache=None,
+                 digests=hfs_digests.DEFAULT_DIGESTS):
+        self.journal_path = journal_path
+        self.hash_cache = hash_cache
+        self._header = {'image': hfs_cache.image_fingerprint(hfs_filename),
+                        'magic': use_magic, 'digests': list(digests)}
+        self._results = {}
+        if resume and os.path.isfile(journal_path):
+            self._load()
+        # Rewritten even on resume, dropping any line torn by a crash;
+        # written aside and renamed over the journal, so a crash while
+        # rewriting it does not lose the checkpoint
+        _rewrite_path = '{0}.tmp'.format(journal_path)
+        self._journal = open(_rewrite_path, 'w')
+        self._journal.write(json.dumps(self._header) + '\n')
+        for _key, _result in self._results.items():
+            self._journal.write(json.dumps(list(_key + _result)) + '\n')
+        self.checkpoint()
+        self._journal.close()
+        os.replace(_rewrite_path, journal_path)
+        self._journal = open(journal_path, 'a')
+
+    def _load(self):
+        with open(self.journal_path) as journalfile:
+            try:
+                _header = json.loads(journalfile.readline())
+            except ValueError:
+                return  # Interrupted before the first checkpoint
+            if _header != self._header:
+                sys.exit('HashJournal error: {0} '.format(self.journal_path) +
+                         'was written for another image or with other ' +
+                         'options.')
+            for journal_line in journalfile:
+                try:
+                    _record = json.loads(journal_line)
+                except ValueError:
+                    break  # Last line was torn by a crash
+                self._results[tuple(_record[:4])] = tuple(_record[4:])
+
+    def _key(self, cnid, fork, size, mtime):
+        return (cnid, fork, size, '' if mtime is None else str(mtime))
+
+    def get(self, cnid, fork, size, mtime):
+        # Returns (libmagic, dict of digest name: hex digest) journaled
+        # (or cached) for the fork, or None.
+        _key = self._key(cnid, fork, size, mtime)
+        if _key in self._results:
+            return self._results[_key]
+        if self.hash_cache is None:
+            return None
+        _cached = self.hash_cache.get(cnid, fork, size, mtime)
+        if _cached is not None:
+            self._record(_key, tuple(_cached))
+        return _cached
+
+    def put(self, cnid, fork, size, mtime, libmagic, fork_hashes):
+        # Journals results for the fork; failed hashes (None) are not kept.
+        if fork_hashes is None:
+            return
+        self._record(self._key(cnid, fork, size, mtime),
+                     (libmagic, fork_hashes))
+        if self.hash_cache is not None:
+            self.hash_cache.put(cnid, fork, size, mtime, libmagic,
+                                fork_hashes)
+
+    def _record(self, journal_key, journal_result):
+        self._journal.write(json.dumps(list(journal_key + journal_result)) +
+                            '\n')
+        self._unsaved += 1
+        if (self._unsaved >= CHECKPOINT_ENTRIES or
+           time.monotonic() - self._last_checkpoint >= CHECKPOINT_SECONDS):
+            self.checkpoint()
+
+    def checkpoint(self):
+        # Flushes journaled results to disk.
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._unsaved = 0
+        self._last_checkpoint = time.monotonic()
+
+    def close(self):
+        if not self._journal.closed:
+            self.checkpoint()
+            self._journal.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,492 @@
+#!/usr/bin/env python3
+#
+# hfs_native reads HFS volumes directly from a disk image,
+# without hfsutils. It parses the Master Directory Block and walks
+# the catalog B-tree, producing the same entry records as hls parsing.
+#
+# Reference: Inside Macintosh: Files, Chapter 2 (Data Organization
+#            on Volumes)
+
+import os
+import sys
+import mmap
+import struct
+from datetime import datetime
+from datetime import timedelta
+
+
+HFS_EPOCH = datetime(1904, 1, 1)
+HFS_SIGNATURE = b'BD'
+MDB_OFFSET = 1024  # Master Directory Block is logical block 2
+SECTOR_SIZE = 512
+
+# CNIDs reserved by HFS
+ROOT_CNID = 2
+EXTENTS_CNID = 3
+CATALOG_CNID = 4
+
+# Catalog data record types
+CDR_DIR = 1
+CDR_FILE = 2
+
+NDX_NODE = 0  # Index node kind in B-tree node descriptors
+
+FNDR_ISINVISIBLE = 0x4000  # Finder flag (fdFlags / frFlags)
+FIL_LOCKED = 0x01  # filFlags bit 0
+
+# drSigWord, drCrDate, drLsMod, drAtrb, drNmFls, drVBMSt, drAllocPtr,
+# drNmAlBlks, drAlBlkSiz, drClpSiz, drAlBlSt, drNxtCNID, drFreeBks, drVN
+MDB_STRUCT = struct.Struct('>2sIIHHHHHIIHIH28p')
+# drXTFlSize, drXTExtRec, drCTFlSize, drCTExtRec
+MDB_FILES_STRUCT = struct.Struct('>I12sI12s')
+MDB_FILES_OFFSET = 130
+EXTENT_STRUCT = struct.Struct('>HHHHHH')
+NODE_DESC_STRUCT = struct.Struct('>IIbBHxx')
+# depth, root, leafRecords, firstLeaf, lastLeaf, nodeSize
+BTH_STRUCT = struct.Struct('>HIIIIH')
+DIR_STRUCT = struct.Struct('>HHIIII')
+FILE_STRUCT = struct.Struct('>BB4s4sH6xIHIIHIIII')
+FILE_EXTENTS_STRUCT = struct.Struct('>12s12s')  # filExtRec, filRExtRec
+FILE_EXTENTS_OFFSET = 74
+DATA_FORK = 0x00
+RSRC_FORK = 0xFF
+READ_SIZE = 1024 * 1024  # Largest slice handed to hashers at once
+
+
+class ForkError(Exception):
+    # A fork that cannot be read from the image: its extents do not
+    # cover its logical size, or run past the end of a truncated image.
+    # Raised while reading the fork, so that only that fork is lost.
+    pass
+
+
+class HFSEntry(object):
+    # One file or directory from the catalog, as it moves through the
+    # parse -> hash -> DFXML pipeline. Attributes are named after the
+    # DFXML tags they become; unset attributes are None.
+    # Byte runs are tuples of (file offset, fs offset, image offset, length).
+    # Hashes of each fork are dicts of digest name: hex digest; results
+    # taken from a dedup store record their source (see hfs_dedup).
+    __slots__ = ('cnid', 'name_type', 'filename', 'dirname', 'filesize',
+                 'HFSrsrcsize', 'HFSlocked', 'HFSflags', 'HFStype_creator',
+                 'crtime', 'mtime', 'libmagic', 'hashes', 'rsrc_hashes',
+                 'data_runs', 'rsrc_runs', 'dedup_source',
+                 'rsrc_dedup_source')
+
+    def __init__(self, **kwargs):
+        for _slot in self.__slots__:
+            setattr(self, _slot, kwargs.get(_slot))
+
+
+def _hfs_date(hfs_seconds):
+    # Takes an HFS timestamp (seconds since midnight, January 1, 1904,
+    # local time). Returns a datetime at full (one second) resolution.
+    return HFS_EPOCH + timedelta(seconds=hfs_seconds)
+
+
+def _decode_name(raw_name):
+    # HFS names are stored as MacRoman, the same encoding hls output
+    # is decoded with.
+    return raw_name.decode('macroman')
+
+
+def _decode_type_creator(raw_type, raw_creator):
+    # Formats file type and creator the way hls does (TYPE/CRTR).
+    return '{0}/{1}'.format(raw_type.decode('macroman').replace('\x00', ' '),
+                            raw_creator.decode('macroman').replace('\x00',
+                                                                   ' '))
+
+
+def _partition_offsets(image):
+    # Takes an mmap (or bytes) of a disk image.
+    # Returns list of (byte offset, byte length, partition name) tuples
+    # for each HFS volume found. Bare HFS volumes return a single tuple
+    # at offset 0; Apple partition maps return one per Apple_HFS entry.
+    if image[MDB_OFFSET:MDB_OFFSET + 2] == HFS_SIGNATURE:
+        return [(0, len(image), None)]
+    if image[0:2] != b'ER':
+        return []
+    partitions = []
+    map_entries = 1
+    block = 1
+    while block <= map_entries:
+        _entry = image[block * SECTOR_SIZE:(block + 1) * SECTOR_SIZE]
+        if len(_entry) < SECTOR_SIZE or _entry[0:2] != b'PM':
+            break
+        map_entries, part_start, part_count = struct.unpack_from('>III',
+                                                                 _entry, 4)
+        part_name = _entry[16:48].split(b'\x00', 1)[0].decode('macroman')
+        part_type = _entry[48:80].split(b'\x00', 1)[0]
+        if part_type == b'Apple_HFS':
+            partitions.append((part_start * SECTOR_SIZE,
+                               part_count * SECTOR_SIZE, part_name))
+        block += 1
+    return partitions
+
+
+def partitions(hfs_filename):
+    # Takes path to disk image.
+    # Returns _partition_offsets of the image (empty if none found).
+    with open(hfs_filename, 'rb') as hfs_file:
+        if os.fstat(hfs_file.fileno()).st_size == 0:
+            return []
+        with mmap.mmap(hfs_file.fileno(), 0,
+                       access=mmap.ACCESS_READ) as image:
+            return _partition_offsets(image)
+
+
+def block_geometry(hfs_filename):
+    # Takes path to disk image.
+    # Returns (block size, block count) as libmagic describes the image:
+    # from the driver descriptor of a partition map (sbBlkSize,
+    # sbBlkCount), or the Master Directory Block of a bare HFS volume
+    # (drAlBlkSiz, drNmAlBlks); (None, None) for neither.
+    with open(hfs_filename, 'rb') as hfs_file:
+        _head = hfs_file.read(MDB_OFFSET + MDB_STRUCT.size)
+    if _head[0:2] == b'ER' and len(_head) >= 8:
+        return struct.unpack_from('>HI', _head, 2)
+    if (_head[MDB_OFFSET:MDB_OFFSET + 2] == HFS_SIGNATURE and
+       len(_head) == MDB_OFFSET + MDB_STRUCT.size):
+        (_sig, _create_date, _modify_date, _attributes, _root_files,
+         _vbm_start, _alloc_ptr, _alloc_blocks, _alloc_block_size,
+         _clump_size, _alloc_start, _next_cnid, _free_blocks,
+         _volname) = MDB_STRUCT.unpack_from(_head, MDB_OFFSET)
+        return _alloc_block_size, _alloc_blocks
+    return None, None
+
+
+class _BTree(object):
+    # Minimal read-only HFS B-tree: node access and record iteration.
+
+    def __init__(self, hfs_vol, extents):
+        self.vol = hfs_vol
+        self.extents = extents
+        header = self._raw_node(0, SECTOR_SIZE)
+        (self.depth, self.root, self.leaf_records, self.first_leaf,
+         self.last_leaf, self.node_size) = BTH_STRUCT.unpack_from(
+                                               header, NODE_DESC_STRUCT.size)
+
+    def _raw_node(self, node_num, node_size):
+        # Nodes never span extents, since allocation blocks are
+        # multiples of the node size.
+        fork_offset = node_num * node_size
+        for ext_fork_offset, ext_img_offset, ext_length in self.extents:
+            if ext_fork_offset <= fork_offset < ext_fork_offset + ext_length:
+                _start = ext_img_offset + fork_offset - ext_fork_offset
+                if _start + node_size > len(self.vol.image):
+                    sys.exit('_BTree error: Node {0} past end of '.format(
+                             node_num) + 'image.')
+                return self.vol.image[_start:_start + node_size]
+        sys.exit('_BTree error: Node {0} outside of B-tree file.'.format(
+                 node_num))
+
+    def node(self, node_num):
+        # Returns (fLink, kind, list of records) for a node.
+        raw = self._raw_node(node_num, self.node_size)
+        flink, _blink, kind, _height, num_recs = NODE_DESC_STRUCT.unpack_from(
+                                                     raw)
+        offsets = struct.unpack_from('>{0}H'.format(num_recs + 1), raw,
+                                     self.node_size - 2 * (num_recs + 1))
+        offsets = offsets[::-1]
+        records = [raw[offsets[i]:offsets[i + 1]] for i in range(num_recs)]
+        return flink, kind, records
+
+    def records_from(self, node_num):
+        # Yields records starting at node_num, following forward links
+        # through the leaf level.
+        while node_num != 0:
+            flink, _kind, records = self.node(node_num)
+            for record in records:
+                yield record
+            node_num = flink
+
+
+def _record_key(record):
+    # Returns (key bytes, data offset) for a B-tree record.
+    key_length = record[0]
+    data_offset = 1 + key_length
+    if data_offset % 2:
+        data_offset += 1
+    return record[1:1 + key_length], data_offset
+
+
+def _catalog_key(key):
+    # Catalog keys: reserved byte, parent ID, Str31 node name.
+    parent_id = struct.unpack_from('>I', key, 1)[0]
+    name_length = key[5] if len(key) > 5 else 0
+    return parent_id, key[6:6 + name_length]
+
+
+class HFSVolume(object):
+    # Read-only view of an HFS volume inside a disk image.
+    # The image is memory-mapped; nothing is copied except the
+    # B-tree nodes currently being read. Fork contents are read
+    # straight from the mapping via their extents.
+    # With header_only, only the Master Directory Block is read (see
+    # hfs_triage); walk() and fork_runs() are then unavailable.
+
+    def __init__(self, hfs_filename, offset=None, header_only=False):
+        self._file = open(hfs_filename, 'rb')
+        if os.fstat(self._file.fileno()).st_size == 0:
+            sys.exit('HFSVolume error: Empty disk image.')
+        self.image = mmap.mmap(self._file.fileno(), 0,
+                               access=mmap.ACCESS_READ)
+        if offset is None:
+            _partitions = _partition_offsets(self.image)
+            if not _partitions:
+                self.close()
+                sys.exit('HFSVolume error: No HFS volume found in ' +
+                         '{0}.'.format(hfs_filename))
+            offset = _partitions[0][0]
+        self.offset = offset
+        self._read_mdb()
+        if header_only:
+            return
+        try:
+            self.extents_tree = _BTree(self, self._fork_extents(
+                                                 self._xt_size,
+                                                 self._xt_extrec,
+                                                 EXTENTS_CNID, DATA_FORK,
+                                                 overflow=False))
+            self.catalog_tree = _BTree(self, self._fork_extents(
+                                                 self._ct_size,
+                                                 self._ct_extrec,
+                                                 CATALOG_CNID, DATA_FORK))
+        except ForkError as e:
+            self.close()
+            sys.exit('HFSVolume error: {0}'.format(e))
+
+    def close(self):
+        self.image.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _read_mdb(self):
+        _mdb_start = self.offset + MDB_OFFSET
+        if self.image[_mdb_start:_mdb_start + 2] != HFS_SIGNATURE:
+            self.close()
+            sys.exit('HFSVolume error: HFS signature not found at ' +
+                     'offset {0}.'.format(self.offset))
+        (_sig, self.create_date, self.modify_date, self.attributes,
+         self.root_files, _vbm_start, _alloc_ptr, self.alloc_blocks,
+         self.alloc_block_size, _clump_size, self.alloc_start,
+         self.next_cnid, self.free_blocks, _volname) = MDB_STRUCT.unpack_from(
+                                                       self.image, _mdb_start)
+        self.name = _decode_name(_volname)
+        self.backup_date, = struct.unpack_from('>I', self.image,
+                                               _mdb_start + 64)
+        self.file_count, self.dir_count = struct.unpack_from('>II', self.image,
+                                                             _mdb_start + 84)
+        (self._xt_size, self._xt_extrec, self._ct_size,
+         self._ct_extrec) = MDB_FILES_STRUCT.unpack_from(
+                                self.image, _mdb_start + MDB_FILES_OFFSET)
+
+    def _alloc_offset(self, alloc_block):
+        # Byte offset in the image of an allocation block.
+        return (self.offset + self.alloc_start * SECTOR_SIZE +
+                alloc_block * self.alloc_block_size)
+
+    def _overflow_records(self, cnid, fork_type):
+        # Yields extent records from the extents overflow file for a fork,
+        # in order of starting allocation block within the fork.
+        # Extent keys: key length, fork type, file ID, starting file block.
+        _found = []
+        for record in self.extents_tree.records_from(
+                          self.extents_tree.first_leaf):
+            key, data_offset = _record_key(record)
+            if len(key) < 7:
+                continue
+            _fork_type, _file_id, _start_block = struct.unpack_from('>BIH',
+                                                                    key)
+            if _file_id == cnid and _fork_type == fork_type:
+                _found.append((_start_block, record[data_offset:
+                                                    data_offset + 12]))
+        _found.sort()
+        for _start_block, extrec in _found:
+            yield extrec
+
+    def _fork_extents(self, logical_size, first_extrec, cnid, fork_type,
+                      overflow=True, partial=False):
+        # Takes the logical size and first extent record of a fork.
+        # Returns list of (fork offset, image offset, length) tuples covering
+        # the logical size of the fork; raises ForkError if the extents
+        # do not cover it, unless partial (then returns those there are).
+        # fork_type is 0x00 for data forks and 0xFF for resource forks.
+        extents = []
+        fork_offset = 0
+
+        def _add(extrec):
+            _fork_offset = fork_offset
+            _ext = EXTENT_STRUCT.unpack(extrec)
+            for start_block, block_count in zip(_ext[0::2], _ext[1::2]):
+                if block_count == 0 or _fork_offset >= logical_size:
+                    break
+                _length = min(block_count * self.alloc_block_size,
+                              logical_size - _fork_offset)
+                extents.append((_fork_offset,
+                                self._alloc_offset(start_block), _length))
+                _fork_offset += _length
+            return _fork_offset
+
+        fork_offset = _add(first_extrec)
+        if fork_offset < logical_size and overflow:
+            for extrec in self._overflow_records(cnid, fork_type):
+                fork_offset = _add(extrec)
+                if fork_offset >= logical_size:
+                    break
+        if fork_offset < logical_size and not partial:
+            raise ForkError('Extents for CNID {0} do not cover '.format(cnid) +
+                            'fork ({0} of {1} bytes).'.format(fork_offset,
+                                                              logical_size))
+        return extents
+
+    def fork_runs(self, logical_size, first_extrec, cnid, fork_type):
+        # Returns tuple of (file offset, fs offset, image offset, length)
+        # tuples for a fork, suitable for DFXML byte_runs. Extents that do
+        # not cover the fork give the runs there are; read_runs fails on
+        # them instead, so that the catalog can still be walked.
+        return tuple((_fork_offset, _img_offset - self.offset, _img_offset,
+                 _length) for _fork_offset, _img_offset, _length in
+                     self._fork_extents(logical_size, first_extrec, cnid,
+                                        fork_type, partial=True))
+
+    def read_runs(self, fork_runs, read_size=READ_SIZE, fork_size=None):
+        # Takes byte runs of a fork (see fork_runs) and its logical size
+        # (None if not known).
+        # Yields memoryview slices of the mapped image, in file order,
+        # without copying fork contents. Raises ForkError if the runs do
+        # not cover fork_size, or run past the end of the image.
+        _covered = sum(_run[3] for _run in fork_runs)
+        if fork_size is not None and _covered < fork_size:
+            raise ForkError('Byte runs do not cover fork ' +
+                            '({0} of {1} bytes).'.format(_covered, fork_size))
+        with memoryview(self.image) as image_view:
+            for _file_offset, _fs_offset, img_offset, length in fork_runs:
+                _end = img_offset + length
+                if _end > len(self.image):
+                    raise ForkError('Byte run past end of image ' +
+                                    '({0}+{1}).'.format(img_offset, length))
+                while img_offset < _end:
+                    _chunk = image_view[img_offset:min(img_offset + read_size,
+                                                       _end)]
+                    yield _chunk
+                    _chunk.release()
+                    img_offset += read_size
+
+    def read_head(self, fork_runs, head_size):
+        # Returns up to head_size bytes from the start of a fork.
+        _head = bytearray()
+        for _file_offset, _fs_offset, img_offset, length in fork_runs:
+            if len(_head) >= head_size:
+                break
+            _head += self.image[img_offset:img_offset +
+                                min(length, head_size - len(_head))]
+        return bytes(_head)
+
+    def read_tail(self, fork_runs, tail_size):
+        # Returns up to tail_size bytes from the end of a fork.
+        _tail = b''
+        for _file_offset, _fs_offset, img_offset, length in reversed(
+                                                                fork_runs):
+            if len(_tail) >= tail_size:
+                break
+            _take = min(length, tail_size - len(_tail))
+            _tail = (self.image[img_offset + length - _take:
+                                img_offset + length] + _tail)
+        return _tail
+
+    def _children(self, dir_id):
+        # Yields (name, catalog data record) for each child of a directory,
+        # in catalog order (the order hls -U lists them).
+        # Descends the index to the first record keyed (dir_id, ''),
+        # which is the directory's thread record.
+        tree = self.catalog_tree
+        node_num = tree.root
+        while True:
+            flink, kind, records = tree.node(node_num)
+            if kind != NDX_NODE:
+                break
+            _next = None
+            for record in records:
+                key, data_offset = _record_key(record)
+                parent_id, name = _catalog_key(key)
+                if parent_id < dir_id or (parent_id == dir_id and not name):
+                    _next = record
+                else:
+                    break
+            if _next is None:
+                _next = records[0]
+            key, data_offset = _record_key(_next)
+            node_num = struct.unpack_from('>I', _next, data_offset)[0]
+        for record in tree.records_from(node_num):
+            key, data_offset = _record_key(record)
+            parent_id, name = _catalog_key(key)
+            if parent_id < dir_id:
+                continue
+            if parent_id > dir_id:
+                break
+            if record[data_offset] in (CDR_DIR, CDR_FILE):
+                yield name, record[data_offset:]
+
+    def walk(self):
+        # Yields HFSEntry per file or directory, depth-first in the same
+        # order as hls -RU, with the same values as hls parsing produces
+        # plus the byte runs of each fork (data_runs, rsrc_runs).
+        # Only the directories pending at each level are held in memory.
+        pending = [(ROOT_CNID, '')]
+        while pending:
+            dir_id, dir_path = pending.pop()
+            subdirs = []
+            for raw_name, data in self._children(dir_id):
+                hfs_line = self._entry(data, '{0}:{1}'.format(
+                                                dir_path,
+                                                _decode_name(raw_name)))
+                if hfs_line.name_type == 'd':
+                    subdirs.append((hfs_line.cnid, hfs_line.dirname))
+                yield hfs_line
+            pending.extend(reversed(subdirs))
+
+    def _entry(self, data, path):
+        # Takes catalog data record and full path of entry.
+        # Returns HFSEntry with formatted values corresponding to DFXML tags.
+        HFS_line = HFSEntry()
+        if data[0] == CDR_DIR:
+            (_dir_flags, _valence, dir_id, crdate, mddate,
+             _bkdate) = DIR_STRUCT.unpack_from(data, 2)
+            fndr_flags = struct.unpack_from('>H', data, 30)[0]
+            HFS_line.cnid = dir_id
+            HFS_line.name_type = 'd'
+            HFS_line.dirname = path
+        else:
+            (fil_flags, _fil_type, fd_type, fd_creator, fndr_flags, fil_id,
+             _stblk, data_size, _pylen, _rstblk, rsrc_size, _rpylen,
+             crdate, mddate) = FILE_STRUCT.unpack_from(data, 2)
+            data_extrec, rsrc_extrec = FILE_EXTENTS_STRUCT.unpack_from(
+                                           data, FILE_EXTENTS_OFFSET)
+            HFS_line.cnid = fil_id
+            HFS_line.name_type = 'r'
+            if fil_flags & FIL_LOCKED:
+                HFS_line.HFSlocked = '1'
+            HFS_line.HFSrsrcsize = rsrc_size
+            HFS_line.filesize = data_size
+            _type_creator = _decode_type_creator(fd_type, fd_creator)
+            if ((_type_creator != '    /    ') and
+               (_type_creator != '????/????')):
+                HFS_line.HFStype_creator = _type_creator
+            HFS_line.filename = path
+            HFS_line.data_runs = self.fork_runs(data_size, data_extrec,
+                                                fil_id, DATA_FORK)
+            HFS_line.rsrc_runs = self.fork_runs(rsrc_size, rsrc_extrec,
+                                                fil_id, RSRC_FORK)
+        if fndr_flags & FNDR_ISINVISIBLE:
+            HFS_line.HFSflags = 'i'
+        if crdate != 0:
+            HFS_line.crtime = _hfs_date(crdate)
+        if mddate != 0:
+            HFS_line.mtime = _hfs_date(mddate)
+        return HFS_line
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+#
+# hfs_replay records the output of the hfsutils commands run by
+# hfs2dfxml (hmount, humount, hls, hcopy) and replays it later, without
+# hfsutils or the disk image. Set hfs2dfxml._hfsutils to a Recorder or
+# a Replayer; both stand in for the subprocess functions hfs2dfxml uses.
+#
+# A recording is a directory holding an index of calls (replay.json)
+# and their outputs, concatenated (replay.bin). Outputs may also be
+# synthetic: pseudo-random bytes of a given size, generated on replay.
+
+import io
+import os
+import sys
+import json
+import mmap
+import random
+import subprocess
+
+INDEX_NAME = 'replay.json'
+OUTPUTS_NAME = 'replay.bin'
+SYNTHETIC_BLOCK = 64 * 1024
+
+
+def _replay_key(args):
+    # hmount is keyed without the image path, so a recording replays
+    # wherever (and whether or not) the image is.
+    if args[0] == 'hmount':
+        return json.dumps(['hmount'] + list(args[2:]))
+    return json.dumps(list(args))
+
+
+def synthetic_output(size, seed):
+    # Returns size bytes of pseudo-random data, the same for each seed.
+    _block = random.Random(seed).randbytes(min(size, SYNTHETIC_BLOCK))
+    if len(_block) == 0:
+        return b''
+    return (_block * (size // len(_block) + 1))[:size]
+
+
+class _ReplayedProcess(object):
+    # Stands in for subprocess.Popen of a command that already finished.
+
+    def __init__(self, args, output, returncode):
+        self.args = args
+        self.stdout = io.BytesIO(output)
+        self.stderr = None
+        self.returncode = None
+        self._returncode = returncode
+
+    def poll(self):
+        self.returncode = self._returncode
+        return self.returncode
+
+    def wait(self, timeout=None):
+        return self.poll()
+
+    def kill(self):
+        pass
+
+    terminate = kill
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stdout.close()
+        self.wait()
+
+
+class _HFSUtils(object):
+    # check_call, check_output and Popen, as used by hfs2dfxml, on top
+    # of _run(args, stderr), which returns (output, return code).
+    # NOTE: Popen only returns once the command has finished.
+
+    def _run(self, args, stderr=None):
+        raise NotImplementedError
+
+    def check_call(self, args, stderr=None, **kwargs):
+        _output, _returncode = self._run(args, stderr)
+        if _returncode != 0:
+            raise subprocess.CalledProcessError(_returncode, args)
+        return 0
+
+    def check_output(self, args, stderr=None, **kwargs):
+        _output, _returncode = self._run(args, stderr)
+        if _returncode != 0:
+            raise subprocess.CalledProcessError(_returncode, args, _output)
+        return _output
+
+    def Popen(self, args, stdout=None, stderr=None, **kwargs):
+        _output, _returncode = self._run(args, stderr)
+        return _ReplayedProcess(args, _output, _returncode)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class Recorder(_HFSUtils):
+    # Takes directory for a new recording.
+    # Runs each command for real and records its output; add() records
+    # a call without running anything (e.g., for synthetic recordings).
+    # NOTE: Only calls made in this process are recorded, so record
+    #       with a single hashing job.
+
+    def __init__(self, recording_dir):
+        os.makedirs(recording_dir, exist_ok=True)
+        self.recording_dir = recording_dir
+        self._index = {}
+        self._outputs = open(os.path.join(recording_dir, OUTPUTS_NAME), 'wb')
+
+    def add(self, args, output=b'', returncode=0, synthetic=None):
+        # Records output of a call, or (size, seed) of synthetic output.
+        _call = {'returncode': returncode}
+        if synthetic is not None:
+            _call['synthetic'] = list(synthetic)
+        else:
+            _call['offset'] = self._outputs.tell()
+            _call['length'] = len(output)
+            self._outputs.write(output)
+        self._index.setdefault(_replay_key(args), []).append(_call)
+
+    def _run(self, args, stderr=None):
+        _result = subprocess.run(args, stdout=subprocess.PIPE,
+                                 stderr=(subprocess.STDOUT
+                                         if stderr == subprocess.STDOUT
+                                         else None))
+        self.add(args, _result.stdout, _result.returncode)
+        return _result.stdout, _result.returncode
+
+    def close(self):
+        if self._outputs.closed:
+            return
+        self._outputs.close()
+        with open(os.path.join(self.recording_dir, INDEX_NAME),
+                  'w') as indexfile:
+            json.dump(self._index, indexfile)
+
+
+class Replayer(_HFSUtils):
+    # Takes directory of a recording.
+    # Returns recorded output for each command instead of running it.
+    # Repeated calls replay the recorded calls in order; once those run
+    # out, the last one is replayed again.
+
+    def __init__(self, recording_dir):
+        with open(os.path.join(recording_dir, INDEX_NAME)) as indexfile:
+            self._index = json.load(indexfile)
+        self._calls = {}
+        self._outputs = open(os.path.join(recording_dir, OUTPUTS_NAME), 'rb')
+        self._mmap = None
+        # NOTE: mmap (not seek and read), so forked workers can share it
+        if os.fstat(self._outputs.fileno()).st_size > 0:
+            self._mmap = mmap.mmap(self._outputs.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+
+    def _run(self, args, stderr=None):
+        _key = _replay_key(args)
+        if _key not in self._index:
+            sys.exit('Replayer error: No recorded output for ' +
+                     '{0}.'.format(' '.join(args)))
+        _recorded = self._index[_key]
+        _call = self._calls.get(_key, 0)
+        self._calls[_key] = _call + 1
+        _result = _recorded[min(_call, len(_recorded) - 1)]
+        if 'synthetic' in _result:
+            _output = synthetic_output(*_result['synthetic'])
+        else:
+            _output = self._mmap[_result['offset']:_result['offset'] +
+                                 _result['length']] if self._mmap else b''
+        return _output, _result['returncode']
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._outputs.close()
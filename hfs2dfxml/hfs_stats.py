@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+#
+# hfs_stats collects where an hfs2dfxml run spends its time and
+# resources: wall and CPU time per stage, subprocesses spawned, bytes
+# hashed, the slowest files and peak memory use.
+# Stage times are exclusive: time spent in a stage nested inside
+# another (e.g. reading the catalog while hashing pulls the next
+# entry) only counts towards the inner stage.
+
+import sys
+import time
+import heapq
+import resource
+from contextlib import nullcontext
+
+SLOWEST_FILES = 10
+_NO_STAGE = nullcontext()
+
+
+def _rss_kib(rusage):
+    # ru_maxrss is in bytes on macOS, KiB elsewhere.
+    if sys.platform == 'darwin':
+        return rusage.ru_maxrss // 1024
+    return rusage.ru_maxrss
+
+
+class _StageTimer(object):
+    # Times a with block as one call of a stage (see RunStats.stage).
+
+    def __init__(self, run_stats, stage_name):
+        self.run_stats = run_stats
+        self.stage_name = stage_name
+
+    def __enter__(self):
+        self._nested = [0.0, 0.0]  # Wall and CPU time of nested stages
+        self.run_stats._stack.append(self._nested)
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _wall = time.perf_counter() - self._wall
+        _cpu = time.process_time() - self._cpu
+        _stack = self.run_stats._stack
+        _stack.pop()
+        _stage = self.run_stats.stages.get(self.stage_name)
+        if _stage is None:
+            _stage = {'wall': 0.0, 'cpu': 0.0, 'calls': 0}
+            self.run_stats.stages[self.stage_name] = _stage
+        _stage['wall'] += _wall - self._nested[0]
+        _stage['cpu'] += _cpu - self._nested[1]
+        _stage['calls'] += 1
+        if _stack:
+            _stack[-1][0] += _wall
+            _stack[-1][1] += _cpu
+        return False
+
+
+class RunStats(object):
+    # Takes optional list of hooks, each called as hook(event, details):
+    # 'file' with dict of path, seconds and bytes after each fork is
+    # hashed, and 'report' with the report (see report()) when a run
+    # finishes. Pass to hfs_volobj (or hfs2dfxml, hfs2dfxml_stream)
+    # and call report() afterwards.
+    # NOTE: CPU time per stage is for this process only; hashing worker
+    #       processes and hfsutils are included in children_cpu.
+
+    def __init__(self, hooks=None, slowest=SLOWEST_FILES):
+        self.hooks = list(hooks or [])
+        self.stages = {}
+        self.subprocesses = {}
+        self.files_hashed = 0
+        self.bytes_hashed = 0
+        self.slowest = slowest
+        self._slowest_files = []  # Heap of (seconds, path, bytes)
+        self._stack = []
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+
+    def stage(self, stage_name):
+        # Returns context manager timing its with block as stage_name.
+        return _StageTimer(self, stage_name)
+
+    def timed_iter(self, stage_name, iterable):
+        # Yields items of iterable, timing each step as stage_name.
+        _iterator = iter(iterable)
+        while True:
+            with _StageTimer(self, stage_name):
+                try:
+                    item = next(_iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def add_subprocesses(self, spawned):
+        # Takes dict of command: number of subprocesses spawned.
+        for command, count in spawned.items():
+            self.subprocesses[command] = (self.subprocesses.get(command, 0) +
+                                          count)
+
+    def add_file(self, path, seconds, nbytes):
+        # Records a hashed fork.
+        self.files_hashed += 1
+        self.bytes_hashed += nbytes
+        self._add_slowest((seconds, path, nbytes))
+        for hook in self.hooks:
+            hook('file', {'path': path, 'seconds': seconds, 'bytes': nbytes})
+
+    def add_report(self, run_report):
+        # Takes report of a run in another process (e.g. one partition
+        # scanned by a worker) and adds its stages, subprocesses and
+        # hashed files to this run. Hooks are not called for its files.
+        for stage_name, stage_time in run_report['stages'].items():
+            _stage = self.stages.setdefault(stage_name, {'wall': 0.0,
+                                                         'cpu': 0.0,
+                                                         'calls': 0})
+            for _field in _stage:
+                _stage[_field] += stage_time[_field]
+        self.add_subprocesses({command: count for command, count in
+                               run_report['subprocesses'].items()
+                               if command != 'total'})
+        self.files_hashed += run_report['files_hashed']
+        self.bytes_hashed += run_report['bytes_hashed']
+        for _file in run_report['slowest_files']:
+            self._add_slowest((_file['seconds'], _file['path'],
+                               _file['bytes']))
+
+    def _add_slowest(self, file_entry):
+        # Keeps file_entry (seconds, path, bytes) if among the slowest.
+        if len(self._slowest_files) < self.slowest:
+            heapq.heappush(self._slowest_files, file_entry)
+        elif self.slowest > 0 and file_entry > self._slowest_files[0]:
+            heapq.heapreplace(self._slowest_files, file_entry)
+
+    def report(self):
+        # Returns dict of everything recorded so far, JSON serializable.
+        _self_usage = resource.getrusage(resource.RUSAGE_SELF)
+        _children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        _subprocesses = dict(self.subprocesses)
+        _subprocesses['total'] = sum(self.subprocesses.values())
+        return {'wall': time.perf_counter() - self._wall,
+                'cpu': time.process_time() - self._cpu,
+                'children_cpu': (_children_usage.ru_utime +
+                                 _children_usage.ru_stime),
+                'stages': {stage_name: dict(stage_time) for
+                           stage_name, stage_time in self.stages.items()},
+                'subprocesses': _subprocesses,
+                'files_hashed': self.files_hashed,
+                'bytes_hashed': self.bytes_hashed,
+                'slowest_files': [{'path': path, 'seconds': seconds,
+                                   'bytes': nbytes}
+                                  for seconds, path, nbytes in
+                                  sorted(self._slowest_files, reverse=True)],
+                'peak_rss_kib': _rss_kib(_self_usage),
+                'peak_rss_children_kib': _rss_kib(_children_usage)}
+
+    def finish(self):
+        # Calls 'report' hooks. Returns the report.
+        run_report = self.report()
+        for hook in self.hooks:
+            hook('report', run_report)
+        return run_report
+
+
+def stage(run_stats, stage_name):
+    # Same as run_stats.stage(stage_name); does nothing without RunStats.
+    if run_stats is None:
+        return _NO_STAGE
+    return run_stats.stage(stage_name)
+
+
+def timed_iter(run_stats, stage_name, iterable):
+    # Same as run_stats.timed_iter(); iterable as-is without RunStats.
+    if run_stats is None:
+        return iterable
+    return run_stats.timed_iter(stage_name, iterable)
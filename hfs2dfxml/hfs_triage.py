@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+#
+# hfs_triage summarizes a disk image from its partition map and the
+# Master Directory Block of each HFS volume on it. Nothing is mounted,
+# libmagic is not run and the catalog is not walked, so only a few
+# sectors are read per image: enough to estimate how much work a full
+# hfs2dfxml run on a collection of images will be.
+
+import os
+import sys
+
+import hfs_native
+
+VOL_LOCKED = 0x8080  # drAtrb bits 7 (hardware lock) and 15 (software lock)
+
+
+def _hfs_time(hfs_seconds):
+    # HFS dates of 0 were never set (e.g. a volume never backed up).
+    if not hfs_seconds:
+        return None
+    return hfs_native._hfs_date(hfs_seconds).isoformat()
+
+
+def volume_summary(hfs_vol):
+    # Takes HFSVolume (header_only is enough).
+    # Returns dict of its Master Directory Block fields.
+    return {'name': hfs_vol.name,
+            'created': _hfs_time(hfs_vol.create_date),
+            'modified': _hfs_time(hfs_vol.modify_date),
+            'backed_up': _hfs_time(hfs_vol.backup_date),
+            'block_size': hfs_vol.alloc_block_size,
+            'block_count': hfs_vol.alloc_blocks,
+            'free_blocks': hfs_vol.free_blocks,
+            'free_bytes': hfs_vol.free_blocks * hfs_vol.alloc_block_size,
+            'used_bytes': ((hfs_vol.alloc_blocks - hfs_vol.free_blocks) *
+                           hfs_vol.alloc_block_size),
+            'files': hfs_vol.file_count,
+            'folders': hfs_vol.dir_count,
+            'locked': bool(hfs_vol.attributes & VOL_LOCKED)}
+
+
+def triage(hfs_filename):
+    # Takes path to disk image.
+    # Returns dict of the image path, its size, whether it has a
+    # partition map, and a volume_summary per HFS volume with partition
+    # number (None for a bare HFS volume; numbered from 1 as hmount
+    # does otherwise), byte offset and byte length. Images that cannot
+    # be read have error set instead of raising, so one bad image does
+    # not stop the triage of a collection.
+    image_summary = {'image': hfs_filename, 'size': None,
+                     'partition_map': False, 'volumes': [], 'error': None}
+    try:
+        image_summary['size'] = os.path.getsize(hfs_filename)
+        _partitions = hfs_native.partitions(hfs_filename)
+        if not _partitions:
+            sys.exit('hfs_triage error: No HFS volume found.')
+        image_summary['partition_map'] = _partitions[0][0] != 0
+        for _number, (_offset, _length, _name) in enumerate(_partitions, 1):
+            with hfs_native.HFSVolume(hfs_filename, _offset,
+                                      header_only=True) as hfs_vol:
+                vol_summary = volume_summary(hfs_vol)
+            vol_summary['partition'] = (_number if
+                                        image_summary['partition_map']
+                                        else None)
+            vol_summary['partition_offset'] = _offset
+            vol_summary['partition_length'] = _length
+            image_summary['volumes'].append(vol_summary)
+    except (Exception, SystemExit) as e:
+        image_summary['error'] = str(e) or type(e).__name__
+    return image_summary
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+#
+# hfs_writer streams DFXML to a file as fileobjects are produced,
+# instead of rendering a whole DFXMLObject at the end of a run.
+# The document and volume headers and trailers are rendered by the
+# Python DFXML Bindings, so the output matches DFXMLObject.to_dfxml().
+# Output can be indented as it is written (as xmllint --format would),
+# and each fileobject checked against the shape the DFXML schema
+# expects, so the file is written once and never read back.
+
+import re
+import sys
+import shutil
+import xml.etree.ElementTree as ET
+
+DFXML_NS = 'http://www.forensicswiki.org/wiki/Category:Digital_Forensics_XML'
+HFS_NS = 'http://www.forensicswiki.org/wiki/HFS'
+INDENT = '  '  # Per level, as xmllint --format
+XML_DECLARATION = '<?xml version="1.0"?>\n'
+_PLACEHOLDER = 'hfs2dfxml:stream'
+_FILEOBJECT_LEVEL = 2  # dfxml > volume > fileobject
+_NAME_TYPES = set('-pcdbrlshwv')
+_INTEGERS = ('filesize', 'inode', 'alloc')
+_HEX_LENGTHS = {'md5': 32, 'sha1': 40, 'sha256': 64, 'blake2b': 128}
+_PATTERNHEX = re.compile(r'^[0-9a-f]+$')
+_PATTERNTIME = re.compile(r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}' +
+                          r'(\.\d+)?(Z|[+-]\d{2}:\d{2})?$')
+
+
+def _split_element(this_elem, indent=None, level=0):
+    # Takes an ElementTree element, and indent per level (None for no
+    # indentation) with the level of the element in the document.
+    # Returns the serialized element as (everything before its closing
+    # tag, closing tag onwards).
+    this_elem.append(ET.Comment(_PLACEHOLDER))
+    if indent is not None:
+        ET.indent(this_elem, indent, level)
+    _rendered = ET.tostring(this_elem, encoding='unicode')
+    _head, _tail = _rendered.split('<!--{0}-->'.format(_PLACEHOLDER))
+    if indent is not None:
+        _head = _head.rstrip()  # Children add their own indentation
+    return _head, _tail
+
+
+def _dfxml_tag(this_elem):
+    # Returns tag of element in the DFXML namespace without namespace;
+    # the DFXML Bindings leave it unqualified (it is the default
+    # namespace of the document), but parsed DFXML has it qualified.
+    return this_elem.tag.replace('{{{0}}}'.format(DFXML_NS), '', 1)
+
+
+def check_fileobject(this_elem):
+    # Takes rendered fileobject Element.
+    # Exits if it is not shaped as the DFXML schema expects: a
+    # fileobject with a filename, name_type of one character from the
+    # schema's set, non-negative integer sizes, inodes and byte runs,
+    # ISO 8601 times and hash digests of the right length for their type.
+    # NOTE: Checks shape only; this is not schema validation.
+    _children = {_dfxml_tag(_child): _child.text for _child in this_elem}
+    _problems = []
+    if _dfxml_tag(this_elem) != 'fileobject':
+        _problems.append('element is not a fileobject')
+    if not _children.get('filename'):
+        _problems.append('no filename')
+    _name_type = _children.get('name_type')
+    if _name_type is not None and _name_type not in _NAME_TYPES:
+        _problems.append('name_type {0!r}'.format(_name_type))
+    for _tag in _INTEGERS:
+        _value = _children.get(_tag)
+        if _value is not None and not _value.isdigit():
+            _problems.append('{0} {1!r}'.format(_tag, _value))
+    for _tag in ('crtime', 'mtime', 'atime', 'ctime'):
+        _value = _children.get(_tag)
+        if _value is not None and not _PATTERNTIME.match(_value):
+            _problems.append('{0} {1!r}'.format(_tag, _value))
+    for _elem in this_elem.iter():
+        _tag = _dfxml_tag(_elem)
+        if _tag == 'byte_run':
+            for _attr, _value in _elem.items():
+                if not _value.isdigit():
+                    _problems.append('byte_run {0} {1!r}'.format(_attr,
+                                                                _value))
+        elif _tag in ('hashdigest', '{{{0}}}hashdigest'.format(HFS_NS)):
+            _type = (_elem.get('type') or '').lower()
+            _value = _elem.text or ''
+            if (len(_value) != _HEX_LENGTHS.get(_type) or
+                    not _PATTERNHEX.match(_value)):
+                _problems.append('{0} hashdigest {1!r}'.format(_type,
+                                                               _value))
+    if _problems:
+        sys.exit('check_fileobject error: Fileobject {0!r}: {1}.'.format(
+                 _children.get('filename'), ', '.join(_problems)))
+
+
+def render_fileobject(fileobj, namespaces, indent=None, check=False):
+    # Takes FileObject and dict of prefix: URI of namespaces declared on
+    # the root element, and optional indent per level (with which the
+    # fileobject is preceded by its own line) and whether to check its
+    # shape (see check_fileobject). Returns the serialized fileobject
+    # without its own declarations of those namespaces.
+    _elem = fileobj.to_Element()
+    if check:
+        check_fileobject(_elem)
+    _prefix = ''
+    if indent is not None:
+        ET.indent(_elem, indent, _FILEOBJECT_LEVEL)
+        _prefix = '\n' + indent * _FILEOBJECT_LEVEL
+    _rendered = ET.tostring(_elem, encoding='unicode')
+    for _prefix_ns, _uri in namespaces.items():
+        _rendered = _rendered.replace(' xmlns:{0}="{1}"'.format(_prefix_ns,
+                                                                _uri),
+                                      '', 1)
+    return _prefix + _rendered
+
+
+class DFXMLStreamWriter(object):
+    # Takes an open output file, a DFXMLObject without volumes,
+    # optional dict of prefix: URI of other namespaces used, indent
+    # per level (None to write the document on one line) and whether to
+    # check the shape of each fileobject (see check_fileobject).
+    # Usage: open_volume(volobj), write_fileobject(fileobj) (or
+    # write_fragment) as many times as needed, close_volume(); repeat
+    # per volume, then close().
+    # Only the fileobject being written is held in memory.
+
+    def __init__(self, output_fh, dfxml_root, namespaces=None, indent=None,
+                 check=False):
+        self.output_fh = output_fh
+        self.namespaces = {'hfs': HFS_NS}
+        self.namespaces.update(namespaces or {})
+        self.indent = indent
+        self.check = check
+        _root_elem = dfxml_root.to_Element()
+        # HFS (and other) namespaces are declared once on the root
+        # element, not on every fileobject.
+        for _prefix, _uri in sorted(self.namespaces.items()):
+            _root_elem.set('xmlns:{0}'.format(_prefix), _uri)
+        self._root_head, self._root_tail = _split_element(_root_elem,
+                                                          indent)
+        self._volume_tail = None
+        if indent is not None:
+            self.output_fh.write(XML_DECLARATION)
+        self.output_fh.write(self._root_head)
+
+    def open_volume(self, volobj):
+        # Takes VolumeObject without fileobjects; writes its header.
+        _volume_head, self._volume_tail = _split_element(volobj.to_Element(),
+                                                         self.indent, 1)
+        if self.indent is not None:
+            self.output_fh.write('\n' + self.indent)
+        self.output_fh.write(_volume_head)
+
+    def write_fileobject(self, fileobj):
+        self.output_fh.write(render_fileobject(fileobj, self.namespaces,
+                                               self.indent, self.check))
+
+    def write_fragment(self, fragment_fh):
+        # Takes open file of fileobjects rendered elsewhere (e.g. by a
+        # worker process) with render_fileobject(fileobj, namespaces,
+        # indent, check) of this writer.
+        shutil.copyfileobj(fragment_fh, self.output_fh)
+
+    def close_volume(self):
+        self.output_fh.write(self._volume_tail)
+        self._volume_tail = None
+
+    def close(self):
+        if self._volume_tail is not None:
+            self.close_volume()
+        self.output_fh.write(self._root_tail)
+        if self.indent is not None:
+            self.output_fh.write('\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:  # Leave a failed run visibly truncated
+            self.close()
@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+#
+# Benchmarks each stage of hfs2dfxml without hfsutils or a disk image,
+# by replaying hfsutils output (see hfs2dfxml/hfs_replay.py), and the
+# native reader on a synthetic disk image of the same volume (see
+# hfs_image.py).
+#
+#   generate: write a synthetic recording (hls listings, fork contents)
+#             and disk image
+#   record:   record hfsutils output for a real disk image
+#   run:      replay a recording, timing parsing, enrichment, hashing
+#             and DFXML serialization separately; then, if the
+#             recording has a disk image, reading its catalog and
+#             hashing forks from it
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import struct
+import argparse
+from datetime import datetime
+from datetime import timedelta
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'hfs2dfxml'))
+import Objects as DFXML
+import hfs2dfxml
+import hfs_digests
+import hfs_replay
+import hfs_writer
+import hfs_image
+
+HLS_CRE_ARGS = ['hls', '-1acilQRUFN']
+HLS_MOD_ARGS = ['hls', '-1amilQRUFN']
+STAGES = ('parse', 'enrich', 'hash', 'serialize', 'pipeline', 'catalog',
+          'image_hash')
+IMAGE_NAME = 'synthetic.img'  # Disk image in a synthetic recording
+HFS_EPOCH = datetime(1904, 1, 1)
+
+
+def _hls_date(this_date):
+    # Formats a date as hls does for dates over six months old.
+    return '{0:%b} {1:>2}  {2}'.format(this_date, this_date.day,
+                                       this_date.year)
+
+
+def _synthetic_tree(entries, depth, dirs_per_dir, file_size, seed):
+    # Returns root directory of a synthetic volume with entries files
+    # and directories, at most depth levels deep, as nested dicts.
+    # File sizes are spread evenly between 0 and 2 * file_size.
+    rng = random.Random(seed)
+    cnids = iter(range(16, 16 + entries))
+
+    def _dates():
+        _crdate = datetime(1985, 1, 1) + timedelta(days=rng.randrange(5000))
+        return _crdate, _crdate + timedelta(days=rng.randrange(3000))
+
+    root = {'name': '', 'children': []}
+    all_dirs = [root]
+    this_level = [root]
+    for _level in range(depth):
+        next_level = []
+        for parent in this_level:
+            for _dirnum in range(dirs_per_dir):
+                if len(all_dirs) - 1 >= entries // 10:
+                    break  # Keep most entries for files
+                _crdate, _mdate = _dates()
+                this_dir = {'name': 'Folder {0}'.format(len(all_dirs)),
+                            'cnid': next(cnids), 'crdate': _crdate,
+                            'mdate': _mdate, 'children': []}
+                parent['children'].append(this_dir)
+                all_dirs.append(this_dir)
+                next_level.append(this_dir)
+        this_level = next_level
+    for _filenum, this_cnid in enumerate(cnids):
+        _crdate, _mdate = _dates()
+        _name = 'file {0}'.format(_filenum)
+        if _filenum % 10 == 0:
+            _name += ' é'  # Exercise non-ASCII names (hcopy uses ?)
+        all_dirs[_filenum % len(all_dirs)]['children'].append({
+            'name': _name, 'cnid': this_cnid, 'crdate': _crdate,
+            'mdate': _mdate, 'size': rng.randint(0, 2 * file_size),
+            'rsrc': rng.choice((0, 0, 0, 286)),
+            'type_creator': rng.choice(('TEXT/ttxt', 'APPL/CREA',
+                                        'PICT/8BIM', '????/????'))})
+    return root
+
+
+def _hls_listing(root, date_key):
+    # Returns hls -R listing of a synthetic volume (see _synthetic_tree)
+    # with creation ('crdate') or modification ('mdate') dates.
+    hls_out = []
+
+    def _list_dir(this_dir, dir_path):
+        subdirs = []
+        for child in this_dir['children']:
+            if 'children' in child:
+                _items = len(child['children'])
+                hls_out.append('{0:>7} d  {1:>9} item{2} {3} "{4}":'.format(
+                               child['cnid'], _items,
+                               '' if _items == 1 else 's',
+                               _hls_date(child[date_key]), child['name']))
+                subdirs.append(child)
+            else:
+                hls_out.append('{0:>7} f  {1} {2:>9} {3:>9} {4} "{5}"{6}'
+                               .format(child['cnid'], child['type_creator'],
+                                       child['rsrc'], child['size'],
+                                       _hls_date(child[date_key]),
+                                       child['name'],
+                                       '*' if child['type_creator']
+                                       .startswith('APPL') else ''))
+        for subdir in subdirs:
+            _path = '{0}:{1}'.format(dir_path, subdir['name'])
+            hls_out.append('')
+            hls_out.append('{0}:'.format(_path))
+            _list_dir(subdir, _path)
+
+    _list_dir(root, '')
+    return ('\n'.join(hls_out) + '\n').encode('macroman')
+
+
+def _macbinary(data_fork, rsrc_fork):
+    # Returns MacBinary of the forks, as hcopy -m writes it (see
+    # hfs_digests.macbinary_header; other header fields are left zero).
+    _header = bytearray(hfs_digests.MACBINARY_BLOCK)
+    struct.pack_into('>II', _header, 83, len(data_fork), len(rsrc_fork))
+    return b''.join([bytes(_header), data_fork,
+                     b'\x00' * (-len(data_fork) % len(_header)), rsrc_fork,
+                     b'\x00' * (-len(rsrc_fork) % len(_header))])
+
+
+def _hfs_date(this_date):
+    # Returns a date in seconds since 1904, as HFS stores it.
+    return int((this_date - HFS_EPOCH).total_seconds())
+
+
+def _write_image(root, image_path):
+    # Writes a disk image of a synthetic volume (see _synthetic_tree),
+    # with the same CNIDs and fork contents as its recording.
+    _all_dirs = []  # (directory, parent CNID), in CNID order
+    _all_files = []
+    this_level = [(root, hfs_image.ROOT_CNID)]
+    while this_level:
+        next_level = []
+        for this_dir, _parent_cnid in this_level:
+            _dir_cnid = this_dir.get('cnid', hfs_image.ROOT_CNID)
+            for child in this_dir['children']:
+                if 'children' in child:
+                    _all_dirs.append((child, _dir_cnid))
+                    next_level.append((child, _dir_cnid))
+                else:
+                    _all_files.append((child, _dir_cnid))
+        this_level = next_level
+    _all_files.sort(key=lambda _file: _file[0]['cnid'])
+    # Smallest allocation blocks that keep the volume within 65535 of
+    # them, counting the free block after each fork and a generous
+    # allowance for the catalog
+    _bytes = sum(_file['size'] + _file['rsrc'] for _file, _parent in
+                 _all_files)
+    _forks = sum(bool(_file['size']) + bool(_file['rsrc']) for _file, _parent
+                 in _all_files)
+    _block_size = hfs_image.NODE_SIZE
+    while (_bytes // _block_size + 2 * _forks +
+           1024 * (len(_all_dirs) + len(_all_files)) // _block_size >
+           0xFFFF):
+        _block_size += hfs_image.NODE_SIZE
+    volume = hfs_image.HFSImage(b'Synthetic', _block_size)
+    for this_dir, _parent_cnid in _all_dirs:
+        _cnid = volume.add_dir(_parent_cnid,
+                               this_dir['name'].encode('macroman'),
+                               _hfs_date(this_dir['crdate']),
+                               _hfs_date(this_dir['mdate']))
+        assert _cnid == this_dir['cnid']
+    for this_file, _parent_cnid in _all_files:
+        _file_type, _creator = this_file['type_creator'].split('/')
+        _cnid = volume.add_file(_parent_cnid,
+                                this_file['name'].encode('macroman'),
+                                hfs_replay.synthetic_output(
+                                    this_file['size'], this_file['cnid']),
+                                hfs_replay.synthetic_output(
+                                    this_file['rsrc'], -this_file['cnid']),
+                                _file_type.encode('macroman'),
+                                _creator.encode('macroman'),
+                                _hfs_date(this_file['crdate']),
+                                _hfs_date(this_file['mdate']))
+        assert _cnid == this_file['cnid']
+    with open(image_path, 'wb') as image_file:
+        volume.write(image_file)
+
+
+def generate(recording_dir, entries, depth, dirs_per_dir, file_size, seed):
+    # Writes a synthetic recording for a volume (see _synthetic_tree),
+    # and a disk image of it.
+    root = _synthetic_tree(entries, depth, dirs_per_dir, file_size, seed)
+    with hfs_replay.Recorder(recording_dir) as recorder:
+        recorder.add(['humount'])
+        recorder.add(['hmount', IMAGE_NAME],
+                     b'Volume name is "Synthetic"\n')
+        recorder.add(HLS_CRE_ARGS, _hls_listing(root, 'crdate'))
+        recorder.add(HLS_MOD_ARGS, _hls_listing(root, 'mdate'))
+
+        def _add_forks(this_dir, dir_path):
+            for child in this_dir['children']:
+                _path = '{0}:{1}'.format(dir_path, child['name'])
+                if 'children' in child:
+                    _add_forks(child, _path)
+                elif child['rsrc']:  # Both forks are copied at once
+                    recorder.add(['hcopy', '-m',
+                                  hfs2dfxml._format_hcopy_name(_path), '-'],
+                                 _macbinary(hfs_replay.synthetic_output(
+                                                child['size'], child['cnid']),
+                                            hfs_replay.synthetic_output(
+                                                child['rsrc'],
+                                                -child['cnid'])))
+                else:
+                    recorder.add(['hcopy', '-r',
+                                  hfs2dfxml._format_hcopy_name(_path), '-'],
+                                 synthetic=(child['size'], child['cnid']))
+
+        _add_forks(root, '')
+    _write_image(root, os.path.join(recording_dir, IMAGE_NAME))
+
+
+def record(hfs_file, recording_dir):
+    # Records hfsutils output for every call hfs2dfxml makes on a volume.
+    with hfs_replay.Recorder(recording_dir) as recorder:
+        hfs2dfxml._hfsutils = recorder
+        hfs2dfxml._call_humount()
+        for _fileobj in hfs2dfxml._hfs_fileobjs(hfs_file, 'classic',
+                                                hfs2dfxml.HFSOptions(
+                                                    reader='hfsutils',
+                                                    hashing='hcopy',
+                                                    magic=False)):
+            pass
+
+
+def _timed(stage_timings, stage, stage_func):
+    # Runs stage_func, adding its wall and CPU time to stage_timings.
+    # Returns result of stage_func.
+    _wall = time.perf_counter()
+    _cpu = time.process_time()
+    stage_result = stage_func()
+    stage_timings[stage] = {'wall': time.perf_counter() - _wall,
+                            'cpu': time.process_time() - _cpu}
+    return stage_result
+
+
+def run_once(recording_dir, delimiter='classic', use_magic=True, jobs=1,
+             digests=hfs_digests.DEFAULT_DIGESTS):
+    # Replays a recording once, then reads its disk image (if any).
+    # Returns dict of stage: {'wall': seconds, 'cpu': seconds}, and
+    # number of entries.
+    # NOTE: Each stage runs to completion before the next, so stages can
+    #       be timed apart; 'pipeline' runs them all, streaming, as
+    #       hfs2dfxml does. 'catalog' and 'image_hash' are the native
+    #       reader's counterparts of 'enrich' and 'hash'.
+    stage_timings = {}
+    hfs_options = hfs2dfxml.HFSOptions(reader='hfsutils', hashing='hcopy',
+                                       jobs=jobs, magic=use_magic,
+                                       digests=digests)
+    with hfs_replay.Replayer(recording_dir) as replayer:
+        hfs2dfxml._hfsutils = replayer
+        hls_cre_raw = replayer.check_output(HLS_CRE_ARGS).decode('macroman')
+        hls_mod_raw = replayer.check_output(HLS_MOD_ARGS).decode('macroman')
+
+        def _parse():
+            hls_mod_dict = hfs2dfxml._parse_hls_mod(hls_mod_raw)
+            for _section, _linenum, hls_line in hfs2dfxml._hls_sections(
+                                                    hls_cre_raw):
+                hfs2dfxml._match_hls_line(hls_line.strip())
+            return hls_mod_dict
+
+        hls_mod_dict = _timed(stage_timings, 'parse', _parse)
+        hfs_lines = _timed(stage_timings, 'enrich', lambda: list(
+                           hfs2dfxml._parse_hls_cre(hls_cre_raw, hls_mod_dict,
+                                                    hcopy=False)))
+        hfs_lines = _timed(stage_timings, 'hash', lambda: list(
+                           hfs2dfxml._hash_lines(hfs_lines, None,
+                                                 hfs_options)))
+
+        def _serialize(hfs_lines, hfs_fileobjs=None):
+            this_volobj = DFXML.VolumeObject()
+            this_volobj.ftype_str = 'HFS'
+            with hfs_writer.DFXMLStreamWriter(
+                     io.StringIO(),
+                     hfs2dfxml._hfs2dfxml_root(IMAGE_NAME)) as writer:
+                writer.open_volume(this_volobj)
+                if hfs_fileobjs is None:
+                    for hfs_line in hfs_lines:
+                        for this_fileobj in hfs2dfxml._line_to_dfxml(
+                                                hfs_line, delimiter):
+                            if this_fileobj is not None:
+                                writer.write_fileobject(this_fileobj)
+                else:
+                    for this_fileobj in hfs_fileobjs:
+                        writer.write_fileobject(this_fileobj)
+                writer.close_volume()
+
+        _timed(stage_timings, 'serialize', lambda: _serialize(hfs_lines))
+        def _pipeline():
+            hfs2dfxml._call_humount()  # As hfs2dfxml_stream does
+            _serialize(None, hfs2dfxml._hfs_fileobjs(IMAGE_NAME, delimiter,
+                                                     hfs_options))
+
+        _timed(stage_timings, 'pipeline', _pipeline)
+    hfs2dfxml._hfsutils = hfs2dfxml.subprocess
+    image_path = os.path.join(recording_dir, IMAGE_NAME)
+    if os.path.isfile(image_path):  # Not kept by record
+        image_lines = _timed(stage_timings, 'catalog', lambda: list(
+                             hfs2dfxml._native_lines(image_path)))
+        _timed(stage_timings, 'image_hash', lambda: list(
+               hfs2dfxml._hash_lines(image_lines, image_path,
+                                     hfs_options.replace(hashing='image'))))
+    return stage_timings, len(hfs_lines)
+
+
+def run(recording_dir, repeat=3, delimiter='classic', use_magic=True,
+        jobs=1, digests=hfs_digests.DEFAULT_DIGESTS):
+    # Replays a recording repeat times.
+    # Returns dict with number of entries and fastest time of each stage.
+    bench_result = {'entries': 0, 'stages': {}}
+    for _run in range(repeat):
+        stage_timings, bench_result['entries'] = run_once(
+                                                     recording_dir, delimiter,
+                                                     use_magic, jobs, digests)
+        for stage, stage_time in stage_timings.items():
+            if (stage not in bench_result['stages'] or stage_time['wall'] <
+               bench_result['stages'][stage]['wall']):
+                bench_result['stages'][stage] = stage_time
+    return bench_result
+
+
+def _regressions(bench_result, baseline_result, tolerance):
+    # Returns list of stages over tolerance (fraction) slower than in
+    # baseline_result (see run).
+    regressions = []
+    for stage in STAGES:
+        if (stage not in baseline_result['stages'] or
+           stage not in bench_result['stages']):
+            continue
+        _baseline = baseline_result['stages'][stage]['wall']
+        if bench_result['stages'][stage]['wall'] > _baseline * (1 + tolerance):
+            regressions.append(stage)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks hfs2dfxml ' +
+                                     'by replaying recorded or synthetic ' +
+                                     'hfsutils output, and reading ' +
+                                     'synthetic disk images')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    parser_gen = subparsers.add_parser('generate',
+                                       help='Write a synthetic recording ' +
+                                       'and disk image')
+    parser_gen.add_argument('recording', help='Recording directory')
+    parser_gen.add_argument('-n', '--entries', type=int, default=10000,
+                            help='Number of files and directories ' +
+                            '(default 10000)')
+    parser_gen.add_argument('--depth', type=int, default=4,
+                            help='Directory depth (default 4)')
+    parser_gen.add_argument('--dirs', type=int, default=8,
+                            help='Subdirectories per directory (default 8)')
+    parser_gen.add_argument('--file-size', type=int, default=32 * 1024,
+                            help='Average data fork size in bytes ' +
+                            '(default 32768)')
+    parser_gen.add_argument('--seed', type=int, default=0,
+                            help='Random seed (default 0)')
+    parser_rec = subparsers.add_parser('record', help='Record hfsutils ' +
+                                       'output for a disk image')
+    parser_rec.add_argument('hfsvol', help='HFS Volume')
+    parser_rec.add_argument('recording', help='Recording directory')
+    parser_run = subparsers.add_parser('run', help='Replay a recording ' +
+                                       'and time each stage')
+    parser_run.add_argument('recording', help='Recording directory')
+    parser_run.add_argument('--repeat', type=int, default=3,
+                            help='Runs; fastest is kept (default 3)')
+    parser_run.add_argument('-d', '--delimiter', default='classic',
+                            help='Path delimiter (default classic)')
+    parser_run.add_argument('-j', '--jobs', type=int, default=1,
+                            help='Number of hashing worker processes ' +
+                            '(default 1)')
+    parser_run.add_argument('--no-magic', dest='magic', action='store_false',
+                            help='Do not identify file types with libmagic')
+    parser_run.add_argument('--digests', default=','.join(
+                            hfs_digests.DEFAULT_DIGESTS),
+                            help='Comma-separated digests to compute ' +
+                            '(default {0})'.format(','.join(
+                            hfs_digests.DEFAULT_DIGESTS)))
+    parser_run.add_argument('--json', default=None,
+                            help='Write results as JSON to this file')
+    parser_run.add_argument('--baseline', default=None,
+                            help='JSON results of an earlier run; exit ' +
+                            'with an error if any stage is slower')
+    parser_run.add_argument('--tolerance', type=float, default=0.2,
+                            help='Fraction slower than baseline allowed ' +
+                            '(default 0.2)')
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        generate(args.recording, args.entries, args.depth, args.dirs,
+                 args.file_size, args.seed)
+    elif args.command == 'record':
+        if not os.path.isfile(args.hfsvol):
+            sys.exit('hfs2dfxml_bench error: HFS Volume not found.')
+        record(args.hfsvol, args.recording)
+    else:
+        bench_result = run(args.recording, args.repeat, args.delimiter,
+                           args.magic, args.jobs, hfs_digests.check_digests(
+                               args.digests.split(',')))
+        print('{0} entries'.format(bench_result['entries']))
+        for stage in STAGES:
+            if stage not in bench_result['stages']:
+                continue
+            stage_time = bench_result['stages'][stage]
+            print('{0:<10} {1:>9.3f}s wall {2:>9.3f}s cpu'.format(
+                  stage, stage_time['wall'], stage_time['cpu']))
+        if args.json is not None:
+            with open(args.json, 'w') as jsonfile:
+                json.dump(bench_result, jsonfile, indent=2)
+        if args.baseline is not None:
+            with open(args.baseline) as baselinefile:
+                regressions = _regressions(bench_result,
+                                           json.load(baselinefile),
+                                           args.tolerance)
+            if regressions:
+                sys.exit('hfs2dfxml_bench error: Slower than baseline: ' +
+                         '{0}'.format(', '.join(regressions)))
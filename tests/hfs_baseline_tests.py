@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+#
+# Tests of hfs_baseline, comparing synthetic disk images (see hfs_image)
+# against DFXML written for an earlier version of them.
+# Run from this directory with: python3 -m unittest hfs_baseline_tests
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'hfs2dfxml'))
+import hfs2dfxml
+import hfs_baseline
+import hfs_image
+from hfs_image import ROOT_CNID
+
+DATE = 2950000000
+OPTIONS = hfs2dfxml.HFSOptions(magic=False)  # libmagic is not under test
+
+
+def _volume_bytes(changed=False):
+    # Returns the test volume, or its changed version: Modified has
+    # other contents, Renamed another name, Touched another modify date
+    # and Deleted is gone (its CNID unused), while New is added and
+    # Same is unchanged.
+    volume = hfs_image.HFSImage(b'Baseline Volume')
+    volume.add_file(ROOT_CNID, b'Same', data=b's' * 1000, rsrc=b'r' * 200,
+                    modify_date=DATE)
+    volume.add_file(ROOT_CNID, b'Modified',
+                    data=b'M' * (1500 if changed else 1000),
+                    modify_date=DATE + (60 if changed else 0))
+    volume.add_file(ROOT_CNID, b'Moved' if changed else b'Renamed',
+                    data=b'n' * 1000, modify_date=DATE)
+    volume.add_file(ROOT_CNID, b'Touched', data=b't' * 1000,
+                    modify_date=DATE + (60 if changed else 0))
+    if changed:
+        volume.next_cnid += 1
+        volume.add_file(ROOT_CNID, b'New', data=b'w' * 1000,
+                        modify_date=DATE)
+    else:
+        volume.add_file(ROOT_CNID, b'Deleted', data=b'd' * 1000,
+                        rsrc=b'D' * 200, modify_date=DATE)
+    return volume.build()
+
+
+class BaselineTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp(prefix='hfs_baseline_')
+        cls.image_path = os.path.join(cls.tmp_dir, 'test.img')
+        cls.changed_path = os.path.join(cls.tmp_dir, 'changed.img')
+        cls.baseline_path = os.path.join(cls.tmp_dir, 'test.xml')
+        with open(cls.image_path, 'wb') as image_file:
+            image_file.write(_volume_bytes())
+        with open(cls.changed_path, 'wb') as image_file:
+            image_file.write(_volume_bytes(changed=True))
+        with open(cls.baseline_path, 'w') as dfxml_file:
+            hfs2dfxml.hfs2dfxml_stream(cls.image_path, dfxml_file,
+                                       'classic', OPTIONS)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def _fileobjs(self, **options):
+        # Takes options to change from OPTIONS.
+        # Returns (list of fileobjects of the changed image, compared
+        # with the baseline, list of the names of the files hashed, in
+        # catalog order).
+        hashed = []
+        _hash_line = hfs2dfxml._hash_line
+
+        def _noted(this_line, *args, **kwargs):
+            if this_line.filename is not None:
+                hashed.append(this_line.filename.lstrip(':'))
+            return _hash_line(this_line, *args, **kwargs)
+
+        with mock.patch('hfs2dfxml._hash_line', side_effect=_noted):
+            this_volobj = hfs2dfxml.hfs_volobj(
+                self.changed_path, 'classic',
+                OPTIONS.replace(baseline_path=self.baseline_path,
+                                **options))
+        return list(this_volobj), hashed
+
+    def test_differential_requires_baseline(self):
+        with self.assertRaises(SystemExit):
+            hfs2dfxml.HFSOptions(differential=True)
+
+    def test_entries_matched_by_cnid(self):
+        # CNID: data fork name and resource fork size
+        baseline = hfs_baseline.Baseline(self.baseline_path)
+        self.assertEqual(
+            {_cnid: (_forks[0].filename.lstrip(':'),
+                     int(_forks[1].filesize))
+             for _cnid, _forks in baseline._entries.items()},
+            {16: ('Same', 200), 17: ('Modified', 0), 18: ('Renamed', 0),
+             19: ('Touched', 0), 20: ('Deleted', 200)})
+
+    def test_differential(self):
+        # Only new and changed entries (each fork), then deleted ones
+        fileobjs, _hashed = self._fileobjs(differential=True)
+        self.assertEqual([(_fileobj.filename.lstrip(':'),
+                           sorted(_fileobj.annos)) for _fileobj in fileobjs],
+                         [('Modified', ['changed', 'modified']),
+                          ('Modified:rsrc', ['changed', 'modified']),
+                          ('Moved', ['renamed']),
+                          ('Moved:rsrc', ['renamed']),
+                          ('New', ['new']), ('New:rsrc', ['new']),
+                          ('Touched', ['changed']),
+                          ('Touched:rsrc', ['changed']),
+                          ('Deleted', ['deleted']),
+                          ('Deleted:rsrc', ['deleted'])])
+        self.assertEqual(fileobjs[0].original_fileobject.filename,
+                         ':Modified')
+        self.assertIsNone(fileobjs[4].original_fileobject)
+
+    def test_unchanged_forks_reused(self):
+        # Forks of the same name, sizes and timestamps are not hashed,
+        # but take the baseline's hashes
+        fileobjs, hashed = self._fileobjs()
+        self.assertEqual(hashed, ['Modified', 'Moved', 'New', 'Touched'])
+        self.assertEqual([_fileobj.md5 for _fileobj in fileobjs
+                          if _fileobj.filename.startswith(':Same')],
+                         ['89672db46d459abd6a9a05afe5973891',
+                          '0c7895e700ffabd0d3216675ffb99e1e'])
+
+    def test_missing_digests_hashed(self):
+        # The baseline has no sha256, so no fork can be reused
+        _fileobjs, hashed = self._fileobjs(digests=('md5', 'sha256'))
+        self.assertEqual(hashed, ['Modified', 'Moved', 'New', 'Same',
+                                  'Touched'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+#
+# Tests of hfs_cache on synthetic disk images (see hfs_image).
+# Run from this directory with: python3 -m unittest hfs_cache_tests
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'hfs2dfxml'))
+import hfs_cache
+import hfs_image
+from hfs_image import ROOT_CNID
+
+DATE = 2950000000  # Modify date of the test file
+
+
+def _volume_bytes(modify_date=DATE):
+    # Returns the test volume, whose one file was last modified (and the
+    # volume with it) at modify_date.
+    volume = hfs_image.HFSImage(b'Cache Volume', modify_date=modify_date)
+    volume.add_file(ROOT_CNID, b'File', data=b'f' * 1000,
+                    modify_date=modify_date)
+    return volume.build()
+
+
+class HashCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='hfs_cache_')
+        self.cache_path = os.path.join(self.tmp_dir, 'cache.db')
+        self.image_path = self._write(_volume_bytes())
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, image_bytes, name='test.img'):
+        # Returns path to image_bytes written into the test directory.
+        image_path = os.path.join(self.tmp_dir, name)
+        with open(image_path, 'wb') as image_file:
+            image_file.write(image_bytes)
+        return image_path
+
+    def _keys(self):
+        # Returns set of (cnid, fork) stored in the cache.
+        with hfs_cache.HashCache(self.cache_path,
+                                 self.image_path) as cache:
+            return set(cache._db.execute('SELECT cnid, fork FROM forks'))
+
+    def test_get_put(self):
+        with hfs_cache.HashCache(self.cache_path, self.image_path) as cache:
+            self.assertIsNone(cache.get(16, 'data', 1000, DATE))
+            cache.put(16, 'data', 1000, DATE, 'ASCII text', {'md5': 'aa'})
+            cache.put(17, 'data', 1000, DATE, None, None)  # Failed hash
+        with hfs_cache.HashCache(self.cache_path, self.image_path) as cache:
+            self.assertEqual(cache.get(16, 'data', 1000, DATE),
+                             ('ASCII text', {'md5': 'aa'}))
+            self.assertIsNone(cache.get(16, 'rsrc', 1000, DATE))
+            self.assertIsNone(cache.get(16, 'data', 999, DATE))
+            self.assertIsNone(cache.get(16, 'data', 1000, DATE + 1))
+            self.assertIsNone(cache.get(17, 'data', 1000, DATE))
+
+    def test_fingerprint_changes_with_volume(self):
+        # A write to the volume changes its MDB, so the image's results
+        # are no longer found.
+        _fingerprint = hfs_cache.image_fingerprint(self.image_path)
+        self.assertEqual(hfs_cache.image_fingerprint(self.image_path),
+                         _fingerprint)
+        with hfs_cache.HashCache(self.cache_path, self.image_path) as cache:
+            cache.put(16, 'data', 1000, DATE, None, {'md5': 'aa'})
+        self._write(_volume_bytes(DATE + 60))
+        self.assertNotEqual(hfs_cache.image_fingerprint(self.image_path),
+                            _fingerprint)
+        with hfs_cache.HashCache(self.cache_path, self.image_path) as cache:
+            self.assertIsNone(cache.get(16, 'data', 1000, DATE))
+
+    def test_fingerprint_reads_partition_mdbs(self):
+        # Only the second partition differs, past the first 64 KiB.
+        _filler = b'\x00' * (hfs_cache.FINGERPRINT_BYTES * 2)
+        _first = self._write(hfs_image.apple_partition_map(
+            [(b'Filler', b'Apple_Free', _filler),
+             (b'Volume', b'Apple_HFS', _volume_bytes())]), 'first.img')
+        _second = self._write(hfs_image.apple_partition_map(
+            [(b'Filler', b'Apple_Free', _filler),
+             (b'Volume', b'Apple_HFS', _volume_bytes(DATE + 60))]),
+            'second.img')
+        self.assertNotEqual(hfs_cache.image_fingerprint(_first),
+                            hfs_cache.image_fingerprint(_second))
+
+    def test_partitions_kept_apart(self):
+        with hfs_cache.HashCache(self.cache_path, self.image_path,
+                                 partition_offset=4096) as cache:
+            cache.put(16, 'data', 1000, DATE, None, {'md5': 'aa'})
+        with hfs_cache.HashCache(self.cache_path, self.image_path) as cache:
+            self.assertIsNone(cache.get(16, 'data', 1000, DATE))
+
+    def test_put_merges_digests(self):
+        # Results of runs with other digests (and without libmagic) are
+        # kept alongside each other.
+        with hfs_cache.HashCache(self.cache_path, self.image_path) as cache:
+            cache.put(16, 'data', 1000, DATE, 'ASCII text',
+                      {'md5': 'aa', 'sha1': 'bb'})
+        with hfs_cache.HashCache(self.cache_path, self.image_path) as cache:
+            cache.put(16, 'data', 1000, DATE, None,
+                      {'sha1': 'bb', 'sha256': 'cc'})
+        with hfs_cache.HashCache(self.cache_path, self.image_path) as cache:
+            self.assertEqual(cache.get(16, 'data', 1000, DATE),
+                             ('ASCII text', {'md5': 'aa', 'sha1': 'bb',
+                                             'sha256': 'cc'}))
+
+    def test_evict_least_recently_used(self):
+        with hfs_cache.HashCache(self.cache_path, self.image_path) as cache:
+            cache.put(16, 'data', 1000, DATE, None, {'md5': 'aa'})
+        with hfs_cache.HashCache(self.cache_path, self.image_path) as cache:
+            cache.put(17, 'data', 1000, DATE, None, {'md5': 'bb'})
+        with hfs_cache.HashCache(self.cache_path, self.image_path,
+                                 max_entries=2) as cache:
+            self.assertIsNotNone(cache.get(16, 'data', 1000, DATE))
+            cache.put(18, 'data', 1000, DATE, None, {'md5': 'cc'})
+        # 17 was last used by an earlier run than 16 and 18
+        self.assertEqual(self._keys(), {(16, 'data'), (18, 'data')})
+
+    def test_evict_only_when_over(self):
+        with hfs_cache.HashCache(self.cache_path, self.image_path,
+                                 max_entries=2) as cache:
+            cache.put(16, 'data', 1000, DATE, None, {'md5': 'aa'})
+            cache.put(17, 'data', 1000, DATE, None, {'md5': 'bb'})
+            _statements = []
+            cache._db.set_trace_callback(_statements.append)
+            cache.evict()
+            cache._db.set_trace_callback(None)
+            self.assertFalse([_statement for _statement in _statements
+                              if _statement.startswith('DELETE')])
+        self.assertEqual(self._keys(), {(16, 'data'), (17, 'data')})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+#
+# Byte-level tests of hfs_digests, on MacBinary II streams as written
+# by hcopy -m, and of hashing them with hfs2dfxml.
+# Run from this directory with: python3 -m unittest hfs_digests_tests
+
+import io
+import os
+import sys
+import struct
+import hashlib
+import binascii
+import unittest
+from unittest import mock
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'hfs2dfxml'))
+import hfs2dfxml
+import hfs_digests
+
+DATA = bytes(range(256)) * 3 + b'tail'  # Not a multiple of 128 bytes
+RSRC = b'R' * 300
+
+
+def _macbinary(data, rsrc, secondary=b''):
+    # Returns MacBinary II stream of a file with the given forks (and
+    # secondary header), each padded to a multiple of 128 bytes.
+    _header = bytearray(hfs_digests.MACBINARY_BLOCK)
+    _header[1] = 4
+    _header[2:6] = b'File'
+    _header[65:73] = b'TEXTttxt'
+    struct.pack_into('>II', _header, 83, len(data), len(rsrc))
+    struct.pack_into('>H', _header, 120, len(secondary))
+    _header[122:124] = b'\x81\x81'  # Written by / needed to read: II
+    struct.pack_into('>H', _header, hfs_digests.MACBINARY_CRC,
+                     binascii.crc_hqx(bytes(_header[:124]), 0))
+    return b''.join(_part + b'\0' * hfs_digests.macbinary_padding(len(_part))
+                    for _part in (bytes(_header), secondary, data, rsrc))
+
+
+def _hashes(contents, digests):
+    return {_digest: hashlib.new(_digest, contents).hexdigest()
+            for _digest in digests}
+
+
+class _Once(object):
+    # Iterable of chunks that can only be iterated over once.
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self.iterated = False
+
+    def __iter__(self):
+        if self.iterated:
+            raise AssertionError('Chunks read twice.')
+        self.iterated = True
+        return self._chunks
+
+
+class DigestsTests(unittest.TestCase):
+
+    def test_check_digests(self):
+        self.assertEqual(hfs_digests.check_digests(['sha256', 'md5', 'md5']),
+                         ('md5', 'sha256'))
+        with self.assertRaises(SystemExit):
+            hfs_digests.check_digests(['crc32'])
+
+    def test_digest_chunks_single_pass(self):
+        _chunks = _Once([DATA[:100], memoryview(DATA)[100:700], DATA[700:]])
+        _head, fork_hashes = hfs_digests.digest_chunks(
+                                 _chunks, hfs_digests.DIGESTS, 150)
+        self.assertEqual(_head, DATA[:150])
+        self.assertEqual(fork_hashes, _hashes(DATA, hfs_digests.DIGESTS))
+
+    def test_macbinary_header(self):
+        _stream = io.BytesIO(_macbinary(DATA, RSRC, b'S' * 10))
+        self.assertEqual(hfs_digests.macbinary_header(_stream),
+                         (len(DATA), len(RSRC)))
+        # Left at the data fork, past the padded secondary header
+        self.assertEqual(_stream.tell(), 2 * hfs_digests.MACBINARY_BLOCK)
+
+    def test_macbinary_header_crc(self):
+        _stream = bytearray(_macbinary(DATA, RSRC))
+        _stream[84] ^= 0x01  # Data fork length, without fixing the CRC
+        with self.assertRaises(SystemExit):
+            hfs_digests.macbinary_header(io.BytesIO(bytes(_stream)))
+        with self.assertRaises(SystemExit):
+            hfs_digests.macbinary_header(io.BytesIO(_stream[:100]))
+
+    def test_macbinary_padding(self):
+        self.assertEqual(hfs_digests.macbinary_padding(0), 0)
+        self.assertEqual(hfs_digests.macbinary_padding(1), 127)
+        self.assertEqual(hfs_digests.macbinary_padding(128), 0)
+        self.assertEqual(hfs_digests.macbinary_padding(len(DATA)),
+                         128 - len(DATA) % 128)
+
+    def test_read_chunks_truncated(self):
+        _chunks = hfs_digests.read_chunks(io.BytesIO(DATA), len(DATA) + 1,
+                                          100)
+        with self.assertRaises(SystemExit):
+            list(_chunks)
+
+    def _hcopy_res(self, hcopy_output, data=True, rsrc=True,
+                   digests=hfs_digests.DIGESTS):
+        # Returns _hcopy_res of a file whose hcopy gives hcopy_output.
+        _proc = mock.Mock(stdout=io.BytesIO(hcopy_output))
+        _proc.wait.return_value = 0
+        with mock.patch.object(hfs2dfxml._hfsutils, 'Popen',
+                               return_value=_proc) as _popen:
+            _results = hfs2dfxml._hcopy_res(':File', digests, False, data,
+                                            rsrc)
+        self.assertEqual(_popen.call_args[0][0][1], '-m' if rsrc else '-r')
+        return _results
+
+    def test_hcopy_forks_between_padding(self):
+        # Each fork is hashed without the padding after it, in every
+        # digest at once
+        self.assertEqual(self._hcopy_res(_macbinary(DATA, RSRC,
+                                                    b'S' * 200)),
+                         (None, _hashes(DATA, hfs_digests.DIGESTS),
+                          _hashes(RSRC, hfs_digests.DIGESTS)))
+
+    def test_hcopy_resource_fork_only(self):
+        self.assertEqual(self._hcopy_res(_macbinary(DATA, RSRC), data=False,
+                                         digests=('md5',)),
+                         (None, None, _hashes(RSRC, ('md5',))))
+
+    def test_hcopy_data_fork_only(self):
+        self.assertEqual(self._hcopy_res(DATA, rsrc=False,
+                                         digests=('sha1',)),
+                         (None, _hashes(DATA, ('sha1',)), None))
+
+    def test_hcopy_bad_header(self):
+        # hcopy succeeded, so its output cannot be trusted
+        _output = bytearray(_macbinary(DATA, RSRC))
+        _output[124] ^= 0xff
+        _proc = mock.Mock(stdout=io.BytesIO(bytes(_output)))
+        _proc.wait.return_value = 0
+        with mock.patch.object(hfs2dfxml._hfsutils, 'Popen',
+                               return_value=_proc):
+            with self.assertRaises(SystemExit):
+                hfs2dfxml._hcopy_res(':File', ('md5',), False, True, True)
+
+
+if __name__ == '__main__':
+    unittest.main()
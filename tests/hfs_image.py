@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+#
+# hfs_image builds synthetic HFS volumes and Apple partition maps in
+# memory, for tests and benchmarks that need a disk image without
+# hfsutils or real media. The catalog B-tree gets index levels once
+# its records do not fit in one node, and forks may be split into
+# several extents, spilling over into the extents overflow B-tree
+# after the three held in the catalog record.
+#
+# Reference: Inside Macintosh: Files, Chapter 2 (Data Organization
+#            on Volumes)
+
+import struct
+from collections import Counter
+
+SECTOR_SIZE = 512
+NODE_SIZE = 512
+ALLOC_START = 4  # Sectors before allocation block 0: boot, MDB, bitmap
+ROOT_PARENT = 1
+ROOT_CNID = 2
+FIRST_CNID = 16
+HFS_DATE = 3000000000  # Default dates, in seconds since 1904
+
+CDR_DIR = 1
+CDR_FILE = 2
+CDR_DIR_THREAD = 3
+CDR_FILE_THREAD = 4
+NDX_NODE = 0
+HDR_NODE = 1
+LEAF_NODE = -1
+INDEX_KEY_LENGTH = 37  # Catalog index keys hold a padded Str31
+DATA_FORK = 0x00
+RSRC_FORK = 0xFF
+FIL_LOCKED = 0x01
+NODE_DESC_SIZE = 14
+NODE_SIZE_EMPTY = NODE_DESC_SIZE + 2  # Descriptor and free space offset
+
+
+def _pad(raw, length):
+    return raw + b'\x00' * (length - len(raw))
+
+
+def _str31(name):
+    return bytes([len(name)]) + name
+
+
+def _record(key, data):
+    # Key length byte and key, padded so the data starts on a word.
+    _keyed = bytes([len(key)]) + key
+    if len(_keyed) % 2:
+        _keyed += b'\x00'
+    return _keyed + data
+
+
+def _node(flink, blink, kind, height, records):
+    # Packs records into a B-tree node, with their offsets at its end.
+    _raw = bytearray(struct.pack('>IIbBHxx', flink, blink, kind, height,
+                                 len(records)))
+    _offsets = []
+    for record in records:
+        _offsets.append(len(_raw))
+        _raw += record
+    _offsets.append(len(_raw))  # Free space
+    _raw += b'\x00' * (NODE_SIZE - len(_raw) - 2 * len(_offsets))
+    for _offset in reversed(_offsets):
+        _raw += struct.pack('>H', _offset)
+    return bytes(_raw)
+
+
+def _fill(records):
+    # Splits records into runs that each fit in a node.
+    _runs = []
+    _used = NODE_SIZE
+    for record in records:
+        if _used + len(record) + 2 > NODE_SIZE:
+            _runs.append([])
+            _used = NODE_SIZE_EMPTY
+        _runs[-1].append(record)
+        _used += len(record) + 2
+    return _runs
+
+
+def btree(records, index_key):
+    # Takes leaf records in key order and function returning the key of
+    # an index record pointing to a node, from the node's first leaf
+    # record.
+    # Returns the B-tree file as bytes: header node, leaf nodes, then
+    # each index level up to the root.
+    nodes = []  # (kind, height, records)
+    level = []  # (node number, first leaf record) of the level below
+    for run in _fill(records):
+        level.append((len(nodes) + 1, run[0]))
+        nodes.append((LEAF_NODE, 1, run))
+    first_leaf = level[0][0] if level else 0
+    last_leaf = level[-1][0] if level else 0
+    depth = 1 if level else 0
+    while len(level) > 1:
+        depth += 1
+        _pointers = [(_record(index_key(_first), struct.pack('>I', _num)),
+                      _first) for _num, _first in level]
+        level = []
+        _at = 0
+        for run in _fill([_pointer for _pointer, _first in _pointers]):
+            level.append((len(nodes) + 1, _pointers[_at][1]))
+            nodes.append((NDX_NODE, depth, run))
+            _at += len(run)
+    root = level[0][0] if level else 0
+    _raw = bytearray(_node(0, 0, HDR_NODE, 0, [
+        struct.pack('>HIIIIHHII', depth, root, len(records), first_leaf,
+                    last_leaf, NODE_SIZE, INDEX_KEY_LENGTH, len(nodes) + 1,
+                    0) + b'\x00' * 76,
+        b'\x00' * 128,
+        b'\xff' * (NODE_SIZE - NODE_DESC_SIZE - 106 - 128 - 8)]))
+    for _num, (kind, height, run) in enumerate(nodes, 1):
+        # Nodes of a level are numbered consecutively
+        _prev = nodes[_num - 2] if _num > 1 else None
+        _next = nodes[_num] if _num < len(nodes) else None
+        blink = _num - 1 if _prev and _prev[:2] == (kind, height) else 0
+        flink = _num + 1 if _next and _next[:2] == (kind, height) else 0
+        _raw += _node(flink, blink, kind, height, run)
+    return bytes(_raw)
+
+
+def _catalog_key(parent_id, name):
+    return struct.pack('>xI', parent_id) + _str31(name)
+
+
+def _catalog_index_key(leaf_record):
+    # Catalog index keys are the leaf key with its name padded.
+    return _pad(leaf_record[1:1 + leaf_record[0]], INDEX_KEY_LENGTH)
+
+
+def _extents_index_key(leaf_record):
+    return leaf_record[1:1 + leaf_record[0]]
+
+
+def _extent_record(extents):
+    # Packs up to three (start block, block count) extents.
+    _extents = list(extents) + [(0, 0)] * (3 - len(extents))
+    return struct.pack('>HHHHHH', *[_value for _extent in _extents
+                                    for _value in _extent])
+
+
+class HFSImage(object):
+    # Builds an HFS volume with allocation blocks of alloc_block_size
+    # bytes (a multiple of NODE_SIZE).
+    # Usage: add_dir() and add_file() (each returns the new CNID; the
+    # root directory is ROOT_CNID), then build() for the volume as
+    # bytes, or write() to write it to a file.
+    # NOTE: Forks are laid out as they are added, so only one copy of
+    #       their contents is held.
+
+    def __init__(self, name=b'Synthetic', alloc_block_size=SECTOR_SIZE,
+                 create_date=HFS_DATE, modify_date=HFS_DATE):
+        self.name = name
+        self.alloc_block_size = alloc_block_size
+        self.create_date = create_date
+        self.modify_date = modify_date
+        self.next_cnid = FIRST_CNID
+        # CNID: (parent ID, name, create date, modify date, Finder flags)
+        self._dirs = {ROOT_CNID: (ROOT_PARENT, name, create_date,
+                                  modify_date, 0)}
+        self._files = []
+        self._forks_area = bytearray()
+        self._fork_extents = {}  # (CNID, fork type): list of extents
+
+    def add_dir(self, parent_id, name, create_date=HFS_DATE,
+                modify_date=HFS_DATE, finder_flags=0):
+        cnid = self._new_cnid()
+        self._dirs[cnid] = (parent_id, name, create_date, modify_date,
+                            finder_flags)
+        return cnid
+
+    def add_file(self, parent_id, name, data=b'', rsrc=b'',
+                 file_type=b'TEXT', creator=b'ttxt', create_date=HFS_DATE,
+                 modify_date=HFS_DATE, finder_flags=0, locked=False,
+                 data_extents=1, rsrc_extents=1):
+        # data_extents and rsrc_extents split each fork into that many
+        # extents (at most one per allocation block), with a free block
+        # between each; beyond three, they are in the extents overflow
+        # file.
+        cnid = self._new_cnid()
+        self._files.append({'parent': parent_id, 'name': name,
+                            'cnid': cnid, 'data_size': len(data),
+                            'rsrc_size': len(rsrc), 'type': file_type,
+                            'creator': creator, 'crdate': create_date,
+                            'mddate': modify_date, 'flags': finder_flags,
+                            'locked': locked})
+        self._fork_extents[(cnid, DATA_FORK)] = self._place(data,
+                                                            data_extents)
+        self._fork_extents[(cnid, RSRC_FORK)] = self._place(rsrc,
+                                                            rsrc_extents)
+        return cnid
+
+    def _new_cnid(self):
+        cnid = self.next_cnid
+        self.next_cnid += 1
+        return cnid
+
+    def _blocks(self, length):
+        return -(-length // self.alloc_block_size)
+
+    def _physical(self, length):
+        return self._blocks(length) * self.alloc_block_size
+
+    def _place(self, contents, pieces):
+        # Appends a fork to the forks laid out so far, in pieces, each
+        # followed by a free block. Returns list of (start block, block
+        # count) from the first fork.
+        _count = self._blocks(len(contents))
+        if not _count:
+            return []
+        pieces = max(1, min(pieces, _count))
+        _extents = []
+        _taken = 0
+        for _piece in range(pieces):
+            _piece_count = (_count - _taken) // (pieces - _piece)
+            _extents.append((len(self._forks_area) // self.alloc_block_size,
+                             _piece_count))
+            self._forks_area += _pad(contents[_taken * self.alloc_block_size:
+                                        (_taken + _piece_count) *
+                                        self.alloc_block_size],
+                               _piece_count * self.alloc_block_size)
+            self._forks_area += b'\x00' * self.alloc_block_size
+            _taken += _piece_count
+        return _extents
+
+    def _trees(self, shift):
+        # Returns extents overflow and catalog B-tree files, with fork
+        # extents moved by shift allocation blocks.
+        _overflow = []
+        _first_extrecs = {}
+        for (cnid, fork_type), _extents in self._fork_extents.items():
+            _extents = [(_start + shift, _count)
+                        for _start, _count in _extents]
+            _first_extrecs[(cnid, fork_type)] = _extent_record(_extents[:3])
+            _file_block = sum(_count for _start, _count in _extents[:3])
+            for _at in range(3, len(_extents), 3):
+                _overflow.append(((cnid, fork_type, _file_block), _record(
+                    struct.pack('>BIH', fork_type, cnid, _file_block),
+                    _extent_record(_extents[_at:_at + 3]))))
+                _file_block += sum(_count for _start, _count in
+                                   _extents[_at:_at + 3])
+        _valences = Counter([_dir[0] for _dir in self._dirs.values()] +
+                            [_file['parent'] for _file in self._files])
+        _catalog = []
+        for cnid, (parent_id, name, crdate, mddate,
+                   finder_flags) in self._dirs.items():
+            _catalog.append(((parent_id, name.lower()), _record(
+                _catalog_key(parent_id, name),
+                struct.pack('>BxHHIIII8sH38x', CDR_DIR, 0, _valences[cnid],
+                            cnid, crdate, mddate, 0, b'', finder_flags))))
+            _catalog.append(((cnid, b''), _record(
+                _catalog_key(cnid, b''),
+                struct.pack('>Bx8xI32s', CDR_DIR_THREAD, parent_id,
+                            _str31(name)))))
+        for _file in self._files:
+            cnid = _file['cnid']
+            _data_size = _file['data_size']
+            _rsrc_size = _file['rsrc_size']
+            _catalog.append(((_file['parent'], _file['name'].lower()),
+                             _record(_catalog_key(_file['parent'],
+                                                  _file['name']),
+                                     struct.pack(
+                '>BxBB4s4sH6xIHIIHIIIII16xH12s12s4x', CDR_FILE,
+                FIL_LOCKED if _file['locked'] else 0, 0, _file['type'],
+                _file['creator'], _file['flags'], cnid,
+                0, _data_size, self._physical(_data_size),
+                0, _rsrc_size, self._physical(_rsrc_size),
+                _file['crdate'], _file['mddate'], 0, 0,
+                _first_extrecs[(cnid, DATA_FORK)],
+                _first_extrecs[(cnid, RSRC_FORK)]))))
+            _catalog.append(((cnid, b''), _record(
+                _catalog_key(cnid, b''),
+                struct.pack('>Bx8xI32s', CDR_FILE_THREAD, _file['parent'],
+                            _str31(_file['name'])))))
+        _overflow.sort(key=lambda _keyed: _keyed[0])
+        _catalog.sort(key=lambda _keyed: _keyed[0])
+        return (btree([record for _key, record in _overflow],
+                      _extents_index_key),
+                btree([record for _key, record in _catalog],
+                      _catalog_index_key))
+
+    def _parts(self):
+        # Returns the volume as a list of byte strings: boot blocks, MDB,
+        # volume bitmap (left empty), extents overflow and catalog files,
+        # the forks, then alternate MDB and reserved sector.
+        # Tree sizes do not depend on where forks are
+        _xt_file, _ct_file = self._trees(0)
+        _xt_blocks = self._blocks(len(_xt_file))
+        _ct_blocks = self._blocks(len(_ct_file))
+        _xt_file, _ct_file = self._trees(_xt_blocks + _ct_blocks)
+        _alloc_blocks = (_xt_blocks + _ct_blocks +
+                         len(self._forks_area) // self.alloc_block_size)
+        if _alloc_blocks > 0xFFFF:
+            raise ValueError('HFSImage error: More than 65535 allocation ' +
+                             'blocks; use larger blocks.')
+        _mdb = bytearray(SECTOR_SIZE)
+        struct.pack_into('>2sIIHHHHHIIHIH28p', _mdb, 0, b'BD',
+                         self.create_date, self.modify_date, 0,
+                         sum(1 for _file in self._files
+                             if _file['parent'] == ROOT_CNID),
+                         3, 0, _alloc_blocks, self.alloc_block_size,
+                         self.alloc_block_size, ALLOC_START, self.next_cnid,
+                         0, self.name)
+        struct.pack_into('>II', _mdb, 84, len(self._files),
+                         len(self._dirs) - 1)
+        struct.pack_into('>I12sI12s', _mdb, 130,
+                         _xt_blocks * self.alloc_block_size,
+                         _extent_record([(0, _xt_blocks)]),
+                         _ct_blocks * self.alloc_block_size,
+                         _extent_record([(_xt_blocks, _ct_blocks)]))
+        return [b'\x00' * 2 * SECTOR_SIZE, bytes(_mdb),
+                b'\x00' * (ALLOC_START - 3) * SECTOR_SIZE,
+                _pad(_xt_file, _xt_blocks * self.alloc_block_size),
+                _pad(_ct_file, _ct_blocks * self.alloc_block_size),
+                self._forks_area, b'\x00' * 2 * SECTOR_SIZE]
+
+    def build(self):
+        # Returns the volume as bytes.
+        return b''.join(self._parts())
+
+    def write(self, image_file):
+        # Writes the volume to a file object opened for binary writing.
+        for _part in self._parts():
+            image_file.write(_part)
+
+
+def apple_partition_map(partitions, block_size=SECTOR_SIZE):
+    # Takes list of (partition name, partition type, contents), with
+    # contents a multiple of SECTOR_SIZE bytes, and the block size
+    # recorded in the driver descriptor.
+    # Returns disk image with a driver descriptor, a partition map
+    # listing itself and each partition, then the partitions.
+    _map_entries = len(partitions) + 1
+    _entries = [(b'Apple', b'Apple_partition_map', 1, _map_entries)]
+    _start = 1 + _map_entries
+    for part_name, part_type, contents in partitions:
+        _entries.append((part_name, part_type, _start,
+                         len(contents) // SECTOR_SIZE))
+        _start += len(contents) // SECTOR_SIZE
+    _image = bytearray(SECTOR_SIZE)
+    struct.pack_into('>2sHI', _image, 0, b'ER', block_size,
+                     _start * SECTOR_SIZE // block_size)
+    for part_name, part_type, part_start, part_count in _entries:
+        _entry = bytearray(SECTOR_SIZE)
+        struct.pack_into('>2s2xIII32s32s', _entry, 0, b'PM', _map_entries,
+                         part_start, part_count, part_name, part_type)
+        _image += _entry
+    for _part_name, _part_type, contents in partitions:
+        _image += contents
+    return bytes(_image)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+#
+# Tests of hfs_index, with SQLite and JSON Lines indexes.
+# Run from this directory with: python3 -m unittest hfs_index_tests
+
+import os
+import sys
+import json
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import multiprocessing
+from datetime import datetime
+from unittest import mock
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'hfs2dfxml'))
+import hfs_index
+from hfs_native import HFSEntry
+
+IMAGE = 'test.img'
+WRITERS = 4  # Processes appending to one JSON Lines index at once
+
+
+def _entries(count=2, magic='ASCII text'):
+    # Returns list of a directory and count - 1 files, as HFSEntry.
+    _entries = [HFSEntry(cnid=2, name_type='d', dirname=':Folder',
+                         crtime=datetime(1995, 11, 23, 19, 33, 20),
+                         mtime=datetime(1995, 11, 23, 19, 33, 20))]
+    for _num in range(1, count):
+        _entries.append(HFSEntry(cnid=15 + _num, name_type='r',
+                                 filename=':Folder:File {0}'.format(_num),
+                                 filesize=_num, HFSrsrcsize=0,
+                                 HFStype_creator='TEXT/ttxt',
+                                 HFSlocked='False', HFSflags='0x0000',
+                                 crtime=datetime(1995, 11, 23, 19, 33, 20),
+                                 mtime=None, libmagic=magic,
+                                 hashes={'md5': '{0:032x}'.format(_num)},
+                                 rsrc_hashes=({'md5': '0' * 32} if _num == 1
+                                              else None)))
+    return _entries
+
+
+def _append(index_path, volume_index, count):
+    # Writes count entries, with long lines, to a JSON Lines index.
+    jsonl_index = hfs_index.JSONLIndex(index_path, IMAGE, volume_index)
+    for _entry in _entries(count, 'x' * 5000):
+        jsonl_index.add(_entry, _entry.filename or _entry.dirname)
+    jsonl_index.close()
+
+
+class IndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='hfs_index_')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _index(self, index_name, volume_index=0, entries=None):
+        # Writes entries (by default, _entries()) to an index in the test
+        # directory. Returns path to the index.
+        index_path = os.path.join(self.tmp_dir, index_name)
+        this_index = hfs_index.open_index(index_path, IMAGE, volume_index)
+        for _entry in entries or _entries():
+            this_index.add(_entry, _entry.filename or _entry.dirname)
+        this_index.close()
+        return index_path
+
+    def test_sqlite(self):
+        _db = sqlite3.connect(self._index('index.db'))
+        self.assertEqual(
+            _db.execute('SELECT image, volume, cnid, name_type, path, ' +
+                        'name, size, crtime, mtime, libmagic ' +
+                        'FROM files ORDER BY cnid').fetchall(),
+            [(os.path.abspath(IMAGE), 0, 2, 'd', ':Folder', 'Folder', None,
+              '1995-11-23T19:33:20', '1995-11-23T19:33:20', None),
+             (os.path.abspath(IMAGE), 0, 16, 'r', ':Folder:File 1',
+              'File 1', 1, '1995-11-23T19:33:20', None, 'ASCII text')])
+        self.assertEqual(
+            _db.execute('SELECT cnid, fork, digest, value FROM hashes ' +
+                        'ORDER BY fork').fetchall(),
+            [(16, 'data', 'md5', '{0:032x}'.format(1)),
+             (16, 'rsrc', 'md5', '0' * 32)])
+        self.assertEqual(
+            sorted(_row[0] for _row in _db.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index'")),
+            sorted(_index_name for _index_name, _index_on
+                   in hfs_index.INDEXES))
+        _db.close()
+
+    def test_sqlite_replaces_volume(self):
+        self._index('index.db', 0, _entries(5))
+        self._index('index.db', 1, _entries(3))
+        with mock.patch('hfs_index.INSERT_EVERY', 2):
+            index_path = self._index('index.db', 0, _entries(4))
+        _db = sqlite3.connect(index_path)
+        self.assertEqual(_db.execute('SELECT volume, COUNT(*) FROM files ' +
+                                     'GROUP BY volume').fetchall(),
+                         [(0, 4), (1, 3)])
+        self.assertEqual(_db.execute('SELECT volume, COUNT(*) FROM hashes ' +
+                                     'GROUP BY volume').fetchall(),
+                         [(0, 4), (1, 3)])
+        _db.close()
+
+    def test_jsonl(self):
+        self._index('index.jsonl')
+        index_path = self._index('index.jsonl', 1)  # Appended to
+        with open(index_path, encoding='utf-8') as index_file:
+            _rows = [json.loads(_line) for _line in index_file]
+        self.assertEqual([(_row['volume'], _row['cnid']) for _row in _rows],
+                         [(0, 2), (0, 16), (1, 2), (1, 16)])
+        self.assertEqual(_rows[1]['hashes'], {'md5': '{0:032x}'.format(1)})
+        self.assertEqual(_rows[1]['rsrc_hashes'], {'md5': '0' * 32})
+        self.assertIsNone(_rows[0]['hashes'])
+        self.assertEqual(_rows[0]['mtime'], '1995-11-23T19:33:20')
+
+    def test_jsonl_concurrent_appends(self):
+        # Lines of processes appending at once are never interleaved
+        index_path = os.path.join(self.tmp_dir, 'index.jsonl')
+        _writers = [multiprocessing.Process(target=_append,
+                                            args=(index_path, _volume,
+                                                  hfs_index.INSERT_EVERY))
+                    for _volume in range(WRITERS)]
+        for _writer in _writers:
+            _writer.start()
+        for _writer in _writers:
+            _writer.join()
+            self.assertEqual(_writer.exitcode, 0)
+        with open(index_path, encoding='utf-8') as index_file:
+            _rows = [json.loads(_line) for _line in index_file]
+        self.assertEqual(len(_rows), WRITERS * hfs_index.INSERT_EVERY)
+        for _volume in range(WRITERS):
+            self.assertEqual([_row['cnid'] for _row in _rows
+                              if _row['volume'] == _volume],
+                             [2] + list(range(16, 15 +
+                                              hfs_index.INSERT_EVERY)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+#
+# Tests of hfs_journal, and of resuming an interrupted run from it, on
+# synthetic disk images (see hfs_image).
+# Run from this directory with: python3 -m unittest hfs_journal_tests
+
+import io
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+from unittest import mock
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'hfs2dfxml'))
+import hfs2dfxml
+import hfs_journal
+import hfs_image
+from hfs_image import ROOT_CNID
+
+FILE_COUNT = 8
+OPTIONS = hfs2dfxml.HFSOptions(magic=False)  # libmagic is not under test
+FORK_RES = hfs2dfxml._fork_res  # Hashes forks, whether patched or not
+
+
+class Interrupted(Exception):
+    pass
+
+
+def _volume_bytes():
+    # Returns the test volume: FILE_COUNT files with a data fork each,
+    # and one with a resource fork too.
+    volume = hfs_image.HFSImage(b'Journal Volume')
+    for _num in range(FILE_COUNT):
+        volume.add_file(ROOT_CNID, 'file {0}'.format(_num).encode('ascii'),
+                        data=bytes([_num]) * (700 * (_num + 1)),
+                        rsrc=b'R' * 300 if _num == 0 else b'')
+    return volume.build()
+
+
+def _fileobjs(dfxml_text):
+    # Returns list of the fileobject elements of DFXML, as text.
+    return [ET.tostring(_elem) for _elem in ET.fromstring(dfxml_text).iter()
+            if _elem.tag.endswith('fileobject')]
+
+
+class HashJournalTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='hfs_journal_')
+        self.image_path = os.path.join(self.tmp_dir, 'test.img')
+        with open(self.image_path, 'wb') as image_file:
+            image_file.write(_volume_bytes())
+        self.journal_path = os.path.join(self.tmp_dir, 'test.xml.journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _journal(self, resume=True, use_magic=False, digests=('md5',)):
+        return hfs_journal.HashJournal(self.journal_path, self.image_path,
+                                       use_magic, resume, digests=digests)
+
+    def _run(self, fork_res=FORK_RES):
+        # Writes DFXML of the test image with the journal, hashing forks
+        # with fork_res. Returns the DFXML.
+        dfxml_fh = io.StringIO()
+        with mock.patch('hfs2dfxml._fork_res', side_effect=fork_res):
+            hfs2dfxml.hfs2dfxml_stream(self.image_path, dfxml_fh, 'classic',
+                                       OPTIONS.replace(resume=True),
+                                       hfs_journal_path=self.journal_path)
+        return dfxml_fh.getvalue()
+
+    def test_resume(self):
+        with self._journal(resume=False) as journal:
+            journal.put(16, 'data', 700, 0, None, {'md5': 'aa'})
+            journal.put(17, 'data', 1400, 0, None, None)  # Failed hash
+        with self._journal() as journal:
+            self.assertEqual(journal.get(16, 'data', 700, 0),
+                             (None, {'md5': 'aa'}))
+            self.assertIsNone(journal.get(16, 'data', 700, 1))
+            self.assertIsNone(journal.get(17, 'data', 1400, 0))
+        with self._journal(resume=False) as journal:
+            self.assertIsNone(journal.get(16, 'data', 700, 0))
+
+    def test_torn_line_dropped(self):
+        with self._journal(resume=False) as journal:
+            journal.put(16, 'data', 700, 0, None, {'md5': 'aa'})
+            journal.put(17, 'data', 1400, 0, None, {'md5': 'bb'})
+        with open(self.journal_path, 'rb+') as journalfile:
+            journalfile.truncate(os.path.getsize(self.journal_path) - 10)
+        with self._journal() as journal:
+            self.assertIsNotNone(journal.get(16, 'data', 700, 0))
+            self.assertIsNone(journal.get(17, 'data', 1400, 0))
+        with open(self.journal_path) as journalfile:
+            self.assertEqual(len(journalfile.readlines()), 2)
+
+    def test_mismatched_header_refused(self):
+        with self._journal(resume=False) as journal:
+            journal.put(16, 'data', 700, 0, None, {'md5': 'aa'})
+        for _other in ({'use_magic': True}, {'digests': ('md5', 'sha1')}):
+            with self.assertRaises(SystemExit):
+                self._journal(**_other)
+        with open(self.journal_path) as journalfile:
+            _header = json.loads(journalfile.readline())
+        _header['image'] = '0' * 40  # Written for another image
+        with open(self.journal_path, 'w') as journalfile:
+            journalfile.write(json.dumps(_header) + '\n')
+        with self.assertRaises(SystemExit):
+            self._journal()
+
+    def test_interrupted_run_resumed(self):
+        _complete = self._run()
+        self.assertFalse(os.path.exists(self.journal_path))  # Once done
+        _hashed = []
+
+        def _interrupted(*args, **kwargs):
+            if len(_hashed) == FILE_COUNT // 2:
+                raise Interrupted()
+            _hashed.append(args)
+            return FORK_RES(*args, **kwargs)
+
+        with self.assertRaises(Interrupted):
+            self._run(_interrupted)
+        with open(self.journal_path) as journalfile:
+            _journaled = len(journalfile.readlines()) - 1  # Less header
+        self.assertGreater(_journaled, 0)
+        _rehashed = []
+
+        def _counted(*args, **kwargs):
+            _rehashed.append(args)
+            return FORK_RES(*args, **kwargs)
+
+        self.assertEqual(_fileobjs(self._run(_counted)), _fileobjs(_complete))
+        # Every fork is hashed once: only the rest on resume
+        self.assertEqual(len(_rehashed), FILE_COUNT + 1 - _journaled)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+#
+# Tests of hfs_native on synthetic disk images (see hfs_image).
+# Run from this directory with: python3 -m unittest hfs_native_tests
+
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'hfs2dfxml'))
+import hfs_native
+import hfs_image
+from hfs_image import ROOT_CNID
+
+CONTENTS = bytes(range(256)) * 40  # 10240 bytes, 20 allocation blocks
+
+
+def _write_image(image_bytes):
+    # Returns path to a temporary file holding image_bytes.
+    _fd, image_path = tempfile.mkstemp(suffix='.img', prefix='hfs_native_')
+    with os.fdopen(_fd, 'wb') as image_file:
+        image_file.write(image_bytes)
+    return image_path
+
+
+def _volume():
+    # Returns (HFSImage, dict of name: CNID) of the test volume.
+    volume = hfs_image.HFSImage(b'Test Volume')
+    cnids = {}
+    cnids['Alpha'] = volume.add_dir(ROOT_CNID, b'Alpha',
+                                    create_date=2900000000,
+                                    modify_date=2900000100)
+    cnids['Beta'] = volume.add_file(ROOT_CNID, b'Beta', data=b'beta\r' * 300,
+                                    rsrc=b'R' * 700, file_type=b'APPL',
+                                    creator=b'BETA', create_date=2950000000,
+                                    modify_date=2950003600, locked=True,
+                                    finder_flags=0x4000)
+    cnids['Gamma'] = volume.add_dir(ROOT_CNID, b'Gamma', finder_flags=0x4000)
+    cnids['Inner'] = volume.add_dir(cnids['Alpha'], b'Inner')
+    cnids['deep'] = volume.add_file(cnids['Inner'], b'deep', data=b'x' * 5000,
+                                    file_type=b'????', creator=b'????')
+    for _num in range(12):  # Enough for more than one catalog leaf
+        _name = 'file {0:02d}'.format(_num)
+        cnids[_name] = volume.add_file(cnids['Alpha'], _name.encode('ascii'),
+                                       data=bytes([_num]) * (100 * _num),
+                                       create_date=0, modify_date=0)
+    cnids['Fragmented'] = volume.add_file(cnids['Gamma'], b'Fragmented',
+                                          data=CONTENTS, data_extents=7,
+                                          rsrc=CONTENTS[:3000],
+                                          rsrc_extents=5)
+    cnids['Split'] = volume.add_file(cnids['Gamma'], b'Split',
+                                     data=CONTENTS[::-1], data_extents=4)
+    return volume, cnids
+
+
+class HFSNativeTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        volume, cls.cnids = _volume()
+        cls.volume_bytes = volume.build()
+        cls.other_bytes = hfs_image.HFSImage(b'Other').build()
+        cls.image_path = _write_image(cls.volume_bytes)
+        cls.map_path = _write_image(hfs_image.apple_partition_map(
+            [(b'First', b'Apple_HFS', cls.volume_bytes),
+             (b'Driver', b'Apple_Driver43', b'\x00' * 4096),
+             (b'Second', b'Apple_HFS', cls.other_bytes)]))
+
+    @classmethod
+    def tearDownClass(cls):
+        os.unlink(cls.image_path)
+        os.unlink(cls.map_path)
+
+    def setUp(self):
+        self.vol = hfs_native.HFSVolume(self.image_path)
+        self.entries = {_entry.filename or _entry.dirname: _entry
+                        for _entry in self.vol.walk()}
+
+    def tearDown(self):
+        self.vol.close()
+
+    def test_volume_header(self):
+        self.assertEqual(self.vol.name, 'Test Volume')
+        self.assertEqual(self.vol.file_count, 16)
+        self.assertEqual(self.vol.dir_count, 3)
+        self.assertEqual(self.vol.alloc_block_size, 512)
+
+    def test_catalog_has_index_nodes(self):
+        self.assertGreaterEqual(self.vol.catalog_tree.depth, 2)
+
+    def test_walk_order(self):
+        # Each directory's entries in catalog order, then its
+        # subdirectories depth-first, as hls -RU lists them.
+        self.assertEqual(
+            [(_entry.filename or _entry.dirname)
+             for _entry in self.vol.walk()],
+            [':Alpha', ':Beta', ':Gamma'] +
+            [':Alpha:file {0:02d}'.format(_num) for _num in range(12)] +
+            [':Alpha:Inner', ':Alpha:Inner:deep',
+             ':Gamma:Fragmented', ':Gamma:Split'])
+
+    def test_walk_directory_fields(self):
+        alpha = self.entries[':Alpha']
+        self.assertEqual(alpha.cnid, self.cnids['Alpha'])
+        self.assertEqual(alpha.name_type, 'd')
+        self.assertIsNone(alpha.filename)
+        self.assertEqual(alpha.crtime, datetime(1995, 11, 23, 19, 33, 20))
+        self.assertEqual(alpha.mtime, datetime(1995, 11, 23, 19, 35))
+        self.assertIsNone(alpha.HFSflags)
+        self.assertEqual(self.entries[':Gamma'].HFSflags, 'i')
+
+    def test_walk_file_fields(self):
+        beta = self.entries[':Beta']
+        self.assertEqual(beta.cnid, self.cnids['Beta'])
+        self.assertEqual(beta.name_type, 'r')
+        self.assertEqual(beta.filesize, 1500)
+        self.assertEqual(beta.HFSrsrcsize, 700)
+        self.assertEqual(beta.HFStype_creator, 'APPL/BETA')
+        self.assertEqual(beta.HFSlocked, '1')
+        self.assertEqual(beta.HFSflags, 'i')
+        self.assertEqual(beta.crtime, datetime(1997, 6, 24, 12, 26, 40))
+        self.assertEqual(beta.mtime, datetime(1997, 6, 24, 13, 26, 40))
+        self.assertIsNone(beta.hashes)
+        deep = self.entries[':Alpha:Inner:deep']
+        self.assertIsNone(deep.HFStype_creator)  # ????/????
+        self.assertIsNone(deep.HFSlocked)
+        self.assertEqual(deep.HFSrsrcsize, 0)
+        self.assertEqual(deep.rsrc_runs, ())
+        undated = self.entries[':Alpha:file 00']
+        self.assertIsNone(undated.crtime)
+        self.assertIsNone(undated.mtime)
+        self.assertEqual(undated.filesize, 0)
+        self.assertEqual(undated.data_runs, ())
+
+    def _read(self, fork_runs, read_size=hfs_native.READ_SIZE):
+        return b''.join(bytes(_chunk) for _chunk in
+                        self.vol.read_runs(fork_runs, read_size))
+
+    def test_fork_runs_contiguous_fork(self):
+        beta = self.entries[':Beta']
+        self.assertEqual(len(beta.data_runs), 1)
+        file_offset, fs_offset, img_offset, length = beta.data_runs[0]
+        self.assertEqual((file_offset, length), (0, 1500))
+        self.assertEqual(fs_offset, img_offset)  # Bare volume
+        self.assertEqual(self._read(beta.data_runs), b'beta\r' * 300)
+        self.assertEqual(self._read(beta.rsrc_runs), b'R' * 700)
+
+    def test_fork_runs_overflow_extents(self):
+        # Three extents from the catalog record, four from two extents
+        # overflow records.
+        fragmented = self.entries[':Gamma:Fragmented']
+        self.assertEqual(len(fragmented.data_runs), 7)
+        self.assertEqual(len(fragmented.rsrc_runs), 5)
+        _file_offset = 0
+        for file_offset, fs_offset, img_offset, length in \
+                fragmented.data_runs:
+            self.assertEqual(file_offset, _file_offset)
+            _file_offset += length
+        self.assertEqual(_file_offset, len(CONTENTS))
+        # Not contiguous, so each run is really a separate extent
+        for _run, _next_run in zip(fragmented.data_runs,
+                                   fragmented.data_runs[1:]):
+            self.assertNotEqual(_run[2] + _run[3], _next_run[2])
+        self.assertEqual(self._read(fragmented.data_runs), CONTENTS)
+        self.assertEqual(self._read(fragmented.rsrc_runs), CONTENTS[:3000])
+
+    def test_fork_runs_overflow_of_other_files(self):
+        split = self.entries[':Gamma:Split']
+        self.assertEqual(len(split.data_runs), 4)
+        self.assertEqual(self._read(split.data_runs), CONTENTS[::-1])
+
+    def test_read_runs_in_chunks(self):
+        fragmented = self.entries[':Gamma:Fragmented']
+        # Chunks are released once the next is read, so copy each
+        _chunks = [bytes(_chunk) for _chunk in
+                   self.vol.read_runs(fragmented.data_runs, 1000)]
+        self.assertTrue(all(len(_chunk) <= 1000 for _chunk in _chunks))
+        self.assertEqual(b''.join(_chunks), CONTENTS)
+
+    def test_read_runs_not_covering_fork(self):
+        fragmented = self.entries[':Gamma:Fragmented']
+        self.assertEqual(b''.join(bytes(_chunk) for _chunk in
+                                  self.vol.read_runs(fragmented.data_runs,
+                                                     fork_size=len(
+                                                         CONTENTS))),
+                         CONTENTS)
+        with self.assertRaises(hfs_native.ForkError):
+            list(self.vol.read_runs(fragmented.data_runs[:-1],
+                                    fork_size=len(CONTENTS)))
+
+    def test_truncated_image(self):
+        # The catalog is still walked and other forks read; only the fork
+        # past the end of the image fails.
+        _cut = self.entries[':Gamma:Split'].data_runs[-1][2] + 100
+        cut_path = _write_image(self.volume_bytes[:_cut])
+        try:
+            with hfs_native.HFSVolume(cut_path) as cut_vol:
+                cut_entries = {_entry.filename or _entry.dirname: _entry
+                               for _entry in cut_vol.walk()}
+                self.assertEqual(sorted(cut_entries), sorted(self.entries))
+                self.assertEqual(b''.join(bytes(_chunk) for _chunk in
+                                          cut_vol.read_runs(
+                                              cut_entries[':Beta'].data_runs)),
+                                 b'beta\r' * 300)
+                with self.assertRaises(hfs_native.ForkError):
+                    for _chunk in cut_vol.read_runs(
+                                      cut_entries[':Gamma:Split'].data_runs):
+                        pass
+        finally:
+            os.unlink(cut_path)
+
+    def test_read_head_and_tail(self):
+        fragmented = self.entries[':Gamma:Fragmented']
+        self.assertEqual(self.vol.read_head(fragmented.data_runs, 3000),
+                         CONTENTS[:3000])
+        self.assertEqual(self.vol.read_tail(fragmented.data_runs, 3000),
+                         CONTENTS[-3000:])
+        self.assertEqual(self.vol.read_head(fragmented.data_runs, 20000),
+                         CONTENTS)
+
+    def test_partition_offsets_bare_volume(self):
+        self.assertEqual(hfs_native._partition_offsets(self.volume_bytes),
+                         [(0, len(self.volume_bytes), None)])
+        self.assertEqual(hfs_native._partition_offsets(b'\x00' * 4096), [])
+
+    def test_partition_offsets_partition_map(self):
+        # Driver descriptor, then a map of four entries (the map itself,
+        # two HFS partitions and a driver between them)
+        _first = 5 * hfs_image.SECTOR_SIZE
+        _second = _first + len(self.volume_bytes) + 4096
+        self.assertEqual(hfs_native.partitions(self.map_path),
+                         [(_first, len(self.volume_bytes), 'First'),
+                          (_second, len(self.other_bytes), 'Second')])
+
+    def test_block_geometry(self):
+        # Allocation blocks of a bare volume; sectors of the whole image
+        # for a partition map
+        self.assertEqual(hfs_native.block_geometry(self.image_path),
+                         (512, self.vol.alloc_blocks))
+        self.assertEqual(hfs_native.block_geometry(self.map_path),
+                         (512, os.path.getsize(self.map_path) // 512))
+
+    def test_partition_volumes(self):
+        _first, _second = [_offset for _offset, _length, _name in
+                           hfs_native.partitions(self.map_path)]
+        with hfs_native.HFSVolume(self.map_path) as first_vol:
+            self.assertEqual(first_vol.offset, _first)
+            self.assertEqual(first_vol.name, 'Test Volume')
+            beta = [_entry for _entry in first_vol.walk()
+                    if _entry.filename == ':Beta'][0]
+            self.assertEqual(beta.data_runs[0][2] - beta.data_runs[0][1],
+                             _first)
+            self.assertEqual(b''.join(bytes(_chunk) for _chunk in
+                                      first_vol.read_runs(beta.data_runs)),
+                             b'beta\r' * 300)
+        with hfs_native.HFSVolume(self.map_path, _second) as second_vol:
+            self.assertEqual(second_vol.name, 'Other')
+            self.assertEqual(list(second_vol.walk()), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+#
+# Tests of hfs_triage, and of the JSON lines hfs2dfxml writes with it,
+# on synthetic disk images (see hfs_image).
+# Run from this directory with: python3 -m unittest hfs_triage_tests
+
+import io
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'hfs2dfxml'))
+import hfs2dfxml
+import hfs_triage
+import hfs_image
+from hfs_image import ROOT_CNID, SECTOR_SIZE
+
+DATE = 2950000000  # 1997-06-24T12:26:40
+
+
+def _volume_bytes(name, files):
+    # Returns volume with a folder of the given number of files.
+    volume = hfs_image.HFSImage(name, create_date=DATE, modify_date=DATE)
+    _folder = volume.add_dir(ROOT_CNID, b'Folder')
+    for _num in range(files):
+        volume.add_file(_folder, 'File {0}'.format(_num).encode('ascii'),
+                        data=b'x' * 1000)
+    return volume.build()
+
+
+class TriageTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp(prefix='hfs_triage_')
+        cls.first_bytes = _volume_bytes(b'First', 3)
+        cls.second_bytes = _volume_bytes(b'Second', 1)
+        cls.map_bytes = hfs_image.apple_partition_map(
+            [(b'First', b'Apple_HFS', cls.first_bytes),
+             (b'Driver', b'Apple_Driver43', b'\x00' * 4096),
+             (b'Second', b'Apple_HFS', cls.second_bytes)])
+        cls.bare_path = cls._write('bare.img', cls.first_bytes)
+        cls.map_path = cls._write('map.img', cls.map_bytes)
+        # Partition map intact, second volume cut off before its MDB
+        cls.cut_path = cls._write('cut.img', cls.map_bytes[:-len(
+                                      cls.second_bytes) + SECTOR_SIZE])
+        cls.text_path = cls._write('text.img', b'Not a disk image.\n' * 100)
+        cls.missing_path = os.path.join(cls.tmp_dir, 'missing.img')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    @classmethod
+    def _write(cls, image_name, image_bytes):
+        image_path = os.path.join(cls.tmp_dir, image_name)
+        with open(image_path, 'wb') as image_file:
+            image_file.write(image_bytes)
+        return image_path
+
+    def test_bare_volume(self):
+        image_summary = hfs_triage.triage(self.bare_path)
+        self.assertIsNone(image_summary['error'])
+        self.assertFalse(image_summary['partition_map'])
+        self.assertEqual(image_summary['size'], len(self.first_bytes))
+        vol_summary, = image_summary['volumes']
+        self.assertEqual(vol_summary['name'], 'First')
+        self.assertEqual(vol_summary['created'], '1997-06-24T12:26:40')
+        self.assertEqual(vol_summary['modified'], '1997-06-24T12:26:40')
+        self.assertEqual((vol_summary['files'], vol_summary['folders']),
+                         (3, 1))
+        self.assertIsNone(vol_summary['partition'])
+        self.assertEqual(vol_summary['partition_offset'], 0)
+        self.assertFalse(vol_summary['locked'])
+        self.assertEqual(vol_summary['used_bytes'] +
+                         vol_summary['free_bytes'],
+                         vol_summary['block_count'] *
+                         vol_summary['block_size'])
+
+    def test_partition_map(self):
+        image_summary = hfs_triage.triage(self.map_path)
+        self.assertIsNone(image_summary['error'])
+        self.assertTrue(image_summary['partition_map'])
+        self.assertEqual([(_vol['partition'], _vol['name'], _vol['files'],
+                           _vol['partition_length'])
+                          for _vol in image_summary['volumes']],
+                         [(1, 'First', 3, len(self.first_bytes)),
+                          (2, 'Second', 1, len(self.second_bytes))])
+        _offsets = [_vol['partition_offset']
+                    for _vol in image_summary['volumes']]
+        self.assertEqual(self.map_bytes[_offsets[1]:_offsets[1] +
+                                        len(self.second_bytes)],
+                         self.second_bytes)
+
+    def test_unreadable(self):
+        for image_path in (self.cut_path, self.text_path,
+                           self.missing_path):
+            image_summary = hfs_triage.triage(image_path)
+            self.assertIsNotNone(image_summary['error'], msg=image_path)
+        # Volumes read before the error are kept
+        self.assertEqual([_vol['name'] for _vol in
+                          hfs_triage.triage(self.cut_path)['volumes']],
+                         ['First'])
+
+    def test_triage_lines(self):
+        # One JSON line per image, in order; unreadable images have the
+        # error set, and do not stop the others
+        _images = [self.map_path, self.text_path, self.missing_path,
+                   self.bare_path]
+        for triage_jobs in (1, 2):
+            triage_output = io.StringIO()
+            triage_summary = hfs2dfxml.hfs2dfxml_triage(_images,
+                                                        triage_output,
+                                                        triage_jobs)
+            _lines = [json.loads(_line)
+                      for _line in triage_output.getvalue().splitlines()]
+            self.assertEqual([_line['image'] for _line in _lines], _images)
+            self.assertEqual([_line['error'] is None for _line in _lines],
+                             [True, False, False, True])
+            self.assertIn('No HFS volume found', _lines[1]['error'])
+            self.assertEqual(_lines[2]['volumes'], [])
+            self.assertEqual(triage_summary,
+                             {'images': 4, 'failed': 2, 'volumes': 3,
+                              'files': 7, 'folders': 3,
+                              'used_bytes': sum(
+                                  _vol['used_bytes'] for _line in _lines
+                                  for _vol in _line['volumes'])})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+#
+# Tests of hfs_writer, on fileobjects rendered as the DFXML Bindings
+# would render them.
+# Run from this directory with: python3 -m unittest hfs_writer_tests
+
+import io
+import os
+import re
+import sys
+import copy
+import shutil
+import subprocess
+import unittest
+import xml.etree.ElementTree as ET
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'hfs2dfxml'))
+import hfs_writer
+from hfs_writer import HFS_NS
+
+PATTERNLINE = re.compile(r'^( *)(</?[^ >/]+|[^<]*)')  # Indent, tag
+MD5 = 'd41d8cd98f00b204e9800998ecf8427e'
+BLAKE2B = ('786a02f742015903c6c6fd852552d272912f4740e15847618a86e217f71f5419'
+           'd25e1031afee585313896444934eb04b903a685b1448b755d56f701afe9be2ce')
+
+
+class _Rendered(object):
+    # Stands in for a DFXML Bindings object, rendering a fixed element.
+
+    def __init__(self, this_elem):
+        self._elem = this_elem
+
+    def to_Element(self):
+        return copy.deepcopy(self._elem)
+
+
+def _element(tag, attributes=None, children=()):
+    # Returns Element with the given attributes and children, each
+    # (tag, text) or an Element.
+    this_elem = ET.Element(tag, attributes or {})
+    for _child in children:
+        if isinstance(_child, tuple):
+            ET.SubElement(this_elem, _child[0]).text = _child[1]
+        else:
+            this_elem.append(_child)
+    return this_elem
+
+
+def _fileobject(**changes):
+    # Returns a known fileobject, with the given children changed.
+    _children = [('filename', ':Folder:File'), ('name_type', 'r'),
+                 ('filesize', '1234'), ('inode', '16'),
+                 ('mtime', '1995-11-23T19:33:20'),
+                 ('crtime', '1995-11-23T19:33:20')]
+    _children = [(_tag, changes.get(_tag, _text))
+                 for _tag, _text in _children]
+    _hfs_digest = _element('{{{0}}}hashdigest'.format(HFS_NS),
+                           {'type': 'blake2b'})
+    _hfs_digest.text = changes.get('blake2b', BLAKE2B)
+    _byte_runs = _element('byte_runs', {}, [
+        _element('byte_run', {'file_offset': '0', 'img_offset': '4096',
+                              'len': changes.get('len', '1234')})])
+    _md5 = _element('hashdigest', {'type': 'md5'})
+    _md5.text = changes.get('md5', MD5)
+    return _Rendered(_element('fileobject', {}, _children +
+                              [_hfs_digest, _byte_runs, _md5]))
+
+
+def _dfxml(indent, fileobjs=2):
+    # Returns DFXML of a volume with fileobjs copies of the known
+    # fileobject, written with the given indent.
+    _root = _Rendered(_element('dfxml', {'version': '1.1.1'}, [
+        _element('metadata', {}, [('{http://purl.org/dc/elements/1.1/}type',
+                                   'Disk Image')]),
+        _element('source', {}, [('image_filename', 'test.img')])]))
+    output_fh = io.StringIO()
+    with hfs_writer.DFXMLStreamWriter(output_fh, _root,
+                                      indent=indent) as writer:
+        writer.open_volume(_Rendered(_element('volume', {}, [
+            ('block_size', '512'), ('ftype_str', 'hfs')])))
+        for _num in range(fileobjs):
+            writer.write_fileobject(_fileobject())
+        writer.close_volume()
+    return output_fh.getvalue()
+
+
+def _layout(dfxml_text):
+    # Returns list of (indentation, opening or closing tag, or text) of
+    # each line of DFXML; attributes are left out, as xmllint orders
+    # namespace declarations first and writes empty elements as <a/>.
+    return [PATTERNLINE.match(_line).groups()
+            for _line in dfxml_text.splitlines()]
+
+
+class WriterTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        ET.register_namespace('hfs', HFS_NS)  # As hfs2dfxml does
+
+    def test_namespaces_declared_once(self):
+        _written = _dfxml(None)
+        self.assertEqual(_written.count('xmlns:hfs='), 1)
+        _root = ET.fromstring(_written)
+        self.assertEqual(len(_root.findall('volume/fileobject')), 2)
+        self.assertEqual(
+            _root.find('volume/fileobject/{{{0}}}hashdigest'.format(
+                HFS_NS)).text, BLAKE2B)
+
+    def test_unindented(self):
+        _written = _dfxml(None)
+        self.assertNotIn('\n', _written)
+        self.assertEqual(
+            ET.canonicalize(_dfxml(hfs_writer.INDENT), strip_text=True),
+            ET.canonicalize(_written, strip_text=True))
+
+    @unittest.skipUnless(shutil.which('xmllint'), 'xmllint not found')
+    def test_indent_matches_xmllint(self):
+        _formatted = subprocess.run(['xmllint', '--format', '-'],
+                                    input=_dfxml(None).encode('utf-8'),
+                                    stdout=subprocess.PIPE,
+                                    check=True).stdout.decode('utf-8')
+        _indented = _dfxml(hfs_writer.INDENT)
+        self.assertEqual(_layout(_indented), _layout(_formatted))
+        self.assertIn('\n      <hfs:hashdigest type="blake2b">', _indented)
+        self.assertIn('\n        <byte_run ', _indented)
+        self.assertTrue(_indented.endswith('</volume>\n</dfxml>\n'))
+
+    def test_check_accepts(self):
+        hfs_writer.check_fileobject(_fileobject().to_Element())
+
+    def test_check_rejects(self):
+        for _changes in ({'filesize': '-1'}, {'filesize': '12a'},
+                         {'inode': ''}, {'filename': ''},
+                         {'name_type': 'file'},
+                         {'mtime': '23 Nov 1995'},
+                         {'crtime': '1995-11-23 19:33:20'},
+                         {'md5': MD5[:-1]}, {'md5': MD5.upper()},
+                         {'blake2b': MD5}, {'len': '0x10'}):
+            with self.assertRaises(SystemExit, msg=_changes):
+                hfs_writer.check_fileobject(
+                    _fileobject(**_changes).to_Element())
+
+    def test_render_checked(self):
+        with self.assertRaises(SystemExit):
+            hfs_writer.render_fileobject(_fileobject(filesize='big'),
+                                         {'hfs': HFS_NS}, check=True)
+
+
+if __name__ == '__main__':
+    unittest.main()